@@ -62,6 +62,7 @@ def get_live_database(conn: connection) -> pd.DataFrame:
     yesterday = datetime.now() - timedelta(days=1
                                            )
     yesterday_date = yesterday.strftime("%Y-%m-%d")
+    today_date = datetime.now().strftime("%Y-%m-%d")
 
     query = """
     SET search_path TO service_data;
@@ -93,13 +94,15 @@ def get_live_database(conn: connection) -> pd.DataFrame:
         LEFT JOIN station s ON sd.origin_station_id = s.station_id
         LEFT JOIN station s2 ON sd.destination_station_id = s2.station_id
         LEFT JOIN delay_details dd ON sd.service_details_id = dd.service_details_id
+            AND sd.run_date = dd.run_date
         LEFT JOIN cancellation cn ON sd.service_details_id = cn.service_details_id
+            AND sd.run_date = cn.run_date
         LEFT JOIN cancel_code cc ON cn.cancel_code_id = cc.cancel_code_id
-        WHERE DATE(sd.run_date) = %s;
+        WHERE sd.run_date >= %s AND sd.run_date < %s;
         """
 
     with conn.cursor() as cur:
-        cur.execute(query, (yesterday_date,))
+        cur.execute(query, (yesterday_date, today_date))
         data = cur.fetchall()
 
     data_df = pd.DataFrame(data, columns=CSV_COLUMNS)
@@ -108,6 +111,64 @@ def get_live_database(conn: connection) -> pd.DataFrame:
     return data_df
 
 
+SUMMARY_QUERIES = {
+    "station": """
+    SET search_path TO service_data;
+    SELECT
+        s.station_name AS origin_station_name,
+        dss.total_services,
+        dss.delayed_services,
+        dss.total_lateness,
+        dss.total_lateness::FLOAT / NULLIF(dss.delayed_services, 0) AS arrival_lateness,
+        dss.cancellations AS cancellation_count,
+        dss.bus_replacements AS bus_replacement_count
+        FROM daily_station_summary dss
+        JOIN station s ON dss.station_id = s.station_id
+        WHERE dss.run_day = %s;
+        """,
+    "company": """
+    SET search_path TO service_data;
+    SELECT
+        c.company_name,
+        dcs.total_services,
+        dcs.total_lateness::FLOAT / NULLIF(dcs.delayed_services, 0) AS arrival_lateness,
+        dcs.cancellations AS cancellation_count,
+        dcs.bus_replacements AS bus_replacement_count
+        FROM daily_company_summary dcs
+        JOIN company c ON dcs.company_id = c.company_id
+        WHERE dcs.run_day = %s;
+        """,
+    "cancel_code": """
+    SET search_path TO service_data;
+    SELECT
+        c.company_name,
+        cc.code AS cancel_code,
+        cc.reason AS cancel_reason,
+        dccs.cancellations AS frequency
+        FROM daily_cancel_code_summary dccs
+        JOIN company c ON dccs.company_id = c.company_id
+        JOIN cancel_code cc ON dccs.cancel_code_id = cc.cancel_code_id
+        WHERE dccs.run_day = %s;
+        """
+}
+
+
+def get_daily_summary(conn: connection, summary: str) -> pd.DataFrame:
+    """
+    Retrieve the previous day's station, company or cancel code
+    rollup, maintained by the load step, as a DataFrame.
+    """
+    yesterday = datetime.now() - timedelta(days=1)
+    yesterday_date = yesterday.strftime("%Y-%m-%d")
+
+    with conn.cursor() as cur:
+        cur.execute(SUMMARY_QUERIES[summary], (yesterday_date,))
+        data = cur.fetchall()
+        columns = [column[0] for column in cur.description]
+
+    return pd.DataFrame(data, columns=columns)
+
+
 def dashboard_header(page:str) -> None:
     """Creates a header for the dashboard and title on tab."""
 
@@ -127,7 +188,7 @@ def dashboard_header(page:str) -> None:
     st.markdown("---")
 
 
-def first_row_display(data_df: pd.DataFrame) -> None:
+def first_row_display(station_summary: pd.DataFrame) -> None:
     """Controls how the first row figures are displayed for the overall data."""
     cols = st.columns(3)
     st.markdown(
@@ -140,28 +201,27 @@ def first_row_display(data_df: pd.DataFrame) -> None:
         """,
         unsafe_allow_html=True,
     )
+    total_records = station_summary['total_services'].sum()
+
     with cols[0]:
-        st.metric("TOTAL SERVICES:", len(data_df))
+        st.metric("TOTAL SERVICES:", total_records)
 
     with cols[1]:
-        total_delays = (data_df['arrival_lateness'] > 0).sum()
-        total_records = len(data_df)  # Total number of records
-        percentage_delays = (total_delays / total_records) * 100
+        total_delays = station_summary['delayed_services'].sum()
+        percentage_delays = (total_delays / max(total_records, 1)) * 100
         st.metric("TOTAL DELAYS:",
                   f"{total_delays} ({percentage_delays:.2f}%)")
 
     with cols[2]:
-        total_cancellations = data_df['cancellation_id'].count()
-        percentage_cancellations = (total_cancellations / total_records) * 100
+        total_cancellations = station_summary['cancellation_count'].sum()
+        percentage_cancellations = (total_cancellations / max(total_records, 1)) * 100
         st.metric("TOTAL CANCELLATIONS:", f"{total_cancellations}\
                   ({percentage_cancellations:.2f}%)")
 
 
-def second_row_display(data_df: pd.DataFrame) -> None:
+def second_row_display(station_summary: pd.DataFrame) -> None:
     """Controls how the second row figures are displayed for the overall data."""
 
-    most_cancelled_station = data_df['origin_station_name'].value_counts().idxmax()
-
     cols = st.columns(3)
 
     st.markdown(
@@ -176,19 +236,19 @@ def second_row_display(data_df: pd.DataFrame) -> None:
     )
 
     with cols[0]:
-        most_cancelled_station = data_df['origin_station_name'].value_counts().idxmax()
-        num_cancellations = data_df.loc[data_df['arrival_lateness'].idxmax()]['origin_station_name']
         st.write("MOST DELAYED STATION:",
-                 data_df.loc[data_df['arrival_lateness'].idxmax()]['origin_station_name'])
+                 station_summary.loc[station_summary['arrival_lateness'].idxmax()]
+                 ['origin_station_name'])
 
     with cols[1]:
-        most_cancelled_station = data_df['origin_station_name'].value_counts().idxmax()
-        num_cancellations = data_df['origin_station_name'].value_counts().max()
+        most_cancelled = station_summary.loc[station_summary['cancellation_count'].idxmax()]
         st.write("MOST CANCELLED STATION:",
-                 f"{most_cancelled_station} (Num of cancellations: {num_cancellations})")
+                 f"{most_cancelled['origin_station_name']} "
+                 f"(Num of cancellations: {most_cancelled['cancellation_count']})")
 
     with cols[2]:
-        avg_delay_minutes = round(data_df['arrival_lateness'].mean(), 2)
+        avg_delay_minutes = round(station_summary['total_lateness'].sum()
+                                  / max(station_summary['delayed_services'].sum(), 1), 2)
         st.metric("AVG DELAYS TIME FOR ALL SERVICES:",
                   f"{avg_delay_minutes} MINUTES")
 
@@ -196,7 +256,7 @@ def second_row_display(data_df: pd.DataFrame) -> None:
 
 
 
-def plot_average_delays_by_station(data_df: pd.DataFrame, selected_station) -> None:
+def plot_average_delays_by_station(station_summary: pd.DataFrame, selected_station) -> None:
     """Create a horizontal bar chart showing the average delays per station."""
     st.write('<h2 style="font-size: 24px;">Average delays per station</h2>',
              unsafe_allow_html=True)
@@ -209,11 +269,10 @@ def plot_average_delays_by_station(data_df: pd.DataFrame, selected_station) -> N
         selected_station = selected_station[:max_stations]  # Truncate the list
 
     if len(selected_station) != 0:
-        data_df = data_df[data_df['origin_station_name'].isin(
+        station_summary = station_summary[station_summary['origin_station_name'].isin(
             selected_station)]
 
-    average_delays = data_df.groupby('origin_station_name')[
-        'arrival_lateness'].mean().reset_index()
+    average_delays = station_summary[['origin_station_name', 'arrival_lateness']]
 
     average_delays = average_delays.sort_values(by='arrival_lateness',
                                                 ascending=False).head(max_stations)
@@ -236,7 +295,7 @@ def plot_average_delays_by_station(data_df: pd.DataFrame, selected_station) -> N
     st.markdown("---")
 
 
-def plot_cancellations_per_station(data_df: pd.DataFrame, selected_station) -> None:
+def plot_cancellations_per_station(station_summary: pd.DataFrame, selected_station) -> None:
     """Create a line graph showing the number of cancellations per station."""
 
     st.write('<h2 style="font-size: 24px;"> Number of cancellations per station</h2>',
@@ -250,13 +309,11 @@ def plot_cancellations_per_station(data_df: pd.DataFrame, selected_station) -> N
         selected_station = selected_station[:max_stations]  # Truncate the list
 
     if len(selected_station) != 0:
-        data_df = data_df[data_df['origin_station_name'].isin(
+        station_summary = station_summary[station_summary['origin_station_name'].isin(
             selected_station)]
 
-    cancellations_per_station = data_df[data_df['cancellation_id'].notnull()].groupby(
-        'origin_station_name')['cancellation_id'].count().reset_index()
-    cancellations_per_station = cancellations_per_station.rename(
-        columns={'cancellation_id': 'cancellation_count'})
+    cancellations_per_station = station_summary[station_summary['cancellation_count'] > 0][
+        ['origin_station_name', 'cancellation_count']]
 
     cancellations_per_station = cancellations_per_station.sort_values(
         by='cancellation_count', ascending=False).head(20)
@@ -279,7 +336,7 @@ def plot_cancellations_per_station(data_df: pd.DataFrame, selected_station) -> N
     st.markdown("---")
 
 
-def plot_bus_replacements_per_station(data_df: pd.DataFrame, selected_station) -> None:
+def plot_bus_replacements_per_station(station_summary: pd.DataFrame, selected_station) -> None:
     """Create a donut Altair chart showing the number of bus replacements per station."""
 
     st.write('<h2 style="font-size: 24px;">Number of bus replacements per station</h2>',
@@ -293,13 +350,11 @@ def plot_bus_replacements_per_station(data_df: pd.DataFrame, selected_station) -
         selected_station = selected_station[:max_stations]  # Truncate the list
 
     if len(selected_station) != 0:
-        data_df = data_df[data_df['origin_station_name'].isin(
+        station_summary = station_summary[station_summary['origin_station_name'].isin(
             selected_station)]
 
-    bus_replacements_per_station = data_df[data_df["service_type_name"] == "bus"].groupby(
-        'origin_station_name').size().reset_index(name='bus_replacement_count')
-    bus_replacements_per_station = bus_replacements_per_station.rename(
-        columns={"service_type_name": 'bus_replacement_count'})
+    bus_replacements_per_station = station_summary[station_summary['bus_replacement_count'] > 0][
+        ['origin_station_name', 'bus_replacement_count']]
 
     bus_replacements_per_station = bus_replacements_per_station.sort_values(
         by='bus_replacement_count', ascending=False).head(20)
@@ -418,23 +473,18 @@ def create_scatter_plot_arrival_lateness_vs_scheduled(data_df: pd.DataFrame, sel
     st.markdown("---")
 
 
-def plot_cancel_codes_frequency_with_reasons(data_df):
+def plot_cancel_codes_frequency_with_reasons(cancel_code_summary: pd.DataFrame):
     """Create a bar chart to visualize the frequency of different cancellation codes."""
 
     st.write("""<h2 style="font-size: 24px;"> Frequency of cancellation codes with reasons</h2>""",
              unsafe_allow_html=True)
 
-    data_df['cancel_reason'].fillna('None filled out', inplace=True)
-
-    # Count the frequency of each cancellation code
-    cancel_code_counts = data_df['cancel_code'].value_counts().reset_index()
-    cancel_code_counts.columns = ['cancel_code', 'frequency']
+    cancel_code_summary['cancel_reason'] = cancel_code_summary['cancel_reason'].fillna(
+        'None filled out')
 
-    cancel_reason_df = data_df[['cancel_code',
-                                'cancel_reason']].drop_duplicates()
-
-    merged_df = pd.merge(cancel_code_counts, cancel_reason_df,
-                         on='cancel_code', how='left')
+    # Sum the frequency of each cancellation code across companies
+    merged_df = cancel_code_summary.groupby(['cancel_code', 'cancel_reason'])[
+        'frequency'].sum().reset_index()
 
     merged_df = merged_df.sort_values(by='frequency', ascending=False).head(20)
 
@@ -461,7 +511,7 @@ def sidebar_header(text, color='white') -> None:
         )
 
 
-def plot_most_average_delays_by_company(data_df: pd.DataFrame, selected_company:str) -> None:
+def plot_most_average_delays_by_company(company_summary: pd.DataFrame, selected_company:str) -> None:
     """Create a horizontal bar chart showing the average delays for each company."""
 
     st.write('<h2 style="font-size: 24px;">Average delays for each company.</h2>',
@@ -476,10 +526,9 @@ def plot_most_average_delays_by_company(data_df: pd.DataFrame, selected_company:
         selected_company = selected_company[:max_companies]
 
     if len(selected_company) != 0:
-        data_df = data_df[data_df['company_name'].isin(selected_company)]
+        company_summary = company_summary[company_summary['company_name'].isin(selected_company)]
 
-    average_delays = data_df.groupby('company_name')[
-        'arrival_lateness'].mean().reset_index()
+    average_delays = company_summary[['company_name', 'arrival_lateness']]
 
     average_delays = average_delays.sort_values(by='arrival_lateness',
                                                 ascending=False).head(max_companies)
@@ -502,7 +551,7 @@ def plot_most_average_delays_by_company(data_df: pd.DataFrame, selected_company:
     st.altair_chart(chart, use_container_width=True)
 
 
-def plot_cancellations_by_company(data_df: pd.DataFrame, selected_company: str):
+def plot_cancellations_by_company(company_summary: pd.DataFrame, selected_company: str):
     """Create a bar chart to compare the frequency of cancellations per company."""
 
     st.write('<h2 style="font-size: 24px;">Frequency of cancellations per company</h2>',
@@ -517,10 +566,9 @@ def plot_cancellations_by_company(data_df: pd.DataFrame, selected_company: str):
         selected_company = selected_company[:max_companies]
 
     if len(selected_company) != 0:
-        data_df = data_df[data_df['company_name'].isin(selected_company)]
+        company_summary = company_summary[company_summary['company_name'].isin(selected_company)]
 
-    cancellation_counts = data_df.groupby('company_name')['cancel_code'].count().reset_index()
-    cancellation_counts.columns = ['company_name', 'cancellation_count']
+    cancellation_counts = company_summary[['company_name', 'cancellation_count']]
 
     cancellation_counts = cancellation_counts.sort_values(by='cancellation_count', ascending=False)
 
@@ -578,20 +626,14 @@ def plot_percentage_of_services_reaching_final_destination_by_company(data_df: p
 
 
 
-def plot_cancellations_by_company_and_reason(data_df: pd.DataFrame):
+def plot_cancellations_by_company_and_reason(cancel_code_summary: pd.DataFrame):
     """Create a stacked bar chart to visualize cancellations by company and reason."""
     st.markdown("---")
     st.write('<h2 style="font-size: 24px;">Cancellations and reasons per company</h2>',
              unsafe_allow_html=True)
 
-    # Filter rows with cancellations
-    cancellations = data_df[data_df['cancel_code'].notna()]
-
-    # Group data by company and cancel_reason and count the occurrences
-    company_reason_counts = cancellations.groupby(['company_name', 'cancel_code']).size().reset_index(name='frequency')
-
-    cancel_reasons_df = data_df[['cancel_code', 'cancel_reason']].drop_duplicates()
-    company_reason_counts = company_reason_counts.merge(cancel_reasons_df, on='cancel_code', how='left')
+    company_reason_counts = cancel_code_summary[['company_name', 'cancel_code',
+                                                 'cancel_reason', 'frequency']]
 
     chart = alt.Chart(company_reason_counts).mark_bar().encode(
         x=alt.X('company_name:N', title='Company Name', axis=alt.Axis(labelAngle=-45)),
@@ -629,6 +671,9 @@ if __name__ == "__main__":
     load_dotenv()
     connection = get_db_connection()
     database_df = get_live_database(connection)
+    station_summary = get_daily_summary(connection, "station")
+    company_summary = get_daily_summary(connection, "company")
+    cancel_code_summary = get_daily_summary(connection, "cancel_code")
 
     st.set_page_config(
         page_title="Train Services Monitoring Dashboard", layout="wide")
@@ -647,18 +692,18 @@ if __name__ == "__main__":
 
         select_station = create_multiselect("origin_station_name")
 
-        first_row_display(database_df)
-        second_row_display(database_df)
+        first_row_display(station_summary)
+        second_row_display(station_summary)
 
-        plot_average_delays_by_station(database_df, select_station)
-        plot_cancellations_per_station(database_df, select_station)
+        plot_average_delays_by_station(station_summary, select_station)
+        plot_cancellations_per_station(station_summary, select_station)
         create_scatter_plot_arrival_lateness_vs_scheduled(database_df, select_station)
 
-        plot_bus_replacements_per_station(database_df, select_station)
+        plot_bus_replacements_per_station(station_summary, select_station)
         
         plot_percentage_of_services_reaching_final_destination(database_df, select_station)
             
-        plot_cancel_codes_frequency_with_reasons(database_df)
+        plot_cancel_codes_frequency_with_reasons(cancel_code_summary)
 
     elif page == "COMPANY PAGE":
         dashboard_header("COMPANY")
@@ -666,9 +711,9 @@ if __name__ == "__main__":
 
         select_companies = create_multiselect("company_name")
 
-        plot_most_average_delays_by_company(database_df, select_companies)
+        plot_most_average_delays_by_company(company_summary, select_companies)
         
-        plot_cancellations_by_company_and_reason(database_df)
+        plot_cancellations_by_company_and_reason(cancel_code_summary)
 
-        plot_cancellations_by_company(database_df, select_companies)
+        plot_cancellations_by_company(company_summary, select_companies)
         plot_percentage_of_services_reaching_final_destination_by_company(database_df)
\ No newline at end of file
@@ -3,6 +3,8 @@
 from os import environ
 from os import _Environ
 from datetime import datetime
+from pathlib import Path
+import sys
 
 import altair as alt
 from boto3 import client
@@ -14,6 +16,9 @@ from psycopg2 import connect
 from psycopg2.extensions import connection
 import pandas as pd
 
+sys.path.append(str(Path(__file__).resolve().parents[2] / "incidents pipeline"))
+from subscriptions import add_subscription
+
 
 def subscribe_to_topic(sns: ServiceResource, phone_number: str,
                         operator_code: str) -> None:
@@ -65,8 +70,7 @@ def display_headline_figures(incident_df: DataFrame):
     from the given DataFrame, in columns
     """
     col1, col2, col3, col4 = st.columns(4)
-    idx = incident_df.groupby('incident_num')['incident_version'].idxmax()
-    incident_df = incident_df.loc[idx]
+    incident_df = incident_df.drop_duplicates('incident_num')
     with col1:
         st.metric(f"TOTAL INCIDENTS", incident_df.shape[0])
     with col2:
@@ -95,8 +99,7 @@ def display_active_incidents(data: DataFrame):
     recent incidents, pulled from the database with
     an SQL query.
     """
-    idx = data.groupby('incident_num')['incident_version'].idxmax()
-    data = data.loc[idx]
+    data = data.drop_duplicates('incident_num')
 
     data = data[['incident_num', 'operator_name', 'summary', 'route_name',
                  'link', 'priority_code', 'start_time', 'end_time', 'is_planned']]
@@ -144,8 +147,7 @@ def show_metrics_for_given_operator(sns_client: ServiceResource, operators_dict:
     Displays specific statistics for the
     specified operator
     """
-    idx = incident_df.groupby('incident_num')['incident_version'].idxmax()
-    incident_df = incident_df.loc[idx]
+    incident_df = incident_df.drop_duplicates('incident_num')
     operator_name = st.selectbox('SELECT OPERATOR TO VIEW METRICS FOR', options=operators_dict.keys())
     code = operators_dict.get(operator_name)
     col1, col2, col3, col4 = st.columns(4)
@@ -169,23 +171,32 @@ def create_incident_subscription_form(operator_dict: dict):
     """
     Creates a form which allows users to input
     information and subscribe their number to
-    the relevant SNS topic    
+    the relevant SNS topic, or to a route or
+    station if one is given
     """
     with st.form(clear_on_submit=True, key="subscribe_form"):
         st.subheader("SUBSCRIBE TO GET INCIDENT NOTIFICATIONS")
         phone_number = st.text_input("PHONE NUMBER (INCL. AREA CODE)")
         operator_name = st.selectbox("OPERATOR", options=operator_dict.keys())
+        route_term = st.text_input("OR A ROUTE OR STATION (E.G. READING)")
         code = operator_dict.get(operator_name)
         submit_button = st.form_submit_button("SUBSCRIBE")
         if submit_button:
             print(code, phone_number)
-            subscribe_to_topic(sns_client, phone_number, code)    
+            if route_term.strip():
+                try:
+                    add_subscription(conn, phone_number, route_term)
+                except ValueError as e:
+                    st.error(e)
+            else:
+                subscribe_to_topic(sns_client, phone_number, code)
 
 
 def retrieve_incident_data_as_dataframe(conn: connection) -> DataFrame:
     """
     Connects to the RDS database, selects relevant
-    incident data, and returns it as a DataFrame
+    data for the latest version of each incident,
+    and returns it as a DataFrame
     """
     with conn.cursor() as cur:
 
@@ -205,7 +216,11 @@ def retrieve_incident_data_as_dataframe(conn: connection) -> DataFrame:
             o.customer_satisfaction,
             r.route_name
         FROM
+            current_incident c
+        JOIN
             incident i
+        ON
+            c.incident_id = i.incident_id
         LEFT JOIN
             priority p
         ON
@@ -235,6 +250,22 @@ def retrieve_incident_data_as_dataframe(conn: connection) -> DataFrame:
     return df
 
 
+@st.cache_data(ttl=3600)
+def get_operators_dict(_conn: connection) -> dict:
+    """
+    Returns the code of each operator in the seeded
+    operator table, keyed by operator name, reading
+    the table at most once an hour
+    """
+    with _conn.cursor() as cur:
+        cur.execute("SELECT operator_name, operator_code FROM operator ORDER BY operator_id;")
+        operators = dict(cur.fetchall())
+
+    _conn.commit()
+
+    return operators
+
+
 def set_search_path(conn: connection) -> None:
     """
     Sets the search path of a Database connection
@@ -253,8 +284,7 @@ def bar_graph_avg_incidents_per_day_per_operator(df: DataFrame) -> None:
     average number of incidents per day
     for each operator
     """
-    idx = df.groupby('incident_num')['incident_version'].idxmax()
-    df = df.loc[idx]
+    df = df.drop_duplicates('incident_num')
     
     df['start_time'] = pd.to_datetime(df['start_time'])
 
@@ -280,8 +310,7 @@ def bar_graph_avg_incidents_per_day_per_route(df: DataFrame) -> None:
     average number of incidents per day
     for each route
     """
-    idx = df.groupby('incident_num')['incident_version'].idxmax()
-    df = df.loc[idx]
+    df = df.drop_duplicates('incident_num')
 
     df['start_time'] = pd.to_datetime(df['start_time'])
 
@@ -305,8 +334,7 @@ def bar_graph_to_show_incidents_per_day(incident_df: DataFrame):
     current_time = datetime.now()
     one_month_ago = current_time - pd.DateOffset(months=1)
 
-    idx = incident_df.groupby('incident_num')['incident_version'].idxmax()
-    incident_df = incident_df.loc[idx]
+    incident_df = incident_df.drop_duplicates('incident_num')
     filtered_incident_df = incident_df[(incident_df['start_time'] >= one_month_ago) & (incident_df['start_time'] <= current_time)]
 
     daily_incident_counts = filtered_incident_df.groupby(filtered_incident_df['start_time'].dt.date)['incident_id'].count().reset_index()
@@ -326,8 +354,7 @@ def bar_graph_to_show_incidents_per_day(incident_df: DataFrame):
 
 def scatter_plot_to_show_incident_freq_vs_customer_satisfaction(incident_df: DataFrame):
 
-    idx = incident_df.groupby('incident_num')['incident_version'].idxmax()
-    incident_df = incident_df.loc[idx]
+    incident_df = incident_df.drop_duplicates('incident_num')
 
     operator_stats = incident_df.groupby('operator_name').agg({
         'incident_id': 'count',
@@ -360,37 +387,7 @@ if __name__ == "__main__":
 
     sns_client = generate_sns_client(environ)
 
-    operators_dict = {
-        "London Overground": "LO",
-        "Avanti West Coast": "VT",
-        "c2c": "CC",
-        "Caledonian Sleeper": "CS",
-        "Chiltern Railways": "CH",
-        "CrossCountry": "XC",
-        "East Midlands Railway": "EM",
-        "Elizabeth line": "XR",
-        "Eurostar": "ES",
-        "Gatwick Express": "GX",
-        "Great Northern": "GN",
-        "Southern": "SN",
-        "Thameslink": "TL",
-        "Grand Central": "GC",
-        "Greater Anglia (also operating Stansted Express)": "LE",
-        "Great Western Railway": "GW",
-        "Heathrow Express": "HX",
-        "Hull Trains": "HT",
-        "London North Eastern Railway": "GR",
-        "Lumo": "LD",
-        "Merseyrail": "ME",
-        "Northern Trains (Trading as Northern)": "NT",
-        "ScotRail": "SR",
-        "Southeastern": "SE",
-        "South Western Railway": "SW",
-        "Island Line": "IL",
-        "TransPennine Trains (Trading as TransPennine Express)": "TP",
-        "Transport for Wales Rail": "AW",
-        "West Midlands Trains": "LM"
-    }
+    operators_dict = get_operators_dict(conn)
 
     st.title("DISRUPTION DETECT: VISUALISATIONS")
 
@@ -0,0 +1,130 @@
+"""Acks file: acknowledges incident frames to the broker once they have been committed"""
+
+import logging
+import threading
+
+import stomp
+
+
+def get_ack_id(frame) -> str:
+    """Returns the id a STOMP 1.2 frame is acknowledged by"""
+    return frame.headers.get("ack", frame.headers.get("message-id"))
+
+
+class IncidentAcker:
+    """
+    Holds the ack id of each spooled frame until the frame is
+    done, then acknowledges it. Ready acks are sent together,
+    once flush_every are waiting or every flush_interval_ms, so
+    a frame is only acknowledged after its transaction commits.
+    A duplicate of a frame that is still pending is held with
+    it, so it is not acknowledged before the original
+    """
+
+    def __init__(self, connection: stomp.Connection12, flush_every: int = 50,
+                 flush_interval_ms: float = 100):
+        self.connection = connection
+        self.flush_every = flush_every
+        self.flush_interval_secs = flush_interval_ms / 1000
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+        self.unacked = {}
+        self.pending_keys = {}
+        self.ready = []
+        self.counts = {"acked": 0, "failed": 0, "held_duplicates": 0}
+
+    def start(self) -> None:
+        """Starts the thread that sends acks every interval"""
+        self.thread = threading.Thread(target=self.run, name="incident-acker", daemon=True)
+        self.thread.start()
+
+    def track(self, sequence: int, frame, incident_key: tuple = None) -> None:
+        """
+        Holds a spooled frame's ack id until the frame is done,
+        noting its incident key so duplicates can wait for it
+        """
+        with self.lock:
+            self.unacked[sequence] = (incident_key, [get_ack_id(frame)])
+            if incident_key is not None:
+                self.pending_keys[incident_key] = sequence
+
+    def ack_duplicate(self, incident_key: tuple, frame) -> None:
+        """
+        Holds a duplicate frame's ack id with the original frame
+        if that is still pending, so both are acknowledged once
+        it is done, and otherwise queues the ack straight away
+        """
+        ack_id = get_ack_id(frame)
+        with self.lock:
+            sequence = self.pending_keys.get(incident_key)
+            if sequence is not None:
+                self.unacked[sequence][1].append(ack_id)
+                self.counts["held_duplicates"] += 1
+                return
+        self.queue_acks([ack_id])
+
+    def done(self, sequences: list) -> None:
+        """Queues acks for frames that are done with, and their held duplicates"""
+        ack_ids = []
+        with self.lock:
+            for sequence in sequences:
+                if sequence not in self.unacked:
+                    continue
+                incident_key, frame_ack_ids = self.unacked.pop(sequence)
+                if self.pending_keys.get(incident_key) == sequence:
+                    del self.pending_keys[incident_key]
+                ack_ids.extend(frame_ack_ids)
+        self.queue_acks(ack_ids)
+
+    def forget_all(self) -> None:
+        """
+        Drops every held ack id, as they are no longer valid once
+        the connection has dropped and the broker will redeliver
+        """
+        with self.lock:
+            self.unacked = {}
+            self.pending_keys = {}
+            self.ready = []
+
+    def queue_acks(self, ack_ids: list) -> None:
+        """Adds acks to the next flush, flushing now if enough are waiting"""
+        if not ack_ids:
+            return
+        with self.lock:
+            self.ready.extend(ack_ids)
+            flush_now = len(self.ready) >= self.flush_every
+        if flush_now:
+            self.flush()
+
+    def flush(self) -> None:
+        """Sends every ack that is ready"""
+        with self.lock:
+            ack_ids, self.ready = self.ready, []
+
+        for ack_id in ack_ids:
+            try:
+                self.connection.ack(ack_id)
+                outcome = "acked"
+            except Exception as e:
+                logging.error("Failed to ack frame %s: %s", ack_id, e)
+                outcome = "failed"
+            with self.lock:
+                self.counts[outcome] += 1
+
+    def run(self) -> None:
+        """Flushes acks every interval until stopped"""
+        while not self.stopped.wait(self.flush_interval_secs):
+            self.flush()
+
+    def stop(self) -> None:
+        """Sends the acks that are ready and stops the thread"""
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+        self.flush()
+
+    def stats(self) -> dict:
+        """Returns how many frames are awaiting an ack and the counters"""
+        with self.lock:
+            return {"unacked": len(self.unacked), "ready": len(self.ready), **self.counts}
@@ -0,0 +1,92 @@
+"""Benchmark file: times incident extraction over recorded kb.incidents payloads"""
+
+import argparse
+import time
+from pathlib import Path
+
+from extract_incident_data import (
+    extract_and_transform_incident_data,
+    extract_incident_details,
+    parse_xml_string,
+    namespaces
+)
+
+
+def load_payloads(payload_dir: str) -> list:
+    """
+    Reads every .xml file in the directory,
+    each holding one recorded message body
+    """
+    payloads = [path.read_text() for path in sorted(Path(payload_dir).glob("*.xml"))]
+    if not payloads:
+        raise FileNotFoundError(f"No .xml payloads found in {payload_dir}")
+    return payloads
+
+
+def extract_with_find(root, namespaces: dict) -> dict:
+    """
+    The previous extractor, which searched the whole tree
+    once per field, kept as a baseline to compare against
+    """
+    fields = {"creation_time": "ns3:CreationTime", "incident_number": "ns3:IncidentNumber",
+              "version": "ns3:Version", "planned": "ns3:Planned",
+              "start_time": "ns2:StartTime", "end_time": "ns2:EndTime",
+              "info_link": "ns3:Uri", "summary": "ns3:Summary",
+              "incident_priority": "ns3:IncidentPriority",
+              "routes_affected": "ns3:RoutesAffected"}
+    incident_data = {}
+    for field, tag in fields.items():
+        element = root.find(f".//{tag}", namespaces)
+        incident_data[field] = element.text if element is not None else None
+    incident_data["operators_affected"] = [
+        {"affected_operator_ref": operator.find(".//ns3:OperatorRef", namespaces).text,
+         "affected_operator_name": operator.find(".//ns3:OperatorName", namespaces).text}
+        for operator in root.findall(".//ns3:AffectedOperator", namespaces)]
+    return incident_data
+
+
+def time_per_message(func, payloads: list, repeat: int) -> float:
+    """Returns the mean microseconds per call of func over the payloads"""
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for payload in payloads:
+            func(payload)
+    return (time.perf_counter() - started) / (repeat * len(payloads)) * 1e6
+
+
+def run_benchmark(payloads: list, repeat: int) -> dict:
+    """
+    Times parsing alone, each extractor on a parsed
+    tree, and the full extract and transform step
+    """
+    roots = [parse_xml_string(payload) for payload in payloads]
+    for root in roots:
+        if extract_with_find(root, namespaces) != extract_incident_details(root, namespaces):
+            raise ValueError("Extractors disagree on a payload")
+
+    return {
+        "parse_us": time_per_message(parse_xml_string, payloads, repeat),
+        "find_extract_us": time_per_message(
+            lambda root: extract_with_find(root, namespaces), roots, repeat),
+        "single_pass_extract_us": time_per_message(
+            lambda root: extract_incident_details(root, namespaces), roots, repeat),
+        "extract_and_transform_us": time_per_message(
+            lambda payload: extract_and_transform_incident_data(payload, namespaces),
+            payloads, repeat)
+    }
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("payload_dir", nargs="?", default="sample_messages",
+                        help="directory of recorded message bodies, one per .xml file")
+    parser.add_argument("--repeat", type=int, default=1000)
+    args = parser.parse_args()
+
+    payloads = load_payloads(args.payload_dir)
+    results = run_benchmark(payloads, args.repeat)
+
+    print(f"{len(payloads)} payloads x {args.repeat} repeats")
+    for stage, micros in results.items():
+        print(f"{stage:<26}{micros:>10.1f} us/message")
@@ -0,0 +1,86 @@
+"""Scaling benchmark file: measures consumer throughput as worker processes are added"""
+
+import argparse
+import functools
+import logging
+import os
+import tempfile
+import time
+
+from stomp.utils import Frame
+
+from generate_incidents import generate_incidents
+from messages import LocalSNS
+from process_pool import PartitionedProcessPool
+from replay_incidents import LocalIncidentDatabase, StompClient
+from seen_incidents import SeenIncidentCache
+from spool import IncidentSpool
+
+
+def make_local_components(db_latency_ms: float, sns_latency_ms: float) -> tuple:
+    """Builds a worker process's in-memory database and SNS stand-ins"""
+    return LocalIncidentDatabase(db_latency_ms), LocalSNS(sns_latency_ms / 1000)
+
+
+def run_benchmark(messages: list, processes: int, args) -> float:
+    """
+    Sends every message through a consumer with the given number
+    of worker processes, waits until each has been loaded and
+    notified, and returns the seconds taken
+    """
+    with tempfile.TemporaryDirectory() as spool_dir:
+        client = StompClient()
+        client.seen_cache = SeenIncidentCache()
+        client.spool = IncidentSpool(spool_dir)
+        client.spool.open()
+        make_components = functools.partial(make_local_components,
+                                            args.db_latency_ms, args.sns_latency_ms)
+        client.work_queue = PartitionedProcessPool(
+            client.spool, client.seen_cache, processes, args.queue_size, make_components,
+            args.batch_size, args.batch_wait_ms, args.notify_workers)
+        client.work_queue.start()
+
+        started = time.perf_counter()
+        for number, message in enumerate(messages):
+            client.on_message(Frame("MESSAGE", {"message-id": str(number)}, message))
+        client.work_queue.stop()
+        elapsed = time.perf_counter() - started
+
+        unfinished = client.spool.stats()["unfinished"]
+        client.spool.close()
+
+    if unfinished:
+        logging.warning("%s messages were left unfinished with %s processes",
+                        unfinished, processes)
+    return elapsed
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--processes", default="1,2,4",
+                        help="comma separated worker process counts to compare")
+    parser.add_argument("--incidents", type=int, default=500)
+    parser.add_argument("--versions", type=int, default=4)
+    parser.add_argument("--size", type=int, default=0,
+                        help="pad each message to this many bytes")
+    parser.add_argument("--db-latency-ms", type=float, default=2)
+    parser.add_argument("--sns-latency-ms", type=float, default=5)
+    parser.add_argument("--queue-size", type=int, default=1000)
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--batch-wait-ms", type=float, default=50)
+    parser.add_argument("--notify-workers", type=int, default=4)
+    args = parser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s %(levelname)s\t%(message)s', level=logging.WARNING)
+
+    messages = generate_incidents(args.incidents, args.versions, 3, 2, args.size, seed=0)
+    print(f"{len(messages)} messages, {os.cpu_count()} CPUs")
+
+    baseline = None
+    for processes in [int(count) for count in args.processes.split(",")]:
+        elapsed = run_benchmark(messages, processes, args)
+        rate = len(messages) / elapsed
+        baseline = baseline or rate
+        print(f"{processes:>3} processes: {elapsed:6.2f}s {rate:8.1f} messages/s "
+              f"({rate / baseline:.2f}x)")
@@ -0,0 +1,197 @@
+"""Schema benchmark file: times incident loads and dashboard queries as incident history grows"""
+
+import argparse
+import os
+import statistics
+import time
+from pathlib import Path
+
+from dotenv import load_dotenv
+from psycopg2.extensions import connection
+
+from extract_incident_data import extract_and_transform_incident_data, namespaces
+from generate_incidents import generate_incidents
+from load_incident_data import (get_connection, load_normalised_incidents, seed_operator_table,
+                                switch_between_schemas)
+from messages import OPERATOR_CODES
+from operators import get_operators
+
+
+SCHEMA_FILE = Path(__file__).parent / "incidents_schema.sql"
+
+FILLER_ROUTES = 1000
+
+VERSIONS_PER_FILLER_INCIDENT = 4
+
+DROP_INDEXES = """DROP INDEX operator_code_idx, incident_num_idx, incident_start_time_brin_idx;
+ALTER TABLE incident_route_link DROP CONSTRAINT incident_route_link_incident_id_route_id_key;
+ALTER TABLE incident_operator_link
+DROP CONSTRAINT incident_operator_link_incident_id_operator_id_key;"""
+
+QUERIES = {
+    "dashboard": """SELECT i.incident_id, i.incident_num, i.incident_version, i.link, i.summary,
+        p.priority_code, i.is_planned, i.creation_time, i.start_time, i.end_time,
+        o.operator_code, o.operator_name, o.customer_satisfaction, r.route_name
+        FROM current_incident c
+        JOIN incident i ON c.incident_id = i.incident_id
+        LEFT JOIN priority p ON i.priority_id = p.priority_id
+        LEFT JOIN incident_operator_link iol ON i.incident_id = iol.incident_id
+        LEFT JOIN operator o ON iol.operator_id = o.operator_id
+        LEFT JOIN incident_route_link irl ON i.incident_id = irl.incident_id
+        LEFT JOIN route_affected r ON irl.route_id = r.route_id;""",
+    "incident_history": """SELECT i.incident_version, o.operator_code, r.route_name
+        FROM incident i
+        LEFT JOIN incident_operator_link iol ON i.incident_id = iol.incident_id
+        LEFT JOIN operator o ON iol.operator_id = o.operator_id
+        LEFT JOIN incident_route_link irl ON i.incident_id = irl.incident_id
+        LEFT JOIN route_affected r ON irl.route_id = r.route_id
+        WHERE i.incident_num = 'H1';""",
+    "last_month": """SELECT COUNT(*) FROM incident
+        WHERE start_time >= NOW() - INTERVAL '1 month';"""
+}
+
+
+def create_schema(conn: connection, schema: str, with_indexes: bool) -> None:
+    """
+    Builds a scratch copy of the incident schema under another
+    name, with its operators and priorities seeded
+    """
+    with conn.cursor() as cur:
+        cur.execute(f"DROP SCHEMA IF EXISTS {schema} CASCADE;")
+        cur.execute(SCHEMA_FILE.read_text().replace("incident_data", schema))
+        if not with_indexes:
+            cur.execute(DROP_INDEXES)
+        cur.execute("""INSERT INTO priority (priority_code)
+                    SELECT generate_series(1, 4);""")
+        cur.execute("""INSERT INTO route_affected (route_name)
+                    SELECT 'Filler route ' || n FROM generate_series(0, %s) AS n;""",
+                    (FILLER_ROUTES - 1,))
+    seed_operator_table(conn, get_operators())
+
+
+def fill_history(conn: connection, start: int, end: int) -> None:
+    """
+    Adds filler incident versions start to end, each linked to one
+    operator and one route, with start times a minute apart so
+    the table's physical order follows start_time as it does live.
+    The new block ranges are summarised for the BRIN index at once,
+    rather than whenever autovacuum next reaches them
+    """
+    with conn.cursor() as cur:
+        cur.execute("""INSERT INTO incident (incident_num, incident_version, link, summary,
+                    priority_id, is_planned, creation_time, start_time, end_time)
+                    SELECT 'H' || n / %(versions)s, 20000000000000 + n, 'https://example.com',
+                    'Filler incident', 1 + n %% 4, n %% 3 = 0,
+                    TIMESTAMP '2020-01-01' + n * INTERVAL '1 minute',
+                    TIMESTAMP '2020-01-01' + n * INTERVAL '1 minute',
+                    TIMESTAMP '2020-01-01' + (n + 120) * INTERVAL '1 minute'
+                    FROM generate_series(%(start)s, %(end)s - 1) AS n;""",
+                    {"versions": VERSIONS_PER_FILLER_INCIDENT, "start": start, "end": end})
+        cur.execute("""INSERT INTO incident_operator_link (operator_id, incident_id)
+                    SELECT o.operator_id, i.incident_id FROM incident i
+                    JOIN operator o ON o.operator_code = (%(codes)s::text[])[
+                        1 + (i.incident_version %% array_length(%(codes)s::text[], 1))::int]
+                    WHERE i.incident_version BETWEEN 20000000000000 + %(start)s
+                    AND 20000000000000 + %(end)s - 1;""",
+                    {"codes": OPERATOR_CODES, "start": start, "end": end})
+        cur.execute("""INSERT INTO incident_route_link (route_id, incident_id)
+                    SELECT r.route_id, i.incident_id FROM incident i
+                    JOIN route_affected r
+                    ON r.route_name = 'Filler route ' || i.incident_version %% %(routes)s
+                    WHERE i.incident_version BETWEEN 20000000000000 + %(start)s
+                    AND 20000000000000 + %(end)s - 1;""",
+                    {"routes": FILLER_ROUTES, "start": start, "end": end})
+        cur.execute("""INSERT INTO current_incident (incident_num, incident_version, incident_id)
+                    SELECT DISTINCT ON (incident_num) incident_num, incident_version, incident_id
+                    FROM incident
+                    WHERE incident_version BETWEEN 20000000000000 + %(start)s
+                    AND 20000000000000 + %(end)s - 1
+                    ORDER BY incident_num, incident_version DESC
+                    ON CONFLICT (incident_num) DO UPDATE
+                    SET incident_version = EXCLUDED.incident_version,
+                    incident_id = EXCLUDED.incident_id
+                    WHERE current_incident.incident_version < EXCLUDED.incident_version;""",
+                    {"start": start, "end": end})
+        cur.execute("""SELECT brin_summarize_new_values(index)
+                    FROM to_regclass('incident_start_time_brin_idx') AS index
+                    WHERE index IS NOT NULL;""")
+        cur.execute("ANALYZE;")
+    conn.commit()
+
+
+def remove_incidents(conn: connection, versions: list) -> None:
+    """Deletes the given incident versions and everything linked to them"""
+    with conn.cursor() as cur:
+        for table in ["incident_route_link", "incident_operator_link", "current_incident"]:
+            cur.execute(f"""DELETE FROM {table} WHERE incident_id IN
+                        (SELECT incident_id FROM incident WHERE incident_version = ANY(%s));""",
+                        (versions,))
+        cur.execute("DELETE FROM incident WHERE incident_version = ANY(%s);", (versions,))
+    conn.commit()
+
+
+def time_batch_load(conn: connection, batch_size: int, repeats: int, seed: int) -> float:
+    """
+    Returns the median milliseconds load_normalised_incidents takes
+    on a batch of generated messages, removing each batch after
+    """
+    durations = []
+    for repeat in range(repeats):
+        messages = [extract_and_transform_incident_data(message.decode(), namespaces)
+                    for message in generate_incidents(batch_size, 1, 3, 2, 0,
+                                                      seed=seed * repeats + repeat)]
+        started = time.perf_counter()
+        load_normalised_incidents(conn, messages)
+        durations.append((time.perf_counter() - started) * 1000)
+        remove_incidents(conn, [int(message["version"]) for message in messages])
+
+    return statistics.median(durations)
+
+
+def explain_query(conn: connection, query: str) -> float:
+    """Returns the execution time EXPLAIN ANALYZE reports for a query, in milliseconds"""
+    with conn.cursor() as cur:
+        cur.execute(f"EXPLAIN (ANALYZE, FORMAT JSON) {query}")
+        plan = cur.fetchone()["QUERY PLAN"]
+    conn.rollback()
+    return plan[0]["Execution Time"]
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--history", default="10000,100000,1000000",
+                        help="comma separated incident versions to measure at")
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--schema", default="incident_benchmark",
+                        help="scratch schema to build, dropped first if it exists")
+    parser.add_argument("--without-indexes", action="store_true",
+                        help="drop the indexes and link constraints to time the schema before them")
+    parser.add_argument("--keep", action="store_true", help="keep the scratch schema afterwards")
+    args = parser.parse_args()
+
+    if args.schema == "incident_data":
+        raise ValueError("The benchmark drops its schema - choose a scratch schema name")
+
+    load_dotenv()
+    conn = get_connection(os.environ["DB_HOST"], os.environ["DB_NAME"],
+                          os.environ["DB_PASS"], os.environ["DB_USER"])
+    create_schema(conn, args.schema, not args.without_indexes)
+    switch_between_schemas(conn, args.schema)
+
+    print(f"{'history':>10}{'load_batch_ms':>16}" + "".join(f"{name + '_ms':>22}"
+                                                         for name in QUERIES))
+    loaded = 0
+    for size in [int(size) for size in args.history.split(",")]:
+        fill_history(conn, loaded, size)
+        loaded = size
+        load_ms = time_batch_load(conn, args.batch_size, args.repeats, size)
+        query_ms = [explain_query(conn, query) for query in QUERIES.values()]
+        print(f"{size:>10}{load_ms:>16.1f}" + "".join(f"{ms:>22.1f}" for ms in query_ms))
+
+    if not args.keep:
+        with conn.cursor() as cur:
+            cur.execute(f"DROP SCHEMA {args.schema} CASCADE;")
+        conn.commit()
+    conn.close()
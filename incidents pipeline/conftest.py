@@ -0,0 +1,22 @@
+"""Conftest file: fixtures shared by the incident pipeline tests"""
+
+from pathlib import Path
+
+from pytest import fixture
+
+from spool import IncidentSpool
+
+
+@fixture
+def example_message():
+    """A fixture that returns the example incident message, which affects three operators"""
+    return (Path(__file__).parent / "sample_messages" / "example_incident.xml").read_bytes()
+
+
+@fixture
+def spool(tmp_path):
+    """A fixture that returns an open spool in a temporary directory, closed afterwards"""
+    incident_spool = IncidentSpool(tmp_path)
+    incident_spool.open()
+    yield incident_spool
+    incident_spool.close()
@@ -0,0 +1,24 @@
+-- Adds the current_incident table to an existing incident_data schema and
+-- fills it with the latest version of every incident. Runs in one transaction.
+
+SET search_path TO incident_data;
+
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS current_incident (
+    incident_num TEXT NOT NULL,
+    incident_version BIGINT NOT NULL,
+    incident_id INT NOT NULL,
+    PRIMARY KEY (incident_num),
+    FOREIGN KEY (incident_id) REFERENCES incident(incident_id)
+);
+
+INSERT INTO current_incident (incident_num, incident_version, incident_id)
+SELECT DISTINCT ON (incident_num) incident_num, incident_version, incident_id
+FROM incident
+ORDER BY incident_num, incident_version DESC
+ON CONFLICT (incident_num) DO UPDATE
+SET incident_version = EXCLUDED.incident_version, incident_id = EXCLUDED.incident_id
+WHERE current_incident.incident_version < EXCLUDED.incident_version;
+
+COMMIT;
@@ -3,8 +3,6 @@
 import xml.etree.ElementTree as ET
 from xml.etree.ElementTree import Element
 from datetime import datetime
-import pandas as pd
-from pandas import DataFrame
 
 
 namespaces = {
@@ -33,53 +31,66 @@ def parse_xml_string(xml_data: str) -> Element:
     return root
 
 
-def extract_operators_from_element(root: Element, namespaces: dict) -> list:
+INCIDENT_FIELDS = {
+    "creation_time": ("ns3", "CreationTime"),
+    "incident_number": ("ns3", "IncidentNumber"),
+    "version": ("ns3", "Version"),
+    "planned": ("ns3", "Planned"),
+    "start_time": ("ns2", "StartTime"),
+    "end_time": ("ns2", "EndTime"),
+    "info_link": ("ns3", "Uri"),
+    "summary": ("ns3", "Summary"),
+    "incident_priority": ("ns3", "IncidentPriority"),
+    "routes_affected": ("ns3", "RoutesAffected")
+}
+
+
+def build_tag_dispatch(namespaces: dict) -> dict:
     """
-    Takes an XML element and returns a list
-    with details for each 'operator' found
+    Maps each fully qualified tag that holds an
+    incident field to the name of that field
     """
-    operators = root.findall(".//ns3:Operators", namespaces)
-    operators_info = []
+    return {f"{{{namespaces[prefix]}}}{tag}": field
+            for field, (prefix, tag) in INCIDENT_FIELDS.items()}
 
-    for operator in operators:
-        operator_info = {
-            "affected_operator_ref": root.find('.//ns3:OperatorRef', namespaces).text,
-            "affected_operator_name": root.find('.//ns3:OperatorName', namespaces).text
-        }
-        operators_info.append(operator_info)
 
-    return operators_info
+def extract_operators_from_element(operator: Element, namespaces: dict) -> dict:
+    """
+    Takes an AffectedOperator element and returns
+    the operator's reference and name
+    """
+    operator_ref = operator.find("ns3:OperatorRef", namespaces)
+    operator_name = operator.find("ns3:OperatorName", namespaces)
+
+    return {
+        "affected_operator_ref": operator_ref.text if operator_ref is not None else None,
+        "affected_operator_name": operator_name.text if operator_name is not None else None
+    }
 
 
 def extract_incident_details(root: Element, namespaces: dict) -> dict:
     """
-    Takes an XML element and returns a
-    dictionary containing incident details
+    Takes an XML element and returns a dictionary
+    containing incident details, filled in a single
+    walk of the tree. The first element found for each
+    field is used, as well as every affected operator
     """
-    creation_time = root.find('.//ns3:CreationTime', namespaces)
-    incident_num = root.find('.//ns3:IncidentNumber', namespaces)
-    version = root.find('.//ns3:Version', namespaces)
-    planned = root.find('.//ns3:Planned', namespaces)
-    start_time = root.find('.//ns2:StartTime', namespaces)
-    end_time = root.find('.//ns2:EndTime', namespaces)
-    info_link = root.find('.//ns3:Uri', namespaces)
-    summary = root.find('.//ns3:Summary', namespaces)
-    incident_priority = root.find('.//ns3:IncidentPriority', namespaces)
-    routes = root.find('.//ns3:RoutesAffected', namespaces)
-
-    incident_data = {
-        "creation_time": creation_time.text if creation_time is not None else None,
-        "incident_number": incident_num.text if incident_num is not None else None,
-        "version": version.text if version is not None else None,
-        "planned": planned.text if planned is not None else None,
-        "start_time": start_time.text if start_time is not None else None,
-        "end_time": end_time.text if end_time is not None else None,
-        "info_link": info_link.text if info_link is not None else None,
-        "summary": summary.text if summary is not None else None,
-        "incident_priority": incident_priority.text if incident_priority is not None else None,
-        "operators_affected": extract_operators_from_element(root, namespaces),
-        "routes_affected": routes.text if routes is not None else None
-    }
+    tag_dispatch = build_tag_dispatch(namespaces)
+    operator_tag = f"{{{namespaces['ns3']}}}AffectedOperator"
+
+    incident_data = dict.fromkeys(INCIDENT_FIELDS)
+    incident_data["operators_affected"] = []
+
+    for element in root.iter():
+        if element is root:
+            continue
+        if element.tag == operator_tag:
+            incident_data["operators_affected"].append(
+                extract_operators_from_element(element, namespaces))
+            continue
+        field = tag_dispatch.get(element.tag)
+        if field and incident_data[field] is None:
+            incident_data[field] = element.text
 
     return incident_data
 
@@ -130,32 +141,3 @@ def extract_and_transform_incident_data(input_string: str, namespaces: dict):
     transformed_incident_data = transform_incident_data(incident_data)
 
     return transformed_incident_data
-
-
-def flatten_incident_data(incident_data: dict) -> DataFrame:
-    """
-    Flattens the incident data dictionary into
-    a list of dictionaries, each one containing
-    only one operator and one affected route
-    """
-    flattened_data = []
-
-    for operator in incident_data['operators_affected']:
-        for route in incident_data['routes_affected']:
-            flattened_dict = {
-                "creation_time": incident_data['creation_time'],
-                "incident_number": incident_data['incident_number'],
-                "version": incident_data['version'],
-                "planned": incident_data['planned'],
-                "start_time": incident_data['start_time'],
-                "end_time": incident_data['end_time'],
-                "info_link": incident_data['info_link'],
-                "summary": incident_data['summary'],
-                "incident_priority": incident_data['incident_priority'],
-                "affected_operator_ref": operator['affected_operator_ref'],
-                "affected_operator_name": operator['affected_operator_name'],
-                "route_affected": route
-            }
-            flattened_data.append(flattened_dict)
-
-    return flattened_data
@@ -0,0 +1,198 @@
+"""Generator file: produces synthetic kb.incidents XML messages for scale testing"""
+
+import argparse
+import random
+import zipfile
+from datetime import datetime, timedelta
+from pathlib import Path
+from xml.sax.saxutils import escape
+
+import stomp
+
+from extract_incident_data import namespaces
+from messages import OPERATOR_CODES
+
+
+DAY_START = datetime(2023, 9, 20, 5, 0)
+
+ROOT_TAG = "uk.co.nationalrail.xml.incident.PtIncidentStructure"
+
+
+def element(prefix: str, name: str, text: str) -> str:
+    """Returns an element in a namespace prefix holding escaped text"""
+    return f"<{prefix}:{name}>{escape(text)}</{prefix}:{name}>"
+
+
+def parent(prefix: str, name: str, *children: str) -> str:
+    """Returns an element in a namespace prefix holding child elements"""
+    return f"<{prefix}:{name}>{''.join(children)}</{prefix}:{name}>"
+
+
+def format_time(timestamp: datetime) -> str:
+    """Formats a timestamp the way the feed does"""
+    return timestamp.strftime("%Y-%m-%dT%H:%M:%S.000+01:00")
+
+
+def build_incident_xml(incident: dict, version_time: datetime, size: int) -> bytes:
+    """
+    Builds one kb.incidents message for a version of an
+    incident, padding its description to reach size bytes
+    """
+    validity = [element("ns2", "StartTime", format_time(incident["start"]))]
+    if incident["end"] is not None:
+        validity.append(element("ns2", "EndTime", format_time(incident["end"])))
+    operators = [parent("ns3", "AffectedOperator",
+                        element("ns3", "OperatorRef", operator_code),
+                        element("ns3", "OperatorName", f"Operator {operator_code}"))
+                 for operator_code in incident["operators"]]
+    info_link = f"https://www.nationalrail.co.uk/service-disruptions/{incident['number'].lower()}/"
+    routes = f"<p>{' / '.join(incident['routes'])}</p>"
+    description = f"<p>{incident['summary']}. Updated {format_time(version_time)}.</p>"
+
+    def build(description: str) -> bytes:
+        return "".join([
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>',
+            f'<{ROOT_TAG} xmlns:ns2="{namespaces["ns2"]}" xmlns:ns3="{namespaces["ns3"]}">',
+            element("ns3", "CreationTime", format_time(incident["created"])),
+            parent("ns3", "ChangeHistory",
+                   element("ns2", "ChangedBy", "NRE CMS Editor"),
+                   element("ns2", "LastChangedDate", format_time(version_time))),
+            element("ns3", "IncidentNumber", incident["number"]),
+            element("ns3", "Version", version_time.strftime("%Y%m%d%H%M%S")),
+            parent("ns3", "ValidityPeriod", *validity),
+            element("ns3", "Planned", str(incident["planned"]).lower()),
+            element("ns3", "Summary", incident["summary"]),
+            element("ns3", "Description", description),
+            parent("ns3", "InfoLinks",
+                   parent("ns3", "InfoLink",
+                          element("ns3", "Uri", info_link),
+                          element("ns3", "Label", "Incident detail page"))),
+            parent("ns3", "Affects",
+                   parent("ns3", "Operators", *operators),
+                   element("ns3", "RoutesAffected", routes)),
+            element("ns3", "ClearedIncident", "false"),
+            element("ns3", "IncidentPriority", str(incident["priority"])),
+            f"</{ROOT_TAG}>"
+        ]).encode()
+
+    message = build(description)
+    if len(message) < size:
+        message = build(description[:-4] + " " + "x" * (size - len(message) - 1) + "</p>")
+
+    return message
+
+
+def make_versions_unique(timeline: list) -> list:
+    """
+    Moves version times on by a second at a time until no two
+    versions share one, as versions are unique across incidents,
+    keeping each incident's versions in order. Returns the
+    timeline sorted again
+    """
+    used = set()
+    last_version = {}
+    unique_timeline = []
+    for version_time, incident in timeline:
+        previous = last_version.get(incident["number"])
+        if previous is not None and version_time <= previous:
+            version_time = previous + timedelta(seconds=1)
+        while version_time in used:
+            version_time += timedelta(seconds=1)
+        used.add(version_time)
+        last_version[incident["number"]] = version_time
+        unique_timeline.append((version_time, incident))
+
+    unique_timeline.sort(key=lambda entry: entry[0])
+    return unique_timeline
+
+
+def generate_incidents(incidents: int, versions: int, operators: int, routes: int,
+                       size: int, seed: int = 0) -> list:
+    """
+    Returns the messages for a day of synthetic incidents,
+    each with the given number of versions, operators and
+    routes, in the order their versions were published
+    """
+    rng = random.Random(seed)
+
+    timeline = []
+    for number in range(incidents):
+        start = DAY_START + timedelta(minutes=rng.randrange(18 * 60))
+        incident = {
+            "number": f"{rng.getrandbits(128):032X}",
+            "created": start - timedelta(minutes=rng.randrange(60)),
+            "start": start,
+            "end": start + timedelta(hours=rng.randrange(1, 8)) if rng.random() < 0.8 else None,
+            "planned": rng.random() < 0.3,
+            "priority": rng.randrange(1, 5),
+            "summary": f"Disruption {number} between Station {rng.randrange(2500)} "
+                       f"and Station {rng.randrange(2500)}",
+            "operators": rng.sample(OPERATOR_CODES, min(operators, len(OPERATOR_CODES))),
+            "routes": [f"between Station {rng.randrange(2500)} and Station {rng.randrange(2500)}"
+                       for _ in range(routes)]
+        }
+        for version in range(versions):
+            timeline.append((incident["created"] + timedelta(minutes=10 * version,
+                                                             seconds=rng.randrange(600)),
+                             incident))
+
+    timeline.sort(key=lambda entry: entry[0])
+    timeline = make_versions_unique(timeline)
+    return [build_incident_xml(incident, version_time, size)
+            for version_time, incident in timeline]
+
+
+def write_messages(messages: list, output: str) -> None:
+    """
+    Writes the messages to a .zip archive, or otherwise
+    to a directory with one numbered .xml file each
+    """
+    if output.endswith(".zip"):
+        with zipfile.ZipFile(output, "w", zipfile.ZIP_DEFLATED) as archive:
+            for number, message in enumerate(messages):
+                archive.writestr(f"{number:07d}.xml", message)
+        return
+
+    directory = Path(output)
+    directory.mkdir(parents=True, exist_ok=True)
+    for number, message in enumerate(messages):
+        (directory / f"{number:07d}.xml").write_bytes(message)
+
+
+def send_messages(messages: list, broker: str, destination: str,
+                  username: str, password: str) -> None:
+    """Sends the messages to a destination on a local STOMP broker"""
+    host, port = broker.split(":")
+    connection = stomp.Connection12([(host, int(port))], auto_decode=False)
+    connection.connect(username=username, passcode=password, wait=True)
+    for message in messages:
+        connection.send(destination=destination, body=message)
+    connection.disconnect()
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--incidents", type=int, default=100)
+    parser.add_argument("--versions", type=int, default=5, help="versions per incident")
+    parser.add_argument("--operators", type=int, default=3, help="operators per incident")
+    parser.add_argument("--routes", type=int, default=2, help="routes per incident")
+    parser.add_argument("--size", type=int, default=0,
+                        help="minimum message size in bytes, reached by padding the description")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="generated_messages",
+                        help="directory, or .zip archive, to write the messages to")
+    parser.add_argument("--broker", help="host:port of a local STOMP broker to send to instead")
+    parser.add_argument("--destination", default="/topic/kb.incidents")
+    parser.add_argument("--username", default="admin")
+    parser.add_argument("--password", default="admin")
+    args = parser.parse_args()
+
+    messages = generate_incidents(args.incidents, args.versions, args.operators,
+                                  args.routes, args.size, args.seed)
+    if args.broker:
+        send_messages(messages, args.broker, args.destination, args.username, args.password)
+        print(f"Sent {len(messages)} messages to {args.destination} on {args.broker}")
+    else:
+        write_messages(messages, args.output)
+        print(f"Wrote {len(messages)} messages to {args.output}")
@@ -0,0 +1,39 @@
+-- Adds the indexes and link table constraints from incidents_schema.sql to an
+-- existing incident_data schema. Duplicate links are removed first, keeping
+-- the earliest. Runs in one transaction.
+
+SET search_path TO incident_data;
+
+BEGIN;
+
+DELETE FROM incident_route_link irl
+USING incident_route_link earlier
+WHERE irl.incident_id = earlier.incident_id
+AND irl.route_id = earlier.route_id
+AND irl.incident_route_link_id > earlier.incident_route_link_id;
+
+DELETE FROM incident_operator_link iol
+USING incident_operator_link earlier
+WHERE iol.incident_id = earlier.incident_id
+AND iol.operator_id = earlier.operator_id
+AND iol.incident_operator_link_id > earlier.incident_operator_link_id;
+
+ALTER TABLE incident_route_link
+    ADD CONSTRAINT incident_route_link_incident_id_route_id_key UNIQUE (incident_id, route_id);
+
+ALTER TABLE incident_operator_link
+    ADD CONSTRAINT incident_operator_link_incident_id_operator_id_key UNIQUE (incident_id, operator_id);
+
+CREATE INDEX IF NOT EXISTS operator_code_idx ON operator (operator_code);
+
+CREATE INDEX IF NOT EXISTS incident_num_idx ON incident (incident_num);
+
+CREATE INDEX IF NOT EXISTS incident_start_time_brin_idx ON incident USING BRIN (start_time)
+    WITH (autosummarize = on);
+
+COMMIT;
+
+ANALYZE incident;
+ANALYZE incident_route_link;
+ANALYZE incident_operator_link;
+ANALYZE operator;
@@ -1,4 +1,4 @@
-"""Schema file: builds the structure of the incident schema"""
+-- Schema file: builds the structure of the incident schema
 
 CREATE SCHEMA incident_data;
 
@@ -20,8 +20,8 @@ CREATE TABLE IF NOT EXISTS priority (
 
 CREATE TABLE IF NOT EXISTS incident (
     incident_id INT GENERATED ALWAYS AS IDENTITY,
-    incident_num NOT NULL,
-    incident_version NOT NULL UNIQUE,
+    incident_num TEXT NOT NULL,
+    incident_version BIGINT NOT NULL UNIQUE,
     link TEXT NOT NULL,
     summary TEXT NOT NULL,
     priority_id INT NOT NULL,
@@ -30,7 +30,15 @@ CREATE TABLE IF NOT EXISTS incident (
     start_time TIMESTAMP NOT NULL,
     end_time TIMESTAMP,
     PRIMARY KEY (incident_id),
-    FOREIGN KEY (priority_id) REFERENCES priority(priority_id),
+    FOREIGN KEY (priority_id) REFERENCES priority(priority_id)
+);
+
+CREATE TABLE IF NOT EXISTS current_incident (
+    incident_num TEXT NOT NULL,
+    incident_version BIGINT NOT NULL,
+    incident_id INT NOT NULL,
+    PRIMARY KEY (incident_num),
+    FOREIGN KEY (incident_id) REFERENCES incident(incident_id)
 );
 
 CREATE TABLE IF NOT EXISTS route_affected (
@@ -44,6 +52,7 @@ CREATE TABLE IF NOT EXISTS incident_route_link (
     route_id INT NOT NULL,
     incident_id INT NOT NULL,
     PRIMARY KEY (incident_route_link_id),
+    UNIQUE (incident_id, route_id),
     FOREIGN KEY (route_id) REFERENCES route_affected(route_id),
     FOREIGN KEY (incident_id) REFERENCES incident(incident_id)
 );
@@ -53,6 +62,23 @@ CREATE TABLE IF NOT EXISTS incident_operator_link (
     operator_id INT NOT NULL,
     incident_id INT NOT NULL,
     PRIMARY KEY (incident_operator_link_id),
+    UNIQUE (incident_id, operator_id),
     FOREIGN KEY (operator_id) REFERENCES operator(operator_id),
     FOREIGN KEY (incident_id) REFERENCES incident(incident_id)
-);
\ No newline at end of file
+);
+
+CREATE TABLE IF NOT EXISTS subscription (
+    subscription_id INT GENERATED ALWAYS AS IDENTITY,
+    phone_number TEXT NOT NULL CHECK (phone_number ~ '^\+[1-9][0-9]{1,14}$'),
+    route_term TEXT NOT NULL,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (subscription_id),
+    UNIQUE (phone_number, route_term)
+);
+
+CREATE INDEX IF NOT EXISTS operator_code_idx ON operator (operator_code);
+
+CREATE INDEX IF NOT EXISTS incident_num_idx ON incident (incident_num);
+
+CREATE INDEX IF NOT EXISTS incident_start_time_brin_idx ON incident USING BRIN (start_time)
+    WITH (autosummarize = on);
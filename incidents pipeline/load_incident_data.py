@@ -1,16 +1,18 @@
 """Load file: loads incident data into the database"""
 
-import os
+import logging
+import queue
+import threading
+import time
 
-from dotenv import load_dotenv
 import psycopg2
 from psycopg2.extensions import connection
 from psycopg2.extras import RealDictCursor, execute_values
 
 from datetime import datetime, timedelta
 
-import pandas as pd
-from pandas import DataFrame
+from metrics import timings
+from operators import get_operators
 
 
 def get_connection(host: str, db_name: str, password: str, user: str):
@@ -38,138 +40,445 @@ def switch_between_schemas(conn, schema_name: str) -> None:
     conn.commit()
 
 
-def get_operator_info_df():
+class IncidentDatabase:
     """
-    Creates a DataFrame of National Rail
-    operators, with columns that include
-    passenger satisfaction and operator
-    code. Some operators are manually inserted
-    into the DataFrame, to account for issues 
-    with the Wikipedia table
+    Owns long-lived connections to the incidents schema, one
+    per thread that uses it, checking each is still healthy
+    before handing it out and reconnecting when it has dropped
     """
-    df = pd.read_html("https://en.wikipedia.org/wiki/List_of_companies_operating_trains_in_the_United_Kingdom",
-                      flavor="bs4", attrs={"class": "wikitable"})[0]
-    df["Passenger satisfaction[1]"] = df["Passenger satisfaction[1]"].apply(
-        lambda x: str(x).strip("%"))
-    df["Passenger satisfaction[1]"] = pd.to_numeric(
-        df["Passenger satisfaction[1]"], errors="coerce")
-    df = df.rename(
-        columns={"Passenger satisfaction[1]": "Passenger satisfaction (%)"})
-    df = df.drop([9, 21], axis=0)
-    additional_operators_df = pd.DataFrame({
-        "Operator": ["Gatwick Express", "Great Northern", "Southern", "Thameslink",
-                     "South Western Railway", "Island Line"],
-        "Code": ["GX", "GN", "SN", "TL", "SW", "IL"],
-        "Passenger satisfaction (%)": [80, 80, 80, 80, 75, 75]
-    })
-    df = pd.concat([df, additional_operators_df], ignore_index=True)
-    print(df[["Code", "Passenger satisfaction (%)"]])
-    return df
 
-
-def seed_operator_table(conn: connection, operator_info: DataFrame):
+    def __init__(self, host: str, db_name: str, password: str, user: str,
+                 health_check_interval_secs: float = 30):
+        self.host = host
+        self.db_name = db_name
+        self.password = password
+        self.user = user
+        self.health_check_interval_secs = health_check_interval_secs
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.connections = []
+
+    @property
+    def conn(self) -> connection:
+        """The calling thread's connection"""
+        return getattr(self.local, "conn", None)
+
+    @conn.setter
+    def conn(self, conn: connection) -> None:
+        self.local.conn = conn
+
+    @property
+    def last_checked(self) -> float:
+        """When the calling thread's connection was last known to be healthy"""
+        return getattr(self.local, "last_checked", 0)
+
+    @last_checked.setter
+    def last_checked(self, checked_at: float) -> None:
+        self.local.last_checked = checked_at
+
+    def connect(self) -> connection:
+        """
+        Opens a new connection and points it
+        at the incident_data schema
+        """
+        if self.conn is not None and not self.conn.closed:
+            self.conn.close()
+        self.conn = get_connection(self.host, self.db_name, self.password, self.user)
+        if self.conn is None:
+            raise ConnectionError("Could not connect to the incidents database.")
+        with self.lock:
+            self.connections = [conn for conn in self.connections
+                                if not conn.closed] + [self.conn]
+        switch_between_schemas(self.conn, "incident_data")
+        self.last_checked = time.monotonic()
+        return self.conn
+
+    def is_healthy(self) -> bool:
+        """
+        Returns whether the connection is open and
+        answers a trivial query
+        """
+        if self.conn is None or self.conn.closed:
+            return False
+        try:
+            with self.conn.cursor() as cur:
+                cur.execute("SELECT 1;")
+            self.conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def get_connection(self) -> connection:
+        """
+        Returns the open connection, reconnecting if it has closed,
+        or if it fails a health check once the check interval has passed
+        """
+        if self.conn is None or self.conn.closed:
+            return self.connect()
+        if time.monotonic() - self.last_checked >= self.health_check_interval_secs:
+            if not self.is_healthy():
+                return self.connect()
+            self.last_checked = time.monotonic()
+        return self.conn
+
+    def is_available(self) -> bool:
+        """
+        Returns whether the database can be reached,
+        connecting the calling thread if needed
+        """
+        try:
+            self.get_connection()
+        except ConnectionError:
+            return False
+        return self.is_healthy()
+
+    def close(self) -> None:
+        """Closes every connection opened by any thread"""
+        with self.lock:
+            for conn in self.connections:
+                if not conn.closed:
+                    conn.close()
+            self.connections = []
+
+
+def seed_operator_table(conn: connection, operators: dict) -> None:
     """
-    Adds data to the 'operator' table
+    Brings the 'operator' table in line with the operator reference
+    data, keyed by operator code. Known operators are updated and
+    missing ones inserted, so seeding can be re-run at any time. A
+    satisfaction left blank in the reference data keeps the stored one
     """
-    operator_info_values = operator_info[[
-        'Operator', 'Code', 'Passenger satisfaction (%)']].values.tolist()
+    data = [(operator["operator_code"], operator["operator_name"],
+             operator["customer_satisfaction"]) for operator in operators.values()]
 
     with conn.cursor() as cur:
-
-        cur.executemany("""INSERT INTO operator 
-                    (operator_name,
-                    operator_code,
-                    customer_satisfaction)
-                    VALUES
-                    (%s, %s, %s)
-                    ON CONFLICT DO NOTHING;
-                    """, operator_info_values)
+        execute_values(cur, """UPDATE operator SET operator_name = data.operator_name,
+                       customer_satisfaction = COALESCE(data.customer_satisfaction,
+                       operator.customer_satisfaction)
+                       FROM (VALUES %s) AS data (operator_code, operator_name, customer_satisfaction)
+                       WHERE operator.operator_code = data.operator_code;""", data,
+                       template="(%s, %s, %s::FLOAT)")
+        execute_values(cur, """INSERT INTO operator (operator_code, operator_name,
+                       customer_satisfaction)
+                       SELECT * FROM (VALUES %s) AS data (operator_code, operator_name,
+                       customer_satisfaction)
+                       WHERE NOT EXISTS (SELECT 1 FROM operator
+                       WHERE operator.operator_code = data.operator_code);""", data,
+                       template="(%s, %s, %s::FLOAT)")
 
     conn.commit()
 
 
-def load_priority(conn: connection, msg_df: DataFrame):
+def get_rows(records: list, columns: list) -> list:
+    """
+    Picks the given columns out of each incident
+    record or message, as a list of tuples
+    """
+    return [tuple(record[column] for column in columns) for record in records]
+
+
+def load_priority(conn: connection, records: list):
     """
     Load data into the priority table 
     from the incoming message
     """
-    priority = msg_df[['incident_priority']].values.tolist()
+    priority = get_rows(records, ["incident_priority"])
 
-    print(f"priorit {priority}")
     with conn.cursor() as cur:
         execute_values(cur, """INSERT INTO priority (priority_code) VALUES %s
                        ON CONFLICT DO NOTHING;""", priority)
-    conn.commit()
 
 
-def load_incident(conn: connection, msg_df: DataFrame):
+def get_message_key(message: dict) -> tuple:
+    """Returns the (incident number, version) a message's incident id is keyed by"""
+    return (str(message["incident_number"]), str(message["version"]))
+
+
+def load_new_incidents(conn: connection, messages: list) -> dict:
     """
-    Loads incident data into the incident table
+    Loads incidents not already in the incident table, returning the
+    incident_id of each new incident keyed by its incident number
+    and version
     """
-    data = msg_df[["incident_number", "version",
-                   "info_link", "summary", "incident_priority", "planned", "creation_time",
-                   "start_time", "end_time"]].values.tolist()
+    unique_messages = {}
+    for message in messages:
+        unique_messages.setdefault(get_message_key(message), message)
+    data = get_rows(unique_messages.values(),
+                    ["incident_number", "version",
+                     "info_link", "summary", "incident_priority", "planned",
+                     "creation_time", "start_time", "end_time"])
 
     with conn.cursor() as cur:
-        cur.executemany("""INSERT INTO incident (incident_num, incident_version, link, summary,
-                       priority_id, is_planned, creation_time, start_time, end_time) VALUES (%s,%s,%s,
-                        %s,(SELECT priority_id FROM priority WHERE priority_code = %s), %s, %s, %s, %s)
-                        ON CONFLICT DO NOTHING;""", data)
-    conn.commit()
+        rows = execute_values(cur, """INSERT INTO incident (incident_num, incident_version, link,
+                              summary, priority_id, is_planned, creation_time, start_time, end_time)
+                              VALUES %s ON CONFLICT DO NOTHING
+                              RETURNING incident_id, incident_num, incident_version;""", data,
+                              template="""(%s, %s, %s, %s,
+                              (SELECT priority_id FROM priority WHERE priority_code = %s),
+                              %s, %s, %s, %s)""", fetch=True)
+
+    return {(str(row["incident_num"]), str(row["incident_version"])): row["incident_id"]
+            for row in rows}
 
 
-def load_routes(conn: connection, msg_df: DataFrame):
+def get_distinct_links(messages: list, incident_ids: dict, key: str, field: str = None) -> list:
     """
-    Loads route data into the routes table
+    Returns each distinct (value, incident_id) pair from the given
+    list in each new message, taking field from each item if given
     """
-    routes = msg_df[["route_affected"]].values.tolist()
+    links = {}
+    for message in messages:
+        incident_id = incident_ids.get(get_message_key(message))
+        if incident_id is None:
+            continue
+        for item in message[key] or []:
+            links[(item[field] if field else item, incident_id)] = None
 
-    with conn.cursor() as cur:
-        execute_values(
-            cur, """INSERT INTO route_affected (route_name) VALUES %s ON CONFLICT DO NOTHING""", routes)
-    conn.commit()
+    return list(links)
 
 
-def load_route_link(conn: connection, msg_df: DataFrame):
+def get_latest_versions(messages: list, incident_ids: dict) -> list:
     """
-    Creates links between incidents and
-    routes and loads them into the
-    incident_route_link table
+    Returns the (incident_num, version, incident_id) of the
+    latest new version of each incident in the messages
     """
-    data = msg_df[["route_affected", "version"]].values.tolist()
+    latest = {}
+    for message in messages:
+        incident_id = incident_ids.get(get_message_key(message))
+        if incident_id is None:
+            continue
+        current = latest.get(message["incident_number"])
+        if current is None or int(message["version"]) > int(current[1]):
+            latest[message["incident_number"]] = (message["incident_number"],
+                                                  message["version"], incident_id)
 
-    with conn.cursor() as cur:
-        cur.executemany("""INSERT INTO incident_route_link (route_id, incident_id) VALUES
-                        ((SELECT route_id FROM route_affected WHERE route_name = %s),
-                        (SELECT incident_id FROM incident WHERE incident_version = %s));""", data)
-    conn.commit()
+    return list(latest.values())
 
 
-def load_operator_link(conn: connection, msg_df: DataFrame):
+def load_current_incidents(conn: connection, messages: list, incident_ids: dict):
     """
-    Creates links between incidents and
-    operators and loads them into the
-    incident_operator_link table
+    Points each incident's current_incident row at its newest version,
+    leaving rows alone when a version arrives older than the stored one
     """
-    data = msg_df[["affected_operator_ref", "version"]].values.tolist()
+    data = get_latest_versions(messages, incident_ids)
 
     with conn.cursor() as cur:
-        cur.executemany("""INSERT INTO incident_operator_link (operator_id, incident_id) VALUES
-                        ((SELECT operator_id FROM operator WHERE operator_code = %s),
-                        (SELECT incident_id FROM incident WHERE incident_version = %s));""", data)
-    conn.commit()
+        execute_values(cur, """INSERT INTO current_incident (incident_num, incident_version,
+                       incident_id) VALUES %s
+                       ON CONFLICT (incident_num) DO UPDATE
+                       SET incident_version = EXCLUDED.incident_version,
+                       incident_id = EXCLUDED.incident_id
+                       WHERE current_incident.incident_version < EXCLUDED.incident_version;""",
+                       data)
+
+
+def load_normalised_incidents(conn: connection, messages: list):
+    """
+    Loads whole incident messages, writing each distinct route
+    and operator link once per incident, with incident ids taken
+    from the incident insert. Incidents that were already loaded
+    get no new links, and operators missing from the reference
+    data are not linked. Moves current_incident on to the newest
+    version. Commits the messages as a single transaction
+    """
+    try:
+        with timings.time("load_priority"):
+            load_priority(conn, messages)
+        with timings.time("load_incident"):
+            incident_ids = load_new_incidents(conn, messages)
+
+        routes = [(route,) for route in dict.fromkeys(
+            route for message in messages for route in message["routes_affected"] or [])]
+        route_links = get_distinct_links(messages, incident_ids, "routes_affected")
+        operator_links = [link for link in get_distinct_links(
+            messages, incident_ids, "operators_affected", "affected_operator_ref")
+            if link[0] in get_operators()]
+
+        with conn.cursor() as cur:
+            with timings.time("load_routes"):
+                execute_values(cur, """INSERT INTO route_affected (route_name) VALUES %s
+                               ON CONFLICT DO NOTHING;""", routes)
+            with timings.time("load_route_link"):
+                execute_values(cur, """INSERT INTO incident_route_link (route_id, incident_id)
+                               VALUES %s ON CONFLICT DO NOTHING;""", route_links,
+                               template="""((SELECT route_id FROM route_affected
+                               WHERE route_name = %s), %s)""")
+            with timings.time("load_operator_link"):
+                execute_values(cur, """INSERT INTO incident_operator_link (operator_id, incident_id)
+                               VALUES %s ON CONFLICT DO NOTHING;""", operator_links,
+                               template="""((SELECT operator_id FROM operator
+                               WHERE operator_code = %s), %s)""")
+        with timings.time("load_current_incident"):
+            load_current_incidents(conn, messages, incident_ids)
+        with timings.time("commit"):
+            conn.commit()
+    except Exception:
+        if not conn.closed:
+            conn.rollback()
+        raise
+
+
+def is_connection_error(error: Exception) -> bool:
+    """
+    Returns whether an error means the database could not
+    be reached, rather than that the data was rejected
+    """
+    return isinstance(error, (ConnectionError, psycopg2.OperationalError,
+                              psycopg2.InterfaceError))
 
 
-def load_all_incidents(msg):
+class IncidentBatchLoader:
     """
-    Calls all of the load functions
+    Gathers incoming incident messages and loads them
+    with one set of normalised bulk statements, once max_messages have
+    arrived or max_wait_ms has passed since the first message of
+    the batch. A failed batch is retried message by message, so
+    one bad message does not lose the others. Messages that still
+    fail are forgotten by the seen incident cache, if one is given,
+    so a redelivery is processed again. When a spool is given,
+    loaded and rejected messages are marked done in it, and messages
+    that failed because the database is unreachable are deferred
+    there to be replayed. At most max_queued messages wait to be
+    loaded, defaulting to four batches, so that a slow database
+    blocks the workers adding to it rather than growing the queue
     """
-    load_dotenv()
-    conn = get_connection(os.environ["DB_HOST"], os.environ["DB_NAME"],
-                          os.environ["DB_PASS"], os.environ["DB_USER"])
-    switch_between_schemas(conn, "incident_data")
-    load_priority(conn, msg)
-    load_incident(conn, msg)
-    load_routes(conn, msg)
-    load_route_link(conn, msg)
-    load_operator_link(conn, msg)
+
+    def __init__(self, database: IncidentDatabase, max_messages: int = 100,
+                 max_wait_ms: float = 200, seen_cache=None, spool=None,
+                 max_queued: int = None):
+        self.database = database
+        self.seen_cache = seen_cache
+        self.spool = spool
+        self.max_messages = max_messages
+        self.max_wait_secs = max_wait_ms / 1000
+        self.messages = queue.Queue(maxsize=max_queued or 4 * max_messages)
+        self.stopping = False
+        self.thread = None
+        self.lock = threading.Lock()
+        self.counts = {"loaded": 0, "rejected": 0, "deferred": 0, "batches": 0,
+                       "failed_batches": 0}
+
+    def start(self) -> None:
+        """Starts the thread that gathers and loads batches"""
+        self.thread = threading.Thread(target=self.run, name="incident-batch-loader",
+                                       daemon=True)
+        self.thread.start()
+
+    def add(self, message_data: dict, sequence: int = None) -> None:
+        """
+        Adds one transformed message to the next batch, with its
+        sequence number in the spool if it has one, blocking while
+        max_queued messages are already waiting
+        """
+        self.messages.put((message_data, sequence))
+
+    def next_batch(self) -> list:
+        """
+        Waits for a message, then keeps gathering messages until
+        the batch is full or the wait since its first message is over.
+        Returns None once the loader has been stopped
+        """
+        if self.stopping:
+            return None
+        first = self.messages.get()
+        if first is None:
+            return None
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait_secs
+
+        while len(batch) < self.max_messages:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self.messages.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is None:
+                self.stopping = True
+                break
+            batch.append(item)
+
+        return batch
+
+    def load_batch(self, batch: list) -> None:
+        """
+        Loads a batch in a single transaction, falling back
+        to one transaction per message if the batch fails
+        """
+        try:
+            with timings.time("load_batch"):
+                load_normalised_incidents(self.database.get_connection(),
+                                          [message_data for message_data, _ in batch])
+            logging.info("Recorded %s incident messages.", len(batch))
+            self.count("batches")
+            self.count("loaded", len(batch))
+            self.mark_done(batch)
+            return
+        except Exception as e:
+            self.count("failed_batches")
+            if len(batch) == 1 or is_connection_error(e):
+                self.record_failure(batch, e)
+                return
+            logging.warning("Batch of %s messages failed (%s) - loading individually",
+                            len(batch), e)
+
+        for item in batch:
+            try:
+                load_normalised_incidents(self.database.get_connection(), [item[0]])
+                self.count("loaded")
+                self.mark_done([item])
+            except Exception as e:
+                self.record_failure([item], e)
+
+    def mark_done(self, batch: list) -> None:
+        """Marks loaded messages as done in the spool"""
+        if self.spool is not None:
+            self.spool.mark_done([sequence for _, sequence in batch if sequence is not None])
+
+    def record_failure(self, batch: list, error: Exception) -> None:
+        """
+        Logs messages that could not be loaded. If the database
+        was unreachable and they are spooled, they are deferred
+        for replay. Otherwise they are marked done and forgotten
+        in the seen incident cache
+        """
+        sequences = [sequence for _, sequence in batch if sequence is not None]
+        if self.spool is not None and is_connection_error(error) and sequences:
+            logging.error("Database unavailable (%s) - deferring %s incident messages",
+                          error, len(batch))
+            self.spool.defer(sequences)
+            self.count("deferred", len(sequences))
+            return
+
+        logging.error("Failed to record incident: %s", error)
+        self.count("rejected", len(batch))
+        self.mark_done(batch)
+        if self.seen_cache is not None:
+            for message_data, _ in batch:
+                self.seen_cache.forget(message_data["incident_number"], message_data["version"])
+
+    def count(self, outcome: str, messages: int = 1) -> None:
+        """Adds to one of the loader's counters"""
+        with self.lock:
+            self.counts[outcome] += messages
+
+    def stats(self) -> dict:
+        """Returns the number of messages waiting and the counters"""
+        with self.lock:
+            return {"waiting": self.messages.qsize(), "capacity": self.messages.maxsize,
+                    **self.counts}
+
+    def run(self) -> None:
+        """Loads batches until the loader is stopped"""
+        while True:
+            batch = self.next_batch()
+            if batch is None:
+                return
+            self.load_batch(batch)
+
+    def stop(self) -> None:
+        """Loads any messages still waiting, then stops the loader"""
+        self.messages.put(None)
+        if self.thread is not None:
+            self.thread.join()
@@ -1,40 +1,228 @@
 """Sends messages to SNs"""
 
+import logging
+import queue
+import random
+import threading
+import time
+from collections import deque
+
 from boto3 import client
 from boto3.resources.base import ServiceResource
 
+from metrics import timings
+from operators import get_operator_codes
+
+
+TOPIC_ARN_PREFIX = "arn:aws:sns:eu-west-2:129033205317:rail-incidents-"
+
+OPERATOR_CODES = get_operator_codes()
+
+
+def build_incident_text(message_data: dict, heading: str) -> str:
+    """
+    Returns the text message describing an incident,
+    under the given heading
+    """
+    text_msg = f"\n\n\U0001F684 {heading} \U0001F684:"
+    text_msg += f"\n\nSummary: {message_data['summary']}"
+    text_msg += f"\n\nPriority: {message_data['incident_priority']}"
+    text_msg += f"\n\nRoutes affected:"
+    for route in message_data["routes_affected"]:
+        text_msg += f"\n• {route}"
+    start_time = message_data["start_time"]
+    end_time = message_data["end_time"]
+    if start_time and end_time:
+        text_msg += f"\n\nDuration: {start_time} to {end_time}"
+    elif start_time:
+        text_msg += f"\n\nStart time: {start_time} End time: Unknown"
+
+    return text_msg
+
 
-def send_incident_notification(message_data: dict, sns: ServiceResource):
+def build_incident_notifications(message_data: dict) -> list:
     """
-    Accepts a dictionary containing incident data
-    and sends it to the SNS topic(s) corresponding
-    to the operator code(s), resulting in SMS
-    notifications
+    Accepts a dictionary containing incident data and
+    returns a (topic ARN, text message) pair for each
+    affected operator that has an SNS topic
     """
+    notifications = []
+
     for operator in message_data["operators_affected"]:
         operator_code = operator["affected_operator_ref"]
         operator_name = operator["affected_operator_name"]
-        priority = message_data["incident_priority"]
-        summary = message_data["summary"]
-        start_time = message_data["start_time"]
-        end_time = message_data["end_time"]
-        routes_affected = message_data["routes_affected"]
-        if operator_code in ['LO', 'VT', 'CC', 'CS', 'CH', 'XC',
-                             'EM', 'XR', 'ES', 'GC', 'LE', 'GW',
-                             'HX', 'HT', 'GR', 'LD', 'ME', 'NT',
-                             'SR', 'SE', 'TP', 'AW', 'LM', 'GX',
-                             'GN', 'SN', 'TL', 'SW', 'IL']:
-            text_msg = f"\n\n\U0001F684 {operator_name} incident \U0001F684:"
-            text_msg += f"\n\nSummary: {summary}"
-            text_msg += f"\n\nPriority: {priority}"
-            text_msg += f"\n\nRoutes affected:"
-            for route in routes_affected:
-                text_msg += f"\n• {route}"
-            if start_time and end_time:
-                text_msg += f"\n\nDuration: {start_time} to {end_time}"
-            elif start_time:
-                text_msg += f"\n\nStart time: {start_time} End time: Unknown"
-            sns.publish(
-                TopicArn=f"arn:aws:sns:eu-west-2:129033205317:rail-incidents-{operator_code}",
-                Message=f"{text_msg}"
-            )
+        if operator_code in OPERATOR_CODES:
+            text_msg = build_incident_text(message_data, f"{operator_name} incident")
+            notifications.append((f"{TOPIC_ARN_PREFIX}{operator_code}", text_msg))
+
+    return notifications
+
+
+def get_publish_target(target: str) -> dict:
+    """Returns the publish argument for a topic ARN or a phone number"""
+    if target.startswith("arn:"):
+        return {"TopicArn": target}
+    return {"PhoneNumber": target}
+
+
+def generate_sns_client(access_key_id: str, secret_access_key: str,
+                        endpoint_url: str = None) -> ServiceResource:
+    """
+    Returns an SNS client. An endpoint URL points
+    the client at a local SNS stand-in instead of AWS
+    """
+    return client("sns", region_name="eu-west-2", endpoint_url=endpoint_url,
+                  aws_access_key_id=access_key_id,
+                  aws_secret_access_key=secret_access_key)
+
+
+class LocalSNS:
+    """
+    An in-memory stand-in for the SNS client, which records
+    published messages instead of sending them. It can be made
+    slow, or made to fail a number of times, to exercise the
+    dispatcher without AWS
+    """
+
+    def __init__(self, delay_secs: float = 0, failures: int = 0):
+        self.delay_secs = delay_secs
+        self.failures = failures
+        self.published = []
+        self.lock = threading.Lock()
+
+    def publish(self, Message: str, TopicArn: str = None, PhoneNumber: str = None) -> dict:
+        """Records the message, or raises while failures remain"""
+        time.sleep(self.delay_secs)
+        with self.lock:
+            if self.failures > 0:
+                self.failures -= 1
+                raise ConnectionError("Local SNS failure")
+            self.published.append({"TopicArn": TopicArn, "PhoneNumber": PhoneNumber,
+                                   "Message": Message})
+            return {"MessageId": str(len(self.published))}
+
+
+class NotificationDispatcher:
+    """
+    Publishes incident notifications from a bounded queue on a
+    pool of threads, so a slow SNS call never holds up the
+    database write. Each topic's publish is retried on its own,
+    with exponential backoff, before it is counted as failed.
+    With a subscription index, the people subscribed to an
+    incident's routes are texted directly. They are queued in
+    groups of up to sms_group_size numbers sharing one message,
+    so one large match is spread across the threads, but SNS
+    has no batch publish to phone numbers, so each number in a
+    group is still published on its own
+    """
+
+    def __init__(self, sns: ServiceResource, workers: int = 4, max_size: int = 1000,
+                 max_attempts: int = 3, retry_base_secs: float = 0.5,
+                 subscriptions=None, sms_group_size: int = 10):
+        self.sns = sns
+        self.workers = workers
+        self.subscriptions = subscriptions
+        self.sms_group_size = sms_group_size
+        self.max_attempts = max_attempts
+        self.retry_base_secs = retry_base_secs
+        self.notifications = queue.Queue(maxsize=max_size)
+        self.threads = []
+        self.lock = threading.Lock()
+        self.counts = {"queued": 0, "sent": 0, "retried": 0, "failed": 0}
+        self.publish_secs = deque(maxlen=1000)
+
+    def start(self) -> None:
+        """Starts the publishing threads"""
+        for number in range(self.workers):
+            thread = threading.Thread(target=self.work, name=f"sns-dispatcher-{number}",
+                                      daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def dispatch(self, message_data: dict) -> None:
+        """
+        Queues a notification for each affected operator's topic,
+        and groups of route subscribers' numbers to be texted,
+        blocking only while the queue is full
+        """
+        for topic_arn, text_msg in build_incident_notifications(message_data):
+            self.queue_notification([topic_arn], text_msg)
+
+        if self.subscriptions is None:
+            return
+        with timings.time("match_subscribers"):
+            recipients = sorted(self.subscriptions.match(message_data["routes_affected"]))
+        if recipients:
+            text_msg = build_incident_text(message_data, "Incident on your route")
+            for start in range(0, len(recipients), self.sms_group_size):
+                self.queue_notification(recipients[start:start + self.sms_group_size], text_msg)
+
+    def queue_notification(self, targets: list, text_msg: str) -> None:
+        """Queues one message for a group of topics or phone numbers"""
+        self.notifications.put((targets, text_msg))
+        with self.lock:
+            self.counts["queued"] += len(targets)
+
+    def publish(self, target: str, text_msg: str) -> None:
+        """
+        Publishes one notification to a topic or phone number,
+        retrying with jittered exponential backoff until
+        max_attempts is reached
+        """
+        for attempt in range(1, self.max_attempts + 1):
+            started = time.monotonic()
+            try:
+                self.sns.publish(**get_publish_target(target), Message=f"{text_msg}")
+                publish_secs = time.monotonic() - started
+                timings.record("publish", publish_secs)
+                with self.lock:
+                    self.counts["sent"] += 1
+                    self.publish_secs.append(publish_secs)
+                return
+            except Exception as e:
+                if attempt == self.max_attempts:
+                    logging.error("Failed to notify %s after %s attempts: %s",
+                                  target if target.startswith("arn:") else "a route subscriber",
+                                  attempt, e)
+                    with self.lock:
+                        self.counts["failed"] += 1
+                    return
+                with self.lock:
+                    self.counts["retried"] += 1
+                time.sleep(self.retry_base_secs * 2 ** (attempt - 1) * random.uniform(0.5, 1.5))
+
+    def work(self) -> None:
+        """
+        Publishes notifications until a None sentinel is taken,
+        with one publish per topic or phone number in a group
+        """
+        while True:
+            notification = self.notifications.get()
+            if notification is None:
+                self.notifications.task_done()
+                return
+            targets, text_msg = notification
+            for target in targets:
+                self.publish(target, text_msg)
+            self.notifications.task_done()
+
+    def stop(self) -> None:
+        """Publishes the notifications already queued, then stops"""
+        for _ in self.threads:
+            self.notifications.put(None)
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+
+    def stats(self) -> dict:
+        """
+        Returns the delivery counters, queue depth and
+        the latencies of the last 1000 publishes
+        """
+        with self.lock:
+            publish_secs = sorted(self.publish_secs)
+            return {"depth": self.notifications.qsize(), **self.counts,
+                    "publish_p50_ms": round(publish_secs[len(publish_secs) // 2] * 1000, 1)
+                    if publish_secs else None,
+                    "publish_max_ms": round(publish_secs[-1] * 1000, 1)
+                    if publish_secs else None}
@@ -0,0 +1,210 @@
+"""Metrics file: records how long each stage of the incident pipeline takes, and exposes it with the pipeline's counters"""
+
+import bisect
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable
+
+
+LATENCY_BUCKETS_SECS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                        0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+METRIC_PREFIX = "incident_pipeline"
+
+
+class StageTimings:
+    """
+    Keeps a latency histogram for each pipeline stage, along
+    with its most recent durations for percentile summaries
+    """
+
+    def __init__(self, max_samples: int = 100000, buckets: tuple = LATENCY_BUCKETS_SECS):
+        self.max_samples = max_samples
+        self.buckets = buckets
+        self.samples = {}
+        self.histograms = {}
+        self.lock = threading.Lock()
+
+    def record(self, stage: str, secs: float) -> None:
+        """Records one duration for a stage"""
+        with self.lock:
+            samples = self.samples.get(stage)
+            if samples is None:
+                samples = self.samples[stage] = deque(maxlen=self.max_samples)
+            samples.append(secs)
+            histogram = self.histograms.setdefault(
+                stage, {"buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0})
+            index = bisect.bisect_left(self.buckets, secs)
+            if index < len(self.buckets):
+                histogram["buckets"][index] += 1
+            histogram["sum"] += secs
+            histogram["count"] += 1
+
+    @contextmanager
+    def time(self, stage: str):
+        """Records how long the body of the with block takes"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - started)
+
+    def percentiles(self, points: tuple = (50, 95, 99)) -> dict:
+        """
+        Returns the sample count and the given percentiles,
+        in milliseconds, for each stage
+        """
+        with self.lock:
+            samples = {stage: sorted(secs) for stage, secs in self.samples.items()}
+
+        summary = {}
+        for stage, secs in samples.items():
+            summary[stage] = {"count": len(secs)}
+            for point in points:
+                index = min(len(secs) - 1, int(len(secs) * point / 100))
+                summary[stage][f"p{point}_ms"] = round(secs[index] * 1000, 3)
+
+        return summary
+
+    def render(self) -> list:
+        """Returns the histograms in Prometheus text exposition format"""
+        name = f"{METRIC_PREFIX}_stage_duration_seconds"
+        lines = [f"# HELP {name} Time spent in each stage of the incident pipeline.",
+                 f"# TYPE {name} histogram"]
+        with self.lock:
+            for stage, histogram in sorted(self.histograms.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, histogram["buckets"]):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+                lines.append(f'{name}_bucket{{stage="{stage}",le="+Inf"}} {histogram["count"]}')
+                lines.append(f'{name}_sum{{stage="{stage}"}} {histogram["sum"]:.6f}')
+                lines.append(f'{name}_count{{stage="{stage}"}} {histogram["count"]}')
+
+        return lines
+
+    def reset(self) -> None:
+        """Clears all recorded durations"""
+        with self.lock:
+            self.samples = {}
+            self.histograms = {}
+
+    def drain(self) -> dict:
+        """
+        Returns the durations recorded since the last drain,
+        with each stage's samples and histogram, and clears them
+        """
+        with self.lock:
+            samples, histograms = self.samples, self.histograms
+            self.samples = {}
+            self.histograms = {}
+
+        return {stage: {"samples": list(samples.get(stage, ())), **histogram}
+                for stage, histogram in histograms.items()}
+
+    def merge(self, drained: dict) -> None:
+        """Adds durations drained from another process's timings"""
+        with self.lock:
+            for stage, recorded in drained.items():
+                samples = self.samples.get(stage)
+                if samples is None:
+                    samples = self.samples[stage] = deque(maxlen=self.max_samples)
+                samples.extend(recorded["samples"])
+                histogram = self.histograms.setdefault(
+                    stage, {"buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0})
+                histogram["buckets"] = [count + added for count, added
+                                        in zip(histogram["buckets"], recorded["buckets"])]
+                histogram["sum"] += recorded["sum"]
+                histogram["count"] += recorded["count"]
+
+
+class StatsRegistry:
+    """
+    Collects the stats dictionaries of the pipeline's components.
+    Keys named as counters are exposed as counters and every other
+    numeric value as a gauge, such as a queue depth
+    """
+
+    def __init__(self):
+        self.sources = {}
+        self.lock = threading.Lock()
+
+    def register(self, component: str, stats: Callable, counters: tuple = ()) -> None:
+        """Registers a component's stats method and which of its keys are counters"""
+        with self.lock:
+            self.sources[component] = (stats, set(counters))
+
+    def render(self) -> list:
+        """Returns every component's stats in Prometheus text exposition format"""
+        lines = []
+        with self.lock:
+            sources = sorted(self.sources.items())
+
+        for component, (stats, counters) in sources:
+            for key, value in stats().items():
+                if isinstance(value, bool) or not isinstance(value, (int, float)):
+                    continue
+                name = f"{METRIC_PREFIX}_{component}_{key}"
+                if key in counters:
+                    name += "_total"
+                lines.append(f"# TYPE {name} {'counter' if key in counters else 'gauge'}")
+                lines.append(f"{name} {value}")
+
+        return lines
+
+
+def combine_stats(snapshots: list, summed: tuple) -> dict:
+    """
+    Combines the stats of several copies of one component, such as
+    the batch loaders of the worker processes. The keys in summed
+    are added up, and every other numeric value takes the largest
+    """
+    combined = {}
+    for stats in snapshots:
+        for key, value in stats.items():
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                continue
+            if key in summed:
+                combined[key] = combined.get(key, 0) + value
+            else:
+                combined[key] = max(combined.get(key, value), value)
+
+    return combined
+
+
+timings = StageTimings()
+registry = StatsRegistry()
+
+
+def render_metrics() -> str:
+    """Returns all of the pipeline's metrics in Prometheus text exposition format"""
+    return "\n".join(timings.render() + registry.render()) + "\n"
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """Serves the metrics at /metrics"""
+
+    def do_GET(self):
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+        body = render_metrics().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logging.debug(format, *args)
+
+
+def start_metrics_server(port: int) -> ThreadingHTTPServer:
+    """Serves the metrics over HTTP on a background thread"""
+    server = ThreadingHTTPServer(("", port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    return server
@@ -1,5 +1,6 @@
 """Pipeline file: pulls in and cleans live XML incident data, and loads it into the incidents database schema"""
 
+import functools
 import os
 import time
 import socket
@@ -8,25 +9,37 @@ import xml.etree.ElementTree as ET
 
 import boto3
 from boto3 import client
-import pandas as pd
 import stomp
 from dotenv import load_dotenv
 
-from extract_incident_data import (
-    extract_and_transform_incident_data,
-    flatten_incident_data
-)
-from load_incident_data import load_all_incidents
-from messages import send_incident_notification
+from acks import IncidentAcker
+from extract_incident_data import extract_and_transform_incident_data, namespaces
+from load_incident_data import IncidentDatabase, IncidentBatchLoader
+from messages import NotificationDispatcher, generate_sns_client
+from process_pool import WORKER_COUNTERS, WORKER_QUEUE_SIZES, PartitionedProcessPool
+from metrics import combine_stats, registry, render_metrics, start_metrics_server, timings
+from reconnect import BrokerSettings, ReconnectSupervisor
+from seen_incidents import SeenIncidentCache, get_incident_key
+from spool import IncidentSpool
+from subscriptions import SubscriptionIndex
+from work_queue import IncidentWorkQueue
 
 
-def connect_and_subscribe(connection, USERNAME, PASSWORD, CLIENT_ID, TOPIC):
-    """insert docstring here"""
-    if stomp.__version__[0] < 5:
+def connect_and_subscribe(connection, USERNAME, PASSWORD, CLIENT_ID, TOPIC,
+                          ack_mode='auto', prefetch_size=None):
+    """
+    Connects to the broker and subscribes to the topic through
+    a durable subscription. In client-individual ack mode, the
+    prefetch size limits how many unacknowledged frames the
+    broker sends before waiting for acks
+    """
+    if int(stomp.__version__.split(".")[0]) < 5:
         connection.start()
 
     connect_header = {'client-id': USERNAME + '-' + CLIENT_ID}
     subscribe_header = {'activemq.subscriptionName': CLIENT_ID}
+    if prefetch_size:
+        subscribe_header['activemq.prefetchSize'] = str(prefetch_size)
 
     connection.connect(username=USERNAME,
                        passcode=PASSWORD,
@@ -35,7 +48,7 @@ def connect_and_subscribe(connection, USERNAME, PASSWORD, CLIENT_ID, TOPIC):
 
     connection.subscribe(destination=TOPIC,
                          id='1',
-                         ack='auto',
+                         ack=ack_mode,
                          headers=subscribe_header)
 
 
@@ -43,6 +56,9 @@ class StompClient(stomp.ConnectionListener):
     """
     Creates a Stomp Client class
     """
+    acker = None
+    supervisor = None
+
     def on_heartbeat(self):
         logging.info('Received a heartbeat')
 
@@ -53,31 +69,91 @@ class StompClient(stomp.ConnectionListener):
         logging.error(message)
 
     def on_disconnected(self):
-        logging.warning(
-            'Disconnected - waiting %s seconds before exiting' % RECONNECT_DELAY_SECS)
-        time.sleep(RECONNECT_DELAY_SECS)
-        connect_and_subscribe(self.conn, USERNAME, PASSWORD, CLIENT_ID, TOPIC)
+        """
+        Hands reconnecting to the supervisor, so the listener
+        thread is not held up and the workers keep draining
+        the frames already queued
+        """
+        logging.warning('Disconnected - reconnecting')
+        if self.acker is not None:
+            self.acker.forget_all()
+        self.supervisor.disconnected()
+
+    def connect(self):
+        """Connects and resubscribes using the client's broker settings"""
+        connect_and_subscribe(self.conn, self.settings.username, self.settings.password,
+                              self.settings.client_id, self.settings.topic,
+                              self.settings.ack_mode, self.settings.prefetch_size)
 
     def on_connecting(self, host_and_port):
         logging.info('Connecting to ' + host_and_port[0])
 
     def on_message(self, frame):
         """
-        When a message is received, it is extracted,
-        decoded, parsed, cleaned, formatted, turned
-        into a DataFrame, and loaded into the incidents
-        schema of the database
+        When a message is received, it is dropped if its
+        incident version has already been processed, and
+        otherwise spooled and handed to the work queue, so
+        the listener thread only enqueues. With an acker, a
+        spooled frame is acknowledged once it is done with,
+        and a duplicate no sooner than its original
+        """
+        if self.supervisor is not None:
+            self.supervisor.frame_received()
+        with timings.time("receive"):
+            if not self.seen_cache.claim(frame.body):
+                logging.debug("Dropped duplicate incident message")
+                if self.acker is not None:
+                    self.acker.ack_duplicate(get_incident_key(frame.body), frame)
+                return
+            sequence = self.spool.append(frame.body)
+            if self.acker is not None:
+                self.acker.track(sequence, frame, get_incident_key(frame.body))
+            self.work_queue.put((sequence, frame))
+
+    def process_frame(self, item):
+        """
+        Runs on a worker thread: the frame is extracted,
+        decoded, parsed, cleaned, formatted, and handed
+        to the batch loader for the
+        incidents schema of the database. Notifications are
+        queued with the dispatcher, so they are published
+        while the batch is written. Errors are logged by
+        the worker, and the message is forgotten by the seen
+        incident cache so a redelivery is processed again
         """
+        sequence, frame = item
         try:
-            message_data = extract_and_transform_incident_data(
-                frame.body.decode(), namespaces)
-            send_incident_notification(message_data, sns)
-            flattened_msg = flatten_incident_data(message_data)
-            msg_df = pd.DataFrame(flattened_msg)
-            load_all_incidents(msg_df)
-            logging.info("Incident recorded.")
-        except Exception as e:
-            logging.error(str(e))
+            with timings.time("extract"):
+                message_data = extract_and_transform_incident_data(
+                    frame.body.decode(), namespaces)
+            self.dispatcher.dispatch(message_data)
+        except Exception:
+            self.spool.mark_done([sequence])
+            incident_key = get_incident_key(frame.body)
+            if incident_key is not None:
+                self.seen_cache.forget(*incident_key)
+            raise
+        self.batch_loader.add(message_data, sequence)
+
+    def replay_spool(self) -> int:
+        """
+        Hands the frames left unloaded in the spool back to
+        the batch loader, in order, and returns how many were
+        replayed. Their notifications are not sent again
+        """
+        replayed = 0
+        for sequence, body in self.spool.pending():
+            try:
+                message_data = extract_and_transform_incident_data(
+                    body.decode(), namespaces)
+            except Exception as e:
+                logging.error("Failed to replay spooled frame %s: %s", sequence, e)
+                self.spool.mark_done([sequence])
+                continue
+            self.batch_loader.add(message_data, sequence)
+            replayed += 1
+
+        return replayed
 
 
 if __name__ == "__main__":
@@ -93,8 +169,8 @@ if __name__ == "__main__":
     s3 = client("s3", aws_access_key_id=os.environ["ACCESS_KEY_ID"],
                 aws_secret_access_key=os.environ["SECRET_ACCESS_KEY"])
     boto3.setup_default_session(region_name='eu-west-2')
-    sns = client("sns", aws_access_key_id=os.environ["ACCESS_KEY_ID"],
-                 aws_secret_access_key=os.environ["SECRET_ACCESS_KEY"])
+    sns = generate_sns_client(ACCESS_KEY_ID, SECRET_ACCESS_KEY,
+                              os.environ.get("SNS_ENDPOINT_URL"))
 
     USERNAME = os.environ["USERNAME"]
     PASSWORD = os.environ["PASSWORD"]
@@ -106,12 +182,26 @@ if __name__ == "__main__":
     CLIENT_ID = socket.getfqdn()
     HEARTBEAT_INTERVAL_MS = 30000
     HEARTBEAT_RESPONSE_TIMEOUT = 25000
-    RECONNECT_DELAY_SECS = 15
-
-    namespaces = {
-        'ns2': 'http://nationalrail.co.uk/xml/common',
-        'ns3': 'http://nationalrail.co.uk/xml/incident'
-    }
+    RECONNECT_INITIAL_SECS = float(os.environ.get("RECONNECT_INITIAL_SECS", 0.5))
+    RECONNECT_MAX_SECS = float(os.environ.get("RECONNECT_MAX_SECS", 60))
+    WORKER_COUNT = int(os.environ.get("WORKER_COUNT", 4))
+    PROCESS_COUNT = int(os.environ.get("PROCESS_COUNT", 0))
+    QUEUE_SIZE = int(os.environ.get("QUEUE_SIZE", 1000))
+    BATCH_SIZE = int(os.environ.get("BATCH_SIZE", 100))
+    BATCH_WAIT_MS = float(os.environ.get("BATCH_WAIT_MS", 200))
+    SEEN_CACHE_SIZE = int(os.environ.get("SEEN_CACHE_SIZE", 10000))
+    SPOOL_DIR = os.environ.get("SPOOL_DIR", "spool")
+    SPOOL_FSYNC_INTERVAL_MS = float(os.environ.get("SPOOL_FSYNC_INTERVAL_MS", 50))
+    REPLAY_CHECK_SECS = 5
+    ACK_MODE = os.environ.get("ACK_MODE", "client-individual")
+    PREFETCH_SIZE = int(os.environ.get("PREFETCH_SIZE", 100))
+    ACK_BATCH_SIZE = int(os.environ.get("ACK_BATCH_SIZE", 50))
+    ACK_INTERVAL_MS = float(os.environ.get("ACK_INTERVAL_MS", 100))
+    NOTIFY_WORKERS = int(os.environ.get("NOTIFY_WORKERS", 4))
+    SMS_GROUP_SIZE = int(os.environ.get("SMS_GROUP_SIZE", 10))
+    SUBSCRIPTION_REFRESH_SECS = float(os.environ.get("SUBSCRIPTION_REFRESH_SECS", 60))
+    STATS_INTERVAL_SECS = 60
+    METRICS_PORT = int(os.environ.get("METRICS_PORT", 0))
 
     if USERNAME == '':
         logging.error(
@@ -120,14 +210,88 @@ if __name__ == "__main__":
 
     conn = stomp.Connection12([(HOSTNAME, HOSTPORT)],
                               auto_decode=False,
+                              heartbeats=(HEARTBEAT_INTERVAL_MS, HEARTBEAT_INTERVAL_MS),
+                              reconnect_attempts_max=1
                               )
 
     client = StompClient()
     client.conn = conn
+    client.settings = BrokerSettings(USERNAME, PASSWORD, CLIENT_ID, TOPIC,
+                                     ACK_MODE, PREFETCH_SIZE)
+    database = IncidentDatabase(os.environ["DB_HOST"], os.environ["DB_NAME"],
+                                os.environ["DB_PASS"], os.environ["DB_USER"])
+    client.seen_cache = SeenIncidentCache(SEEN_CACHE_SIZE)
+    if database.is_available():
+        logging.info("Warmed seen incident cache with %s versions.",
+                     client.seen_cache.warm(database.get_connection()))
+    else:
+        logging.warning("Database unavailable - starting with an empty seen incident cache")
+    client.spool = IncidentSpool(SPOOL_DIR, fsync_interval_ms=SPOOL_FSYNC_INTERVAL_MS)
+    client.spool.open()
+    client.batch_loader = IncidentBatchLoader(database, BATCH_SIZE, BATCH_WAIT_MS,
+                                              client.seen_cache, client.spool)
+    client.batch_loader.start()
+    if PROCESS_COUNT:
+        client.work_queue = PartitionedProcessPool(
+            client.spool, client.seen_cache, PROCESS_COUNT, QUEUE_SIZE,
+            batch_size=BATCH_SIZE, batch_wait_ms=BATCH_WAIT_MS, notify_workers=NOTIFY_WORKERS,
+            sms_group_size=SMS_GROUP_SIZE, subscription_refresh_secs=SUBSCRIPTION_REFRESH_SECS)
+    else:
+        subscriptions = SubscriptionIndex(SUBSCRIPTION_REFRESH_SECS)
+        subscriptions.start(database)
+        client.dispatcher = NotificationDispatcher(sns, NOTIFY_WORKERS, QUEUE_SIZE,
+                                                   subscriptions=subscriptions,
+                                                   sms_group_size=SMS_GROUP_SIZE)
+        client.dispatcher.start()
+        client.work_queue = IncidentWorkQueue(client.process_frame, WORKER_COUNT, QUEUE_SIZE)
+    client.work_queue.start()
+    if ACK_MODE != "auto":
+        client.acker = IncidentAcker(conn, ACK_BATCH_SIZE, ACK_INTERVAL_MS)
+        client.acker.start()
+        client.spool.on_done = client.acker.done
+    client.supervisor = ReconnectSupervisor(
+        client.connect, conn.is_connected, RECONNECT_INITIAL_SECS, RECONNECT_MAX_SECS,
+        is_caught_up=lambda: client.work_queue.stats()["depth"] == 0)
+    client.supervisor.start()
+    registry.register("work_queue", client.work_queue.stats,
+                      ("enqueued", "processed", "failed", "blocked_puts", "restarts"))
+    if PROCESS_COUNT:
+        registry.register("batch_loader", lambda: combine_stats(
+            [client.work_queue.component_stats("batch_loader"), client.batch_loader.stats()],
+            WORKER_COUNTERS["batch_loader"] + WORKER_QUEUE_SIZES),
+            WORKER_COUNTERS["batch_loader"])
+        for component in ("notifications", "subscriptions"):
+            registry.register(component, functools.partial(client.work_queue.component_stats,
+                                                           component),
+                              WORKER_COUNTERS[component])
+    else:
+        registry.register("batch_loader", client.batch_loader.stats,
+                          WORKER_COUNTERS["batch_loader"])
+        registry.register("notifications", client.dispatcher.stats,
+                          WORKER_COUNTERS["notifications"])
+        registry.register("subscriptions", subscriptions.stats, WORKER_COUNTERS["subscriptions"])
+    registry.register("seen_cache", client.seen_cache.stats,
+                      ("new", "duplicates", "changed", "unkeyed"))
+    registry.register("spool", client.spool.stats,
+                      ("appended", "fsyncs", "deferred", "replayed"))
+    registry.register("reconnect", client.supervisor.stats,
+                      ("disconnects", "attempts", "reconnects"))
+    if client.acker is not None:
+        registry.register("acks", client.acker.stats, ("acked", "failed", "held_duplicates"))
+    if METRICS_PORT:
+        start_metrics_server(METRICS_PORT)
+        logging.info("Serving metrics on port %s at /metrics", METRICS_PORT)
     conn.set_listener('', client)
-    connect_and_subscribe(conn, USERNAME, PASSWORD, CLIENT_ID, TOPIC)
+    client.connect()
 
+    last_stats = time.monotonic()
     while True:
-        time.sleep(1)
+        time.sleep(REPLAY_CHECK_SECS)
+        if client.spool.needs_replay() and database.is_available():
+            logging.info("Replayed %s spooled incident messages.", client.replay_spool())
+        if time.monotonic() - last_stats >= STATS_INTERVAL_SECS:
+            last_stats = time.monotonic()
+            if not METRICS_PORT:
+                logging.info("Metrics:\n%s", render_metrics())
 
     conn.disconnect()
@@ -0,0 +1,35 @@
+"""Operators file: reads the train operator reference data shipped with the pipeline"""
+
+import csv
+from functools import lru_cache
+from pathlib import Path
+
+
+OPERATORS_FILE = Path(__file__).parent / "operators.csv"
+
+OPERATORS_VERSION = 3
+
+
+def read_operators(path: Path = OPERATORS_FILE) -> dict:
+    """
+    Reads the operator reference data, keyed by operator code.
+    A blank customer satisfaction is read as None
+    """
+    with open(path, newline="", encoding="utf-8") as file:
+        return {row["operator_code"]: {
+                    "operator_code": row["operator_code"],
+                    "operator_name": row["operator_name"],
+                    "customer_satisfaction": float(row["customer_satisfaction"])
+                    if row["customer_satisfaction"] else None}
+                for row in csv.DictReader(file)}
+
+
+@lru_cache(maxsize=None)
+def get_operators() -> dict:
+    """Returns the operator reference data, read once per process"""
+    return read_operators()
+
+
+def get_operator_codes() -> list:
+    """Returns every known operator code"""
+    return list(get_operators())
@@ -0,0 +1,371 @@
+"""Process pool file: fans incident frames out to worker processes partitioned by incident number"""
+
+import logging
+import multiprocessing
+import multiprocessing.connection
+import os
+import queue
+import threading
+import time
+import zlib
+from typing import Callable
+
+from extract_incident_data import extract_and_transform_incident_data, namespaces
+from load_incident_data import IncidentBatchLoader, IncidentDatabase
+from messages import NotificationDispatcher, generate_sns_client
+from metrics import combine_stats, timings
+from seen_incidents import get_incident_key
+from subscriptions import SubscriptionIndex
+
+
+WORKER_COUNTERS = {
+    "batch_loader": ("loaded", "rejected", "deferred", "batches", "failed_batches"),
+    "notifications": ("queued", "sent", "retried", "failed"),
+    "subscriptions": ("lookups", "matches"),
+    "frames": ("processed", "failed")
+}
+
+WORKER_QUEUE_SIZES = ("waiting", "capacity", "depth")
+
+
+def make_live_components() -> tuple:
+    """
+    Builds a worker process's own database and SNS
+    client from the environment
+    """
+    database = IncidentDatabase(os.environ["DB_HOST"], os.environ["DB_NAME"],
+                                os.environ["DB_PASS"], os.environ["DB_USER"])
+    sns = generate_sns_client(os.environ["ACCESS_KEY_ID"], os.environ["SECRET_ACCESS_KEY"],
+                              os.environ.get("SNS_ENDPOINT_URL"))
+    return database, sns
+
+
+def get_partition(body: bytes, partitions: int) -> int:
+    """
+    Returns the partition for a frame, by a stable hash of its
+    incident number, so every version of an incident goes to the
+    same worker. Frames without an incident number go to the first
+    """
+    incident_key = get_incident_key(body)
+    if incident_key is None:
+        return 0
+    return zlib.crc32(incident_key[0].encode()) % partitions
+
+
+class ResultReporter:
+    """
+    Stands in for the spool and seen incident cache inside
+    a worker process, sending what the batch loader reports
+    back to the parent to be applied there, along with the
+    process's stage timings and component stats, over the
+    process's own pipe. It also counts the frames the process
+    has handed to its batch loader or failed to parse
+    """
+
+    def __init__(self, results: multiprocessing.connection.Connection):
+        self.results = results
+        self.lock = threading.Lock()
+        self.counts = {"processed": 0, "failed": 0}
+
+    def send(self, kind: str, value) -> None:
+        with self.lock:
+            self.results.send((kind, value))
+
+    def mark_done(self, sequences: list) -> None:
+        if sequences:
+            self.send("done", sequences)
+
+    def defer(self, sequences: list) -> None:
+        if sequences:
+            self.send("defer", sequences)
+
+    def forget(self, incident_number: str, version: str) -> None:
+        self.send("forget", (incident_number, version))
+
+    def count(self, outcome: str) -> None:
+        """Counts a frame as processed or failed"""
+        with self.lock:
+            self.counts[outcome] += 1
+
+    def stats(self) -> dict:
+        """Returns how many frames were processed and failed"""
+        with self.lock:
+            return dict(self.counts)
+
+    def report_stats(self, components: dict) -> None:
+        """
+        Sends the timings recorded since the last report and
+        the current stats of each of the process's components
+        """
+        self.send("stats", {"timings": timings.drain(),
+                            **{name: component.stats() for name, component in components.items()}})
+
+
+def run_partition(frames: multiprocessing.Queue,
+                  results: multiprocessing.connection.Connection, make_components: Callable,
+                  batch_size: int, batch_wait_ms: float, notify_workers: int, sms_group_size: int,
+                  subscription_refresh_secs: float, stats_interval_secs: float) -> None:
+    """
+    Runs in a worker process: parses each frame of its partition
+    in arrival order, queues its notifications and loads it
+    through the process's own batch loader and connection.
+    Its timings and stats are reported every stats_interval_secs
+    """
+    logging.basicConfig(format='%(asctime)s %(levelname)s\t%(message)s', level=logging.INFO)
+    database, sns = make_components()
+    reporter = ResultReporter(results)
+    subscriptions = SubscriptionIndex(subscription_refresh_secs)
+    subscriptions.start(database)
+    dispatcher = NotificationDispatcher(sns, notify_workers, subscriptions=subscriptions,
+                                        sms_group_size=sms_group_size)
+    dispatcher.start()
+    batch_loader = IncidentBatchLoader(database, batch_size, batch_wait_ms, reporter, reporter)
+    batch_loader.start()
+    components = {"batch_loader": batch_loader, "notifications": dispatcher,
+                  "subscriptions": subscriptions, "frames": reporter}
+
+    last_report = time.monotonic()
+    while True:
+        if time.monotonic() - last_report >= stats_interval_secs:
+            reporter.report_stats(components)
+            last_report = time.monotonic()
+        try:
+            item = frames.get(timeout=stats_interval_secs)
+        except queue.Empty:
+            continue
+        if item is None:
+            break
+        sequence, body = item
+        try:
+            with timings.time("extract"):
+                message_data = extract_and_transform_incident_data(body.decode(), namespaces)
+            dispatcher.dispatch(message_data)
+        except Exception as e:
+            logging.error("Worker process failed to process frame: %s", e)
+            reporter.count("failed")
+            reporter.mark_done([sequence])
+            incident_key = get_incident_key(body)
+            if incident_key is not None:
+                reporter.forget(*incident_key)
+            continue
+        batch_loader.add(message_data, sequence)
+        reporter.count("processed")
+
+    batch_loader.stop()
+    dispatcher.stop()
+    subscriptions.stop()
+    reporter.report_stats(components)
+    results.close()
+    database.close()
+
+
+class PartitionedProcessPool:
+    """
+    A drop-in for the work queue that hands each frame to one of
+    several worker processes, chosen by incident number, through a
+    bounded queue per process. Frames of one incident are handled
+    in order by one process, while the processes together use every
+    core. Each process reports back over its own pipe, and a collector
+    thread applies the results to the parent's spool and seen incident
+    cache, merges the timings and stats, and restarts any process
+    that dies
+    """
+
+    def __init__(self, spool, seen_cache, processes: int = 4, max_size: int = 1000,
+                 make_components: Callable = make_live_components, batch_size: int = 100,
+                 batch_wait_ms: float = 200, notify_workers: int = 4, sms_group_size: int = 10,
+                 subscription_refresh_secs: float = 60, stats_interval_secs: float = 5):
+        self.spool = spool
+        self.seen_cache = seen_cache
+        self.processes = processes
+        self.context = multiprocessing.get_context("spawn")
+        self.max_size = max_size
+        self.partitions = [self.context.Queue(maxsize=max_size) for _ in range(processes)]
+        self.results = [None] * processes
+        self.worker_args = (make_components, batch_size, batch_wait_ms, notify_workers,
+                            sms_group_size, subscription_refresh_secs, stats_interval_secs)
+        self.stats_interval_secs = stats_interval_secs
+        self.workers = []
+        self.collector = None
+        self.stopping = False
+        self.lock = threading.Lock()
+        self.assigned = {}
+        self.worker_stats = {}
+        self.retired_stats = []
+        self.counts = {"enqueued": 0, "blocked_puts": 0, "restarts": 0}
+        self.partition_counts = [0] * processes
+
+    def start_worker(self, number: int) -> multiprocessing.Process:
+        """
+        Starts the worker process for one partition, with a pipe
+        for its results that the parent keeps the reading end of
+        """
+        reader, writer = self.context.Pipe(duplex=False)
+        worker = self.context.Process(target=run_partition, name=f"incident-partition-{number}",
+                                      args=(self.partitions[number], writer, *self.worker_args),
+                                      daemon=True)
+        worker.start()
+        writer.close()
+        self.results[number] = reader
+        return worker
+
+    def start(self) -> None:
+        """Starts the worker processes and the result collector"""
+        self.workers = [self.start_worker(number) for number in range(self.processes)]
+        self.collector = threading.Thread(target=self.collect, name="incident-partition-results",
+                                          daemon=True)
+        self.collector.start()
+
+    def put(self, item) -> None:
+        """
+        Sends a spooled frame to its incident's partition,
+        blocking while that partition's queue is full
+        """
+        sequence, frame = item
+        partition = get_partition(frame.body, self.processes)
+        with self.lock:
+            self.assigned[sequence] = partition
+            frames = self.partitions[partition]
+        try:
+            frames.put_nowait((sequence, frame.body))
+        except queue.Full:
+            logging.warning("Partition %s full - blocking listener", partition)
+            with self.lock:
+                self.counts["blocked_puts"] += 1
+            while True:
+                try:
+                    frames.put((sequence, frame.body), timeout=self.stats_interval_secs)
+                    break
+                except queue.Full:
+                    with self.lock:
+                        if sequence not in self.assigned:
+                            break
+                        frames = self.partitions[partition]
+        with self.lock:
+            self.counts["enqueued"] += 1
+            self.partition_counts[partition] += 1
+
+    def collect(self) -> None:
+        """
+        Applies the workers' results until every worker has
+        stopped, waking as soon as a worker sends a result or dies
+        """
+        while True:
+            readers = [reader for reader in self.results if reader is not None]
+            if not readers:
+                return
+            ready = multiprocessing.connection.wait(
+                readers + [worker.sentinel for worker in self.workers if worker.is_alive()],
+                self.stats_interval_secs)
+            for number, reader in enumerate(self.results):
+                if reader in ready:
+                    self.receive(number)
+            self.restart_dead_workers()
+
+    def receive(self, number: int) -> None:
+        """
+        Applies a result from one worker's pipe, closing the
+        pipe once the worker has finished with it
+        """
+        reader = self.results[number]
+        try:
+            self.apply(number, *reader.recv())
+        except (EOFError, OSError) as e:
+            if not self.stopping:
+                logging.error("Lost the results pipe of worker process %s: %s", number, e)
+            reader.close()
+            self.results[number] = None
+
+    def apply(self, number: int, kind: str, value) -> None:
+        """Applies one result reported by a worker"""
+        if kind in ("done", "defer"):
+            with self.lock:
+                for sequence in value:
+                    self.assigned.pop(sequence, None)
+        if kind == "done":
+            self.spool.mark_done(value)
+        elif kind == "defer":
+            self.spool.defer(value)
+        elif kind == "forget":
+            self.seen_cache.forget(*value)
+        elif kind == "stats":
+            timings.merge(value.pop("timings"))
+            with self.lock:
+                self.worker_stats[number] = value
+
+    def restart_dead_workers(self) -> None:
+        """
+        Restarts any worker that has died, with a new queue and
+        pipe, as it may have died holding the locks of its old ones.
+        The frames it was given that are not done, including any
+        left in its old queue, are deferred to be replayed from the
+        spool, once whatever it sent before dying has been applied
+        """
+        if self.stopping:
+            return
+        for number, worker in enumerate(self.workers):
+            if worker.is_alive():
+                continue
+            logging.error("Worker process %s died with exit code %s - restarting it",
+                          number, worker.exitcode)
+            while self.results[number] is not None and self.results[number].poll():
+                self.receive(number)
+            if self.results[number] is not None:
+                self.results[number].close()
+            old_frames = self.partitions[number]
+            with self.lock:
+                self.partitions[number] = self.context.Queue(maxsize=self.max_size)
+                unfinished = sorted(sequence for sequence, partition in self.assigned.items()
+                                    if partition == number)
+                for sequence in unfinished:
+                    del self.assigned[sequence]
+                stats = self.worker_stats.pop(number, {})
+                self.retired_stats.append(
+                    {component: {key: value for key, value in component_stats.items()
+                                 if key in WORKER_COUNTERS[component]}
+                     for component, component_stats in stats.items()})
+                self.counts["restarts"] += 1
+            old_frames.cancel_join_thread()
+            old_frames.close()
+            self.spool.defer(unfinished)
+            self.workers[number] = self.start_worker(number)
+
+    def stop(self) -> None:
+        """
+        Lets every worker finish its queued frames,
+        then stops the workers and the collector
+        """
+        self.stopping = True
+        for frames in self.partitions:
+            frames.put(None)
+        for worker in self.workers:
+            worker.join()
+        if self.collector is not None:
+            self.collector.join()
+        self.workers = []
+
+    def stats(self) -> dict:
+        """
+        Returns the queued frames per partition and the counters,
+        with the frames the workers have processed and failed as
+        of their last report
+        """
+        frame_counts = {"processed": 0, "failed": 0, **self.component_stats("frames")}
+        with self.lock:
+            return {"depth": sum(frames.qsize() for frames in self.partitions),
+                    "processes": self.processes,
+                    "alive": sum(worker.is_alive() for worker in self.workers),
+                    "largest_partition_share": round(
+                        max(self.partition_counts) / max(1, self.counts["enqueued"]), 3),
+                    **self.counts, **frame_counts}
+
+    def component_stats(self, component: str) -> dict:
+        """
+        Returns the stats of one component of the workers, such
+        as their batch loaders, combined across the processes.
+        Counters include those of workers that have been restarted
+        """
+        with self.lock:
+            snapshots = [stats[component] for stats in self.worker_stats.values()] + \
+                        [stats[component] for stats in self.retired_stats if component in stats]
+        return combine_stats(snapshots, WORKER_COUNTERS[component] + WORKER_QUEUE_SIZES)
@@ -0,0 +1,148 @@
+"""Reconnect file: restores the broker subscription after a disconnect, away from the listener thread"""
+
+import logging
+import random
+import threading
+import time
+from typing import Callable
+
+
+class BrokerSettings:
+    """
+    The details needed to connect to the broker and
+    resubscribe through the durable subscription
+    """
+
+    def __init__(self, username: str, password: str, client_id: str, topic: str,
+                 ack_mode: str = "client-individual", prefetch_size: int = 100):
+        self.username = username
+        self.password = password
+        self.client_id = client_id
+        self.topic = topic
+        self.ack_mode = ack_mode
+        self.prefetch_size = prefetch_size
+
+
+class ReconnectSupervisor:
+    """
+    Reconnects on its own thread whenever it is told the connection
+    has dropped, retrying with exponential backoff and full jitter.
+    Once reconnected, it times how long the consumer takes to catch
+    up: from the reconnect to the last frame before the feed goes
+    quiet for quiet_secs with is_caught_up returning True
+    """
+
+    def __init__(self, connect: Callable, is_connected: Callable,
+                 initial_delay_secs: float = 0.5, max_delay_secs: float = 60,
+                 is_caught_up: Callable = None, quiet_secs: float = 1):
+        self.connect = connect
+        self.is_connected = is_connected
+        self.initial_delay_secs = initial_delay_secs
+        self.max_delay_secs = max_delay_secs
+        self.is_caught_up = is_caught_up
+        self.quiet_secs = quiet_secs
+        self.disconnected_event = threading.Event()
+        self.stopped = threading.Event()
+        self.lock = threading.Lock()
+        self.thread = None
+        self.disconnected_at = None
+        self.frames_since_reconnect = 0
+        self.last_frame_at = None
+        self.counts = {"disconnects": 0, "attempts": 0, "reconnects": 0}
+        self.downtime_secs = {"last": 0.0, "total": 0.0}
+        self.catch_up_secs = None
+
+    def start(self) -> None:
+        """Starts the supervising thread"""
+        self.thread = threading.Thread(target=self.run, name="stomp-reconnect", daemon=True)
+        self.thread.start()
+
+    def disconnected(self) -> None:
+        """Called by the listener; returns at once and lets the supervisor reconnect"""
+        with self.lock:
+            if self.disconnected_at is None:
+                self.disconnected_at = time.monotonic()
+                self.counts["disconnects"] += 1
+        self.disconnected_event.set()
+
+    def frame_received(self) -> None:
+        """Counts a frame towards the catch-up after a reconnect"""
+        with self.lock:
+            self.frames_since_reconnect += 1
+            self.last_frame_at = time.monotonic()
+
+    def get_delay(self, attempt: int) -> float:
+        """Returns a jittered exponential backoff for an attempt"""
+        return random.uniform(0, min(self.max_delay_secs,
+                                     self.initial_delay_secs * 2 ** (attempt - 1)))
+
+    def reconnect(self) -> None:
+        """Tries to reconnect until it succeeds or the supervisor stops"""
+        attempt = 0
+        while not self.stopped.is_set():
+            attempt += 1
+            with self.lock:
+                self.counts["attempts"] += 1
+            try:
+                self.connect()
+                break
+            except Exception as e:
+                delay = self.get_delay(attempt)
+                logging.warning("Reconnect attempt %s failed (%s) - retrying in %.1f seconds",
+                                attempt, e, delay)
+                self.stopped.wait(delay)
+        else:
+            return
+
+        with self.lock:
+            downtime = time.monotonic() - self.disconnected_at
+            self.disconnected_at = None
+            self.frames_since_reconnect = 0
+            self.last_frame_at = None
+            self.counts["reconnects"] += 1
+            self.downtime_secs["last"] = downtime
+            self.downtime_secs["total"] += downtime
+        logging.info("Reconnected after %.1f seconds and %s attempts", downtime, attempt)
+
+    def measure_catch_up(self) -> None:
+        """Times how long the backlog from the outage takes to clear"""
+        reconnected_at = time.monotonic()
+        while not self.stopped.wait(0.1) and not self.disconnected_event.is_set():
+            with self.lock:
+                frames = self.frames_since_reconnect
+                last_frame_at = self.last_frame_at or reconnected_at
+            if time.monotonic() - last_frame_at < self.quiet_secs or not self.is_caught_up():
+                continue
+            self.catch_up_secs = round(last_frame_at - reconnected_at, 3)
+            logging.info("Caught up on %s frames in %.1f seconds", frames, self.catch_up_secs)
+            return
+
+    def run(self) -> None:
+        """Reconnects after each disconnect until stopped"""
+        while not self.stopped.is_set():
+            if not self.disconnected_event.wait(1):
+                continue
+            self.disconnected_event.clear()
+            if self.is_connected():
+                with self.lock:
+                    self.disconnected_at = None
+                continue
+            self.reconnect()
+            if self.is_caught_up is not None:
+                self.measure_catch_up()
+
+    def stop(self) -> None:
+        """Stops the supervising thread"""
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+
+    def stats(self) -> dict:
+        """Returns the reconnect counters, downtime and the last catch-up time"""
+        with self.lock:
+            down_for = time.monotonic() - self.disconnected_at \
+                if self.disconnected_at is not None else 0.0
+            return {**self.counts, "down_for_secs": round(down_for, 3),
+                    "last_downtime_secs": round(self.downtime_secs["last"], 3),
+                    "total_downtime_secs": round(self.downtime_secs["total"], 3),
+                    "catch_up_secs": self.catch_up_secs}
@@ -0,0 +1,223 @@
+"""Replay file: streams recorded incident messages through the consumer and reports its throughput"""
+
+import argparse
+import importlib
+import logging
+import os
+import tarfile
+import tempfile
+import threading
+import time
+import zipfile
+from pathlib import Path
+
+from dotenv import load_dotenv
+from stomp.utils import Frame
+
+from load_incident_data import IncidentDatabase, IncidentBatchLoader
+from messages import LocalSNS, NotificationDispatcher, generate_sns_client
+from metrics import timings
+from seen_incidents import SeenIncidentCache
+from spool import IncidentSpool
+from work_queue import IncidentWorkQueue
+
+StompClient = importlib.import_module("opendata-nationalrail-client").StompClient
+
+
+def read_payloads(source: str) -> list:
+    """
+    Reads recorded message bodies from a directory of .xml
+    files, or from a .zip or .tar archive of them
+    """
+    path = Path(source)
+    if path.is_dir():
+        payloads = [file.read_bytes() for file in sorted(path.glob("*.xml"))]
+    elif zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as archive:
+            payloads = [archive.read(name) for name in sorted(archive.namelist())
+                        if name.endswith(".xml")]
+    elif tarfile.is_tarfile(path):
+        with tarfile.open(path) as archive:
+            members = sorted((member for member in archive.getmembers()
+                              if member.isfile() and member.name.endswith(".xml")),
+                             key=lambda member: member.name)
+            payloads = [archive.extractfile(member).read() for member in members]
+    else:
+        raise ValueError(f"{source} is not a directory, zip or tar archive")
+
+    if not payloads:
+        raise FileNotFoundError(f"No .xml payloads found in {source}")
+    return payloads
+
+
+class LocalCursor:
+    """
+    A cursor for LocalConnection, which keeps the incident
+    versions it has seen so inserts returning incident ids
+    behave like the incident table's ON CONFLICT DO NOTHING
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.args = []
+        self.rows = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def mogrify(self, template, args) -> bytes:
+        self.args.append(args)
+        return b"()"
+
+    def execute(self, query, args=None) -> None:
+        time.sleep(self.connection.latency_secs)
+        query = query.decode() if isinstance(query, bytes) else query
+        self.rows = []
+        if "RETURNING incident_id" in query:
+            with self.connection.lock:
+                for args in self.args:
+                    number, version = args[0], args[1]
+                    if version not in self.connection.incident_ids:
+                        self.connection.incident_ids[version] = len(self.connection.incident_ids) + 1
+                        self.rows.append({"incident_id": self.connection.incident_ids[version],
+                                          "incident_num": number, "incident_version": version})
+        self.connection.statements += 1
+        self.args = []
+
+    def fetchall(self) -> list:
+        return self.rows
+
+
+class LocalConnection:
+    """An in-memory stand-in for a psycopg2 connection to the incidents schema"""
+
+    encoding = "UTF8"
+    closed = 0
+
+    def __init__(self, latency_secs: float = 0):
+        self.latency_secs = latency_secs
+        self.incident_ids = {}
+        self.statements = 0
+        self.commits = 0
+        self.lock = threading.Lock()
+
+    def cursor(self) -> LocalCursor:
+        return LocalCursor(self)
+
+    def commit(self) -> None:
+        self.commits += 1
+
+    def rollback(self) -> None:
+        pass
+
+
+class LocalIncidentDatabase:
+    """
+    Stands in for IncidentDatabase, handing out one in-memory
+    connection that waits latency_ms on every statement
+    """
+
+    def __init__(self, latency_ms: float = 0):
+        self.conn = LocalConnection(latency_ms / 1000)
+
+    def get_connection(self) -> LocalConnection:
+        return self.conn
+
+    def is_available(self) -> bool:
+        return True
+
+    def close(self) -> None:
+        pass
+
+
+def build_client(database, sns, spool_dir: str, args) -> StompClient:
+    """Builds a StompClient wired up the way the consumer runs it"""
+    client = StompClient()
+    client.seen_cache = SeenIncidentCache(args.seen_cache_size)
+    client.spool = IncidentSpool(spool_dir)
+    client.spool.open()
+    client.dispatcher = NotificationDispatcher(sns, args.notify_workers)
+    client.dispatcher.start()
+    client.batch_loader = IncidentBatchLoader(database, args.batch_size, args.batch_wait_ms,
+                                              client.seen_cache, client.spool)
+    client.batch_loader.start()
+    client.work_queue = IncidentWorkQueue(client.process_frame, args.workers, args.queue_size)
+    client.work_queue.start()
+    return client
+
+
+def replay(client: StompClient, payloads: list, rate: float, repeat: int) -> float:
+    """
+    Sends each payload to on_message as a STOMP frame, at the given
+    rate per second or as fast as possible if the rate is 0. Waits
+    until every message has been loaded and notified, and returns
+    the seconds taken
+    """
+    started = time.perf_counter()
+    sent = 0
+    for _ in range(repeat):
+        for payload in payloads:
+            if rate:
+                wait = started + sent / rate - time.perf_counter()
+                if wait > 0:
+                    time.sleep(wait)
+            client.on_message(Frame("MESSAGE", {"message-id": str(sent)}, payload))
+            sent += 1
+
+    client.work_queue.stop()
+    client.batch_loader.stop()
+    client.dispatcher.stop()
+    client.spool.close()
+    return time.perf_counter() - started
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("source", help="directory, zip or tar archive of recorded .xml bodies")
+    parser.add_argument("--rate", type=float, default=0,
+                        help="messages per second to send, or 0 for as fast as possible")
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--local", action="store_true",
+                        help="use in-memory database and SNS stand-ins")
+    parser.add_argument("--db-latency-ms", type=float, default=1)
+    parser.add_argument("--sns-latency-ms", type=float, default=50)
+    parser.add_argument("--keep-duplicates", action="store_true",
+                        help="process repeated payloads instead of dropping them")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--queue-size", type=int, default=1000)
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--batch-wait-ms", type=float, default=200)
+    parser.add_argument("--notify-workers", type=int, default=4)
+    args = parser.parse_args()
+    args.seen_cache_size = 0 if args.keep_duplicates else 10000
+
+    logging.basicConfig(format='%(asctime)s %(levelname)s\t%(message)s', level=logging.WARNING)
+
+    if args.local:
+        database = LocalIncidentDatabase(args.db_latency_ms)
+        sns = LocalSNS(args.sns_latency_ms / 1000)
+    else:
+        load_dotenv()
+        database = IncidentDatabase(os.environ["DB_HOST"], os.environ["DB_NAME"],
+                                    os.environ["DB_PASS"], os.environ["DB_USER"])
+        sns = generate_sns_client(os.environ["ACCESS_KEY_ID"], os.environ["SECRET_ACCESS_KEY"],
+                                  os.environ.get("SNS_ENDPOINT_URL"))
+
+    payloads = read_payloads(args.source)
+
+    with tempfile.TemporaryDirectory() as spool_dir:
+        client = build_client(database, sns, spool_dir, args)
+        elapsed = replay(client, payloads, args.rate, args.repeat)
+
+    sent = len(payloads) * args.repeat
+    print(f"{sent} messages in {elapsed:.2f}s ({sent / elapsed:.1f} messages/s)")
+    print(f"Work queue: {client.work_queue.stats()}")
+    print(f"Notifications: {client.dispatcher.stats()}")
+    print(f"Seen incident cache: {client.seen_cache.stats()}")
+    for stage, summary in timings.percentiles().items():
+        print(f"{stage:<24}" + "  ".join(f"{name}={value}" for name, value in summary.items()))
+    database.close()
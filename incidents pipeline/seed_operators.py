@@ -0,0 +1,24 @@
+"""Seed file: seeds the operator table from the operator reference data"""
+
+import logging
+import os
+
+from dotenv import load_dotenv
+
+from load_incident_data import get_connection, seed_operator_table, switch_between_schemas
+from operators import OPERATORS_VERSION, get_operators
+
+
+if __name__ == "__main__":
+
+    load_dotenv()
+    logging.basicConfig(format='%(asctime)s %(levelname)s\t%(message)s', level=logging.INFO)
+
+    conn = get_connection(os.environ["DB_HOST"], os.environ["DB_NAME"],
+                          os.environ["DB_PASS"], os.environ["DB_USER"])
+    switch_between_schemas(conn, "incident_data")
+    operators = get_operators()
+    seed_operator_table(conn, operators)
+    logging.info("Seeded %s operators from version %s of the operator reference data.",
+                 len(operators), OPERATORS_VERSION)
+    conn.close()
@@ -0,0 +1,110 @@
+"""Seen incidents file: remembers recently processed incident versions so redelivered frames can be dropped"""
+
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+
+from psycopg2.extensions import connection
+
+
+INCIDENT_NUMBER_PATTERN = re.compile(rb"<(?:\w+:)?IncidentNumber>\s*([^<\s]+)\s*<")
+VERSION_PATTERN = re.compile(rb"<(?:\w+:)?Version>\s*([^<\s]+)\s*<")
+
+
+def get_incident_key(body: bytes) -> tuple:
+    """
+    Reads the incident number and version from a raw
+    message body without parsing the XML. Returns None
+    if either cannot be found
+    """
+    incident_number = INCIDENT_NUMBER_PATTERN.search(body)
+    version = VERSION_PATTERN.search(body)
+    if incident_number is None or version is None:
+        return None
+    return (incident_number.group(1).decode(), version.group(1).decode())
+
+
+def get_content_hash(body: bytes) -> str:
+    """Returns a short hash of a raw message body"""
+    return hashlib.blake2b(body, digest_size=16).hexdigest()
+
+
+class SeenIncidentCache:
+    """
+    A bounded, least recently used record of the (incident number,
+    version) pairs already processed, with a hash of each message
+    body. A frame whose pair has been seen with the same content,
+    or which was loaded before the consumer started, is a duplicate
+    """
+
+    def __init__(self, max_size: int = 10000):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.counts = {"new": 0, "duplicates": 0, "changed": 0, "unkeyed": 0}
+
+    def remember(self, key: tuple, content_hash: str = None) -> None:
+        """
+        Records a pair as processed, evicting the least
+        recently used pair once the cache is full. A hash
+        of None matches any content
+        """
+        with self.lock:
+            self.entries[key] = content_hash
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def forget(self, incident_number: str, version: str) -> None:
+        """Removes a pair, so it is processed again if redelivered"""
+        with self.lock:
+            self.entries.pop((incident_number, version), None)
+
+    def claim(self, body: bytes) -> bool:
+        """
+        Returns True and records the message if it has not been
+        seen, or False if it is a duplicate. Messages without an
+        incident number and version are always processed
+        """
+        key = get_incident_key(body)
+        if key is None:
+            with self.lock:
+                self.counts["unkeyed"] += 1
+            return True
+
+        content_hash = get_content_hash(body)
+        with self.lock:
+            if key in self.entries:
+                seen_hash = self.entries[key]
+                self.entries.move_to_end(key)
+                if seen_hash is None or seen_hash == content_hash:
+                    self.counts["duplicates"] += 1
+                    return False
+                self.counts["changed"] += 1
+            else:
+                self.counts["new"] += 1
+
+        self.remember(key, content_hash)
+        return True
+
+    def warm(self, conn: connection) -> int:
+        """
+        Fills the cache with the most recently loaded incident
+        versions, returning how many were added
+        """
+        with conn.cursor() as cur:
+            cur.execute("""SELECT incident_num, incident_version FROM incident
+                        ORDER BY incident_id DESC LIMIT %s;""", (self.max_size,))
+            rows = cur.fetchall()
+        conn.rollback()
+
+        for row in reversed(rows):
+            self.remember((str(row["incident_num"]), str(row["incident_version"])))
+
+        return len(rows)
+
+    def stats(self) -> dict:
+        """Returns the cache size and the outcome counts"""
+        with self.lock:
+            return {"size": len(self.entries), **self.counts}
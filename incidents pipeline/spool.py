@@ -0,0 +1,255 @@
+"""Spool file: keeps a durable, append-only local log of raw incident frames until they are loaded"""
+
+import logging
+import os
+import struct
+import threading
+import zlib
+from pathlib import Path
+
+
+RECORD_HEADER = struct.Struct("<QII")
+SEGMENT_SUFFIX = ".seg"
+CHECKPOINT_FILE = "checkpoint"
+
+
+def read_records(path: Path):
+    """
+    Yields the sequence number, body and end offset of each
+    intact record in a segment file, stopping at the first
+    torn or corrupt record. A segment removed since it
+    was listed yields nothing
+    """
+    try:
+        segment = open(path, "rb")
+    except FileNotFoundError:
+        return
+    with segment:
+        offset = 0
+        while True:
+            header = segment.read(RECORD_HEADER.size)
+            if len(header) < RECORD_HEADER.size:
+                return
+            sequence, length, crc = RECORD_HEADER.unpack(header)
+            body = segment.read(length)
+            if len(body) < length or zlib.crc32(body) != crc:
+                return
+            offset += RECORD_HEADER.size + length
+            yield sequence, body, offset
+
+
+def get_first_sequence(path: Path) -> int:
+    """Returns the sequence number a segment file starts at"""
+    return int(path.stem)
+
+
+class IncidentSpool:
+    """
+    An append-only log of raw frames, split into segment files.
+    Each record is framed by its sequence number, length and a
+    CRC32 of the body. Appends are fsynced in batches every
+    fsync_interval_ms. Frames are marked done once loaded, and the
+    checkpoint moves past every frame done in sequence. Frames that
+    could not be loaded are deferred and handed back by pending, in
+    order, to be replayed
+    """
+
+    def __init__(self, directory: str, segment_bytes: int = 64 * 1024 * 1024,
+                 fsync_interval_ms: float = 50):
+        self.directory = Path(directory)
+        self.segment_bytes = segment_bytes
+        self.fsync_interval_secs = fsync_interval_ms / 1000
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+        self.segment = None
+        self.next_sequence = 1
+        self.checkpoint = 0
+        self.done = set()
+        self.in_flight = set()
+        self.dirty = False
+        self.checkpoint_dirty = False
+        self.replay_needed = False
+        self.on_done = None
+        self.counts = {"appended": 0, "fsyncs": 0, "deferred": 0, "replayed": 0}
+
+    def open(self) -> None:
+        """
+        Reads the checkpoint, recovers the last segment by cutting
+        off any torn record at its end, and starts the fsync thread
+        """
+        self.directory.mkdir(parents=True, exist_ok=True)
+        checkpoint_path = self.directory / CHECKPOINT_FILE
+        if checkpoint_path.exists():
+            self.checkpoint = int(checkpoint_path.read_text())
+
+        segments = self.list_segments()
+        if segments:
+            last_segment = segments[-1]
+            self.next_sequence = get_first_sequence(last_segment)
+            valid_bytes = 0
+            for sequence, _, offset in read_records(last_segment):
+                self.next_sequence = sequence + 1
+                valid_bytes = offset
+            if valid_bytes < last_segment.stat().st_size:
+                logging.warning("Truncating torn record at the end of %s", last_segment)
+                os.truncate(last_segment, valid_bytes)
+            self.segment = open(last_segment, "ab")
+
+        self.next_sequence = max(self.next_sequence, self.checkpoint + 1)
+        if self.segment is None:
+            self.start_segment()
+        self.replay_needed = self.next_sequence - 1 > self.checkpoint
+
+        self.thread = threading.Thread(target=self.run, name="incident-spool-fsync", daemon=True)
+        self.thread.start()
+
+    def list_segments(self) -> list:
+        """Returns the segment files in sequence order"""
+        return sorted(self.directory.glob(f"*{SEGMENT_SUFFIX}"))
+
+    def start_segment(self) -> None:
+        """Closes the current segment and starts a new one"""
+        if self.segment is not None:
+            self.segment.flush()
+            os.fsync(self.segment.fileno())
+            self.segment.close()
+        path = self.directory / f"{self.next_sequence:020d}{SEGMENT_SUFFIX}"
+        self.segment = open(path, "ab")
+        directory_fd = os.open(self.directory, os.O_RDONLY)
+        try:
+            os.fsync(directory_fd)
+        finally:
+            os.close(directory_fd)
+
+    def append(self, body: bytes) -> int:
+        """
+        Appends a raw frame body and returns its sequence
+        number. It is on disk by the next fsync
+        """
+        with self.lock:
+            if self.segment.tell() >= self.segment_bytes:
+                self.start_segment()
+            sequence = self.next_sequence
+            self.next_sequence += 1
+            self.segment.write(RECORD_HEADER.pack(sequence, len(body), zlib.crc32(body)) + body)
+            self.in_flight.add(sequence)
+            self.dirty = True
+            self.counts["appended"] += 1
+        return sequence
+
+    def mark_done(self, sequences: list) -> None:
+        """
+        Marks frames as finished with, moving the checkpoint
+        past every frame that is done in sequence, then passes
+        the sequence numbers to on_done if it is set
+        """
+        with self.lock:
+            for sequence in sequences:
+                self.in_flight.discard(sequence)
+                if sequence > self.checkpoint:
+                    self.done.add(sequence)
+            while self.checkpoint + 1 in self.done:
+                self.checkpoint += 1
+                self.done.remove(self.checkpoint)
+            self.checkpoint_dirty = True
+
+        if self.on_done is not None:
+            self.on_done(sequences)
+
+    def defer(self, sequences: list) -> None:
+        """Leaves frames in the spool to be replayed later"""
+        with self.lock:
+            for sequence in sequences:
+                self.in_flight.discard(sequence)
+            self.counts["deferred"] += len(sequences)
+            self.replay_needed = True
+
+    def needs_replay(self) -> bool:
+        """Returns whether any frames have been deferred since the last replay"""
+        with self.lock:
+            return self.replay_needed
+
+    def pending(self):
+        """
+        Yields the sequence number and body of each frame after the
+        checkpoint that is neither done nor being processed, in order.
+        Each frame yielded is treated as being processed again
+        """
+        with self.lock:
+            self.segment.flush()
+            self.replay_needed = False
+            checkpoint = self.checkpoint
+            end_sequence = self.next_sequence
+            segments = self.list_segments()
+
+        for number, path in enumerate(segments):
+            if number + 1 < len(segments) and \
+                    get_first_sequence(segments[number + 1]) <= checkpoint + 1:
+                continue
+            for sequence, body, _ in read_records(path):
+                if sequence <= checkpoint:
+                    continue
+                if sequence >= end_sequence:
+                    return
+                with self.lock:
+                    if sequence in self.done or sequence in self.in_flight:
+                        continue
+                    self.in_flight.add(sequence)
+                    self.counts["replayed"] += 1
+                yield sequence, body
+
+    def sync(self) -> None:
+        """
+        Fsyncs appended frames, then saves the checkpoint and
+        removes segments holding only frames before it
+        """
+        with self.lock:
+            if self.dirty:
+                self.segment.flush()
+                os.fsync(self.segment.fileno())
+                self.dirty = False
+                self.counts["fsyncs"] += 1
+            if not self.checkpoint_dirty:
+                return
+            self.checkpoint_dirty = False
+            checkpoint = self.checkpoint
+            current_segment = Path(self.segment.name)
+
+        temporary_path = self.directory / f"{CHECKPOINT_FILE}.tmp"
+        with open(temporary_path, "w") as checkpoint_file:
+            checkpoint_file.write(str(checkpoint))
+            checkpoint_file.flush()
+            os.fsync(checkpoint_file.fileno())
+        os.replace(temporary_path, self.directory / CHECKPOINT_FILE)
+
+        segments = self.list_segments()
+        for path, next_path in zip(segments, segments[1:]):
+            if path != current_segment and get_first_sequence(next_path) <= checkpoint + 1:
+                path.unlink()
+
+    def run(self) -> None:
+        """Fsyncs the spool every interval until it is closed"""
+        while not self.stopped.wait(self.fsync_interval_secs):
+            try:
+                self.sync()
+            except OSError as e:
+                logging.error("Failed to sync incident spool: %s", e)
+
+    def close(self) -> None:
+        """Stops the fsync thread and syncs and closes the spool"""
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+        self.sync()
+        self.segment.close()
+
+    def stats(self) -> dict:
+        """
+        Returns how many frames are not yet done, how
+        many are being processed, and the counters
+        """
+        with self.lock:
+            return {"unfinished": self.next_sequence - 1 - self.checkpoint,
+                    "in_flight": len(self.in_flight), "checkpoint": self.checkpoint,
+                    **self.counts}
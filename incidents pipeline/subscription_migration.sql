@@ -0,0 +1,24 @@
+-- Adds the subscription table for route and station subscriptions to an
+-- existing incident_data schema. A table added by an earlier run is given
+-- the phone number format check, without checking the rows already in it.
+
+SET search_path TO incident_data;
+
+CREATE TABLE IF NOT EXISTS subscription (
+    subscription_id INT GENERATED ALWAYS AS IDENTITY,
+    phone_number TEXT NOT NULL CHECK (phone_number ~ '^\+[1-9][0-9]{1,14}$'),
+    route_term TEXT NOT NULL,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (subscription_id),
+    UNIQUE (phone_number, route_term)
+);
+
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_constraint
+                   WHERE conrelid = 'subscription'::REGCLASS
+                   AND conname = 'subscription_phone_number_check') THEN
+        ALTER TABLE subscription ADD CONSTRAINT subscription_phone_number_check
+            CHECK (phone_number ~ '^\+[1-9][0-9]{1,14}$') NOT VALID;
+    END IF;
+END $$;
@@ -0,0 +1,163 @@
+"""Subscriptions file: matches the routes an incident affects to the people subscribed to them"""
+
+import logging
+import re
+import threading
+from collections import Counter
+
+from psycopg2.extensions import connection
+
+
+STOP_WORDS = {"all", "and", "at", "between", "from", "line", "lines", "of", "on", "route",
+              "routes", "service", "services", "the", "to", "train", "trains", "via"}
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+APOSTROPHES = str.maketrans("", "", "'’")
+
+PHONE_NUMBER_PATTERN = re.compile(r"\+[1-9]\d{1,14}")
+
+
+def normalise_phone_number(phone_number: str) -> str:
+    """
+    Returns a phone number without spaces, raising a ValueError
+    unless it is in E.164 format, such as +447700900123, as route
+    subscribers are texted directly rather than through a topic
+    """
+    phone_number = phone_number.replace(" ", "")
+    if not PHONE_NUMBER_PATTERN.fullmatch(phone_number):
+        raise ValueError(f"{phone_number} is not an E.164 phone number, such as +447700900123")
+    return phone_number
+
+
+def add_subscription(conn: connection, phone_number: str, route_term: str) -> None:
+    """
+    Subscribes a phone number to incidents on a route or
+    at a station, once its format has been checked
+    """
+    phone_number = normalise_phone_number(phone_number)
+    with conn.cursor() as cur:
+        cur.execute("""INSERT INTO subscription (phone_number, route_term)
+                    VALUES (%s, %s) ON CONFLICT DO NOTHING;""",
+                    (phone_number, route_term.strip()))
+    conn.commit()
+
+
+def normalise_tokens(text: str) -> frozenset:
+    """
+    Returns the lower-cased words of a route or station name,
+    without punctuation or the words every route description uses.
+    Apostrophes are dropped rather than splitting a word, so
+    "King's Lynn" and "Kings Lynn" give the same words
+    """
+    return frozenset(token for token in TOKEN_PATTERN.findall(text.lower().translate(APOSTROPHES))
+                     if token not in STOP_WORDS)
+
+
+def build_index(subscriptions: list) -> dict:
+    """
+    Indexes (phone number, route term) pairs by the word of each term
+    that the fewest terms share, keeping every word so a candidate
+    can be checked against the whole term. Keying on the rarest word
+    keeps common words such as a city name from collecting candidates
+    that mostly fail the check
+    """
+    terms = [(normalise_tokens(route_term), phone_number)
+             for phone_number, route_term in subscriptions]
+    frequency = Counter(token for tokens, _ in terms for token in tokens)
+
+    index = {}
+    for tokens, phone_number in terms:
+        if not tokens:
+            continue
+        key = min(sorted(tokens), key=lambda token: frequency[token])
+        index.setdefault(key, []).append((tokens, phone_number))
+
+    return index
+
+
+class SubscriptionIndex:
+    """
+    An inverted index of the route and station subscriptions, so
+    the phone numbers subscribed to an incident's routes are found
+    by looking up each word of the routes, rather than checking
+    every subscription. A subscription matches a route when every
+    word of its term is in the route. The index is rebuilt from the
+    subscription table every refresh_secs
+    """
+
+    def __init__(self, refresh_secs: float = 60):
+        self.refresh_secs = refresh_secs
+        self.index = {}
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+        self.counts = {"subscriptions": 0, "lookups": 0, "matches": 0}
+
+    def load(self, conn: connection) -> int:
+        """
+        Rebuilds the index from the subscription table, returning
+        its size. Numbers not in E.164 format are left out, as
+        SNS cannot text them
+        """
+        with conn.cursor() as cur:
+            cur.execute("SELECT phone_number, route_term FROM subscription;")
+            rows = cur.fetchall()
+        conn.commit()
+
+        subscriptions = []
+        for row in rows:
+            try:
+                subscriptions.append((normalise_phone_number(row["phone_number"]),
+                                      row["route_term"]))
+            except ValueError as e:
+                logging.warning("Skipping route subscription: %s", e)
+        index = build_index(subscriptions)
+        with self.lock:
+            self.index = index
+            self.counts["subscriptions"] = len(subscriptions)
+        return len(subscriptions)
+
+    def start(self, database) -> None:
+        """Starts the thread that keeps the index up to date"""
+        self.thread = threading.Thread(target=self.run, args=(database,),
+                                       name="subscription-index", daemon=True)
+        self.thread.start()
+
+    def run(self, database) -> None:
+        """Reloads the index every refresh_secs until stopped"""
+        while not self.stopped.is_set():
+            try:
+                self.load(database.get_connection())
+            except Exception as e:
+                logging.warning("Could not refresh route subscriptions: %s", e)
+            self.stopped.wait(self.refresh_secs)
+
+    def stop(self) -> None:
+        """Stops the refreshing thread"""
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+
+    def match(self, routes: list) -> set:
+        """Returns the phone numbers subscribed to any of the routes"""
+        with self.lock:
+            index = self.index
+
+        recipients = set()
+        for route in routes or []:
+            route_tokens = normalise_tokens(route)
+            for token in route_tokens:
+                for tokens, phone_number in index.get(token, ()):
+                    if tokens <= route_tokens:
+                        recipients.add(phone_number)
+
+        with self.lock:
+            self.counts["lookups"] += 1
+            self.counts["matches"] += len(recipients)
+        return recipients
+
+    def stats(self) -> dict:
+        """Returns the number of subscriptions and the lookup counters"""
+        with self.lock:
+            return {"words": len(self.index), **self.counts}
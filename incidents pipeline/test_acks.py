@@ -0,0 +1,88 @@
+import importlib
+from unittest.mock import MagicMock
+
+from acks import IncidentAcker
+from seen_incidents import SeenIncidentCache
+
+StompClient = importlib.import_module("opendata-nationalrail-client").StompClient
+
+INCIDENT_KEY = ("ABC", "1")
+
+
+def make_frame(ack_id: str, body: bytes = b"") -> MagicMock:
+    """Returns a fake STOMP 1.2 frame with the given ack id"""
+    frame = MagicMock()
+    frame.headers = {"ack": ack_id}
+    frame.body = body
+    return frame
+
+
+def sent_acks(connection: MagicMock) -> list:
+    """Returns the ack ids sent on a fake connection, in order"""
+    return [call[0][0] for call in connection.ack.call_args_list]
+
+
+def test_duplicate_is_not_acked_before_the_original_is_done():
+    """Tests that a duplicate of a pending frame is only acked once the original is done"""
+    connection = MagicMock()
+    acker = IncidentAcker(connection)
+    acker.track(1, make_frame("original"), INCIDENT_KEY)
+
+    acker.ack_duplicate(INCIDENT_KEY, make_frame("duplicate"))
+    acker.flush()
+
+    assert sent_acks(connection) == []
+    acker.done([1])
+    acker.flush()
+    assert sent_acks(connection) == ["original", "duplicate"]
+    assert acker.stats()["held_duplicates"] == 1
+
+
+def test_duplicate_of_a_finished_frame_is_acked_straight_away():
+    """Tests that a duplicate is acked without waiting once its original is done"""
+    connection = MagicMock()
+    acker = IncidentAcker(connection)
+    acker.track(1, make_frame("original"), INCIDENT_KEY)
+    acker.done([1])
+
+    acker.ack_duplicate(INCIDENT_KEY, make_frame("duplicate"))
+    acker.flush()
+
+    assert sent_acks(connection) == ["original", "duplicate"]
+    assert acker.stats()["held_duplicates"] == 0
+
+
+def test_forget_all_drops_held_duplicates():
+    """Tests that held duplicate acks are dropped with the original after a disconnect"""
+    connection = MagicMock()
+    acker = IncidentAcker(connection)
+    acker.track(1, make_frame("original"), INCIDENT_KEY)
+    acker.ack_duplicate(INCIDENT_KEY, make_frame("duplicate"))
+
+    acker.forget_all()
+    acker.done([1])
+    acker.flush()
+
+    assert sent_acks(connection) == []
+    assert acker.stats()["unacked"] == 0
+
+
+def test_on_message_holds_a_duplicate_until_the_original_is_committed(example_message, spool):
+    """Tests that a redelivered frame is acked after, not before, the spooled original"""
+    connection = MagicMock()
+    client = StompClient()
+    client.seen_cache = SeenIncidentCache()
+    client.spool = spool
+    client.work_queue = MagicMock()
+    client.acker = IncidentAcker(connection)
+    spool.on_done = client.acker.done
+
+    client.on_message(make_frame("original", example_message))
+    client.on_message(make_frame("duplicate", example_message))
+    client.acker.flush()
+
+    assert sent_acks(connection) == []
+    sequence, _ = client.work_queue.put.call_args[0][0]
+    spool.mark_done([sequence])
+    client.acker.flush()
+    assert sent_acks(connection) == ["original", "duplicate"]
@@ -0,0 +1,23 @@
+from extract_incident_data import extract_and_transform_incident_data, namespaces
+
+
+def test_every_affected_operator_is_extracted(example_message):
+    """Tests that each affected operator is read from its own element, not the first repeated"""
+    message_data = extract_and_transform_incident_data(example_message.decode(), namespaces)
+
+    assert message_data["operators_affected"] == [
+        {"affected_operator_ref": "GW", "affected_operator_name": "Great Western Railway"},
+        {"affected_operator_ref": "XR", "affected_operator_name": "Elizabeth line"},
+        {"affected_operator_ref": "HX", "affected_operator_name": "Heathrow Express"}]
+
+
+def test_incident_fields_are_transformed(example_message):
+    """Tests that the incident fields are extracted and converted to their types"""
+    message_data = extract_and_transform_incident_data(example_message.decode(), namespaces)
+
+    assert message_data["incident_number"] == "A1B2C3D4E5F6A7B8C9D0E1F2A3B4C5D6"
+    assert message_data["version"] == "20230920101600"
+    assert message_data["incident_priority"] == 2
+    assert message_data["routes_affected"] == [
+        "between Reading and London Paddington",
+        "between Hayes & Harlington and Heathrow Terminal 5"]
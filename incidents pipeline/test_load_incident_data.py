@@ -0,0 +1,84 @@
+from unittest.mock import patch, MagicMock
+
+import psycopg2
+
+from load_incident_data import IncidentBatchLoader, get_message_key
+
+
+def make_message(incident_number: str, version: str) -> dict:
+    """Returns a transformed message with just the fields the loader reads"""
+    return {"incident_number": incident_number, "version": version}
+
+
+def test_get_message_key_uses_number_and_version():
+    """Tests that messages are keyed by incident number and version as strings"""
+    assert get_message_key({"incident_number": "ABC", "version": 20230920101600}) == (
+        "ABC", "20230920101600")
+
+
+@patch("load_incident_data.load_normalised_incidents")
+def test_failed_batch_is_loaded_one_message_at_a_time(mock_load):
+    """Tests that one bad message in a batch is rejected while the others are loaded"""
+    def fail_on_bad_incident(conn, messages):
+        if any(message["incident_number"] == "BAD" for message in messages):
+            raise psycopg2.IntegrityError("null value violates not-null constraint")
+
+    mock_load.side_effect = fail_on_bad_incident
+    spool = MagicMock()
+    seen_cache = MagicMock()
+    loader = IncidentBatchLoader(MagicMock(), seen_cache=seen_cache, spool=spool)
+    batch = [(make_message("A", "1"), 1), (make_message("BAD", "2"), 2),
+             (make_message("C", "3"), 3)]
+
+    loader.load_batch(batch)
+
+    assert mock_load.call_count == 4
+    assert loader.stats()["loaded"] == 2
+    assert loader.stats()["rejected"] == 1
+    assert loader.stats()["failed_batches"] == 1
+    done = [sequence for call in spool.mark_done.call_args_list for sequence in call[0][0]]
+    assert sorted(done) == [1, 2, 3]
+    seen_cache.forget.assert_called_once_with("BAD", "2")
+    spool.defer.assert_not_called()
+
+
+@patch("load_incident_data.load_normalised_incidents")
+def test_batch_is_deferred_when_the_database_is_unreachable(mock_load):
+    """Tests that a connection error defers the whole batch without retrying each message"""
+    mock_load.side_effect = psycopg2.OperationalError("could not connect to server")
+    spool = MagicMock()
+    seen_cache = MagicMock()
+    loader = IncidentBatchLoader(MagicMock(), seen_cache=seen_cache, spool=spool)
+
+    loader.load_batch([(make_message("A", "1"), 1), (make_message("B", "2"), 2)])
+
+    assert mock_load.call_count == 1
+    spool.defer.assert_called_once_with([1, 2])
+    spool.mark_done.assert_not_called()
+    seen_cache.forget.assert_not_called()
+    assert loader.stats()["deferred"] == 2
+
+
+@patch("load_incident_data.load_normalised_incidents")
+def test_stop_loads_the_messages_still_waiting(mock_load):
+    """Tests that stopping the loader loads the messages already added"""
+    loader = IncidentBatchLoader(MagicMock(), max_messages=10, max_wait_ms=10000)
+    loader.start()
+    loader.add(make_message("A", "1"))
+    loader.add(make_message("B", "2"))
+
+    loader.stop()
+
+    loaded = [message for call in mock_load.call_args_list for message in call[0][1]]
+    assert loaded == [make_message("A", "1"), make_message("B", "2")]
+
+
+def test_add_blocks_once_the_queue_is_full():
+    """Tests that the loader's queue is bounded by max_queued"""
+    loader = IncidentBatchLoader(MagicMock(), max_messages=2, max_queued=3)
+
+    for number in range(3):
+        loader.add(make_message("A", str(number)))
+
+    assert loader.messages.full()
+    assert loader.stats()["capacity"] == 3
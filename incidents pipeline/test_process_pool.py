@@ -0,0 +1,129 @@
+import functools
+import os
+import signal
+import time
+from unittest.mock import MagicMock, patch
+
+from stomp.utils import Frame
+
+from benchmark_scaling import make_local_components
+from generate_incidents import generate_incidents
+from process_pool import PartitionedProcessPool, get_partition
+from seen_incidents import SeenIncidentCache
+
+
+def make_incident(incident_number: str, version: str) -> bytes:
+    """Returns a message body with just an incident number and version"""
+    return (f"<IncidentNumber>{incident_number}</IncidentNumber>"
+            f"<Version>{version}</Version>").encode()
+
+
+def make_worker(alive: bool) -> MagicMock:
+    """Returns a fake worker process that is alive or dead"""
+    worker = MagicMock()
+    worker.is_alive.return_value = alive
+    return worker
+
+
+def wait_for(condition, timeout_secs: float = 30) -> bool:
+    """Polls a condition until it is true or the timeout passes"""
+    deadline = time.monotonic() + timeout_secs
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.05)
+    return True
+
+
+def test_get_partition_keeps_every_version_of_an_incident_together():
+    """Tests that the partition depends on the incident number and not the version"""
+    partitions = {get_partition(make_incident("ABC", version), 4) for version in range(20)}
+
+    assert len(partitions) == 1
+
+
+def test_get_partition_spreads_incidents_and_sends_unkeyed_frames_to_the_first():
+    """Tests that incidents use every partition, and frames without a number go to the first"""
+    partitions = {get_partition(make_incident(f"INC{number}", "1"), 4) for number in range(100)}
+
+    assert partitions == {0, 1, 2, 3}
+    assert get_partition(b"<Summary>No number</Summary>", 4) == 0
+
+
+def test_apply_marks_frames_done_and_forgets_failed_incidents():
+    """Tests that workers' results are applied to the parent's spool and seen incident cache"""
+    spool, seen_cache = MagicMock(), MagicMock()
+    pool = PartitionedProcessPool(spool, seen_cache, processes=2)
+    pool.assigned = {1: 0, 2: 0}
+
+    pool.apply(0, "done", [1])
+    pool.apply(0, "forget", ("ABC", "1"))
+
+    spool.mark_done.assert_called_once_with([1])
+    seen_cache.forget.assert_called_once_with("ABC", "1")
+    assert pool.assigned == {2: 0}
+
+
+@patch.object(PartitionedProcessPool, "start_worker")
+def test_dead_worker_frames_are_deferred_and_its_counts_kept(mock_start_worker):
+    """Tests that only the dead worker's unfinished frames are deferred, and its counts survive"""
+    spool = MagicMock()
+    pool = PartitionedProcessPool(spool, MagicMock(), processes=2)
+    pool.workers = [make_worker(alive=False), make_worker(alive=True)]
+    pool.assigned = {3: 0, 4: 1, 1: 0}
+    pool.apply(0, "stats", {"timings": {}, "frames": {"processed": 5, "failed": 1},
+                            "batch_loader": {"loaded": 4, "waiting": 2}})
+    pool.apply(1, "stats", {"timings": {}, "frames": {"processed": 2, "failed": 0},
+                            "batch_loader": {"loaded": 1, "waiting": 1}})
+
+    pool.restart_dead_workers()
+
+    spool.defer.assert_called_once_with([1, 3])
+    mock_start_worker.assert_called_once_with(0)
+    assert pool.assigned == {4: 1}
+    assert pool.stats()["restarts"] == 1
+    assert pool.stats()["processed"] == 7
+    assert pool.stats()["failed"] == 1
+    assert pool.component_stats("batch_loader") == {"loaded": 5, "waiting": 1}
+
+
+def test_stats_count_no_frames_before_the_workers_report():
+    """Tests that the processed and failed counters start at zero"""
+    pool = PartitionedProcessPool(MagicMock(), MagicMock(), processes=2)
+
+    assert pool.stats()["processed"] == 0
+    assert pool.stats()["failed"] == 0
+
+
+def test_killed_worker_frames_are_replayed_from_the_spool(spool):
+    """
+    Tests that frames given to a worker process that is killed are left
+    in the spool to be replayed, while the other worker's frames are loaded
+    """
+    messages = generate_incidents(20, 1, 1, 1, 0, seed=1)
+    pool = PartitionedProcessPool(spool, SeenIncidentCache(), processes=2, max_size=100,
+                                  make_components=functools.partial(make_local_components,
+                                                                    60000, 0),
+                                  batch_size=100, batch_wait_ms=10, notify_workers=1,
+                                  stats_interval_secs=0.2)
+    pool.start()
+    try:
+        sent = {}
+        for message in messages:
+            sequence = spool.append(message)
+            sent[sequence] = get_partition(message, 2)
+            pool.put((sequence, Frame("MESSAGE", {}, message)))
+        killed = pool.workers[0].pid
+        os.kill(killed, signal.SIGKILL)
+
+        assert wait_for(lambda: pool.stats()["restarts"] == 1 and spool.needs_replay())
+        assert pool.workers[0].pid != killed
+        replayed = [sequence for sequence, body in spool.pending()]
+        assert replayed
+        assert replayed == sorted(sequence for sequence, partition in sent.items()
+                                  if partition == 0)
+    finally:
+        pool.stopping = True
+        for worker in pool.workers:
+            worker.kill()
+        pool.stop()
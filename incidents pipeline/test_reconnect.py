@@ -0,0 +1,104 @@
+import importlib
+import time
+from unittest.mock import MagicMock, patch
+
+from reconnect import ReconnectSupervisor
+
+client_module = importlib.import_module("opendata-nationalrail-client")
+connect_and_subscribe = client_module.connect_and_subscribe
+
+
+def make_connect(failures: int) -> MagicMock:
+    """Returns a fake connect that fails the given number of times, then succeeds"""
+    return MagicMock(side_effect=[ConnectionError("refused")] * failures + [None])
+
+
+def test_connect_and_subscribe_uses_a_durable_subscription():
+    """Tests that connecting works with the installed stomp.py and subscribes durably"""
+    connection = MagicMock()
+
+    connect_and_subscribe(connection, "user", "pass", "host", "/topic/kb.incidents",
+                          "client-individual", 100)
+
+    connection.start.assert_not_called()
+    assert connection.connect.call_args[1]["headers"] == {"client-id": "user-host"}
+    assert connection.subscribe.call_args[1]["ack"] == "client-individual"
+    assert connection.subscribe.call_args[1]["headers"] == {
+        "activemq.subscriptionName": "host", "activemq.prefetchSize": "100"}
+
+
+@patch("reconnect.random.uniform", side_effect=lambda low, high: high)
+def test_reconnect_backs_off_exponentially_up_to_the_maximum(_mock_uniform):
+    """Tests that each failed attempt waits twice as long as the last, capped at the maximum"""
+    connect = make_connect(4)
+    supervisor = ReconnectSupervisor(connect, lambda: False, initial_delay_secs=1,
+                                     max_delay_secs=3)
+    supervisor.stopped = MagicMock()
+    supervisor.stopped.is_set.return_value = False
+    supervisor.disconnected()
+
+    supervisor.reconnect()
+
+    assert [call[0][0] for call in supervisor.stopped.wait.call_args_list] == [1, 2, 3, 3]
+    assert connect.call_count == 5
+    assert supervisor.stats()["attempts"] == 5
+    assert supervisor.stats()["reconnects"] == 1
+    assert supervisor.stats()["down_for_secs"] == 0
+
+
+def test_get_delay_is_jittered_below_the_backoff():
+    """Tests that the delay is drawn between zero and the capped backoff"""
+    supervisor = ReconnectSupervisor(MagicMock(), lambda: False, initial_delay_secs=0.5,
+                                     max_delay_secs=4)
+
+    delays = [supervisor.get_delay(attempt) for attempt in range(1, 10) for _ in range(20)]
+
+    assert all(0 <= delay <= 4 for delay in delays)
+    assert max(supervisor.get_delay(1) for _ in range(20)) <= 0.5
+
+
+def test_stopping_ends_the_retries_without_a_reconnect():
+    """Tests that a stopped supervisor gives up rather than retrying forever"""
+    supervisor = ReconnectSupervisor(make_connect(100), lambda: False, initial_delay_secs=0.01,
+                                     max_delay_secs=0.01)
+    supervisor.disconnected()
+    supervisor.start()
+    time.sleep(0.1)
+
+    supervisor.stop()
+
+    assert supervisor.stats()["attempts"] >= 2
+    assert supervisor.stats()["reconnects"] == 0
+
+
+def test_disconnect_is_handled_on_the_supervisor_thread():
+    """Tests that a disconnect returns at once and the supervisor reconnects after a retry"""
+    connect = make_connect(1)
+    supervisor = ReconnectSupervisor(connect, lambda: False, initial_delay_secs=0.01)
+    supervisor.start()
+
+    supervisor.disconnected()
+    deadline = time.monotonic() + 2
+    while supervisor.stats()["reconnects"] == 0 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    supervisor.stop()
+
+    assert connect.call_count == 2
+    assert supervisor.stats()["disconnects"] == 1
+    assert supervisor.stats()["reconnects"] == 1
+
+
+def test_disconnect_while_still_connected_does_not_reconnect():
+    """Tests that no reconnect is attempted if the connection is already back"""
+    connect = MagicMock()
+    supervisor = ReconnectSupervisor(connect, lambda: True)
+    supervisor.start()
+
+    supervisor.disconnected()
+    deadline = time.monotonic() + 2
+    while supervisor.disconnected_at is not None and time.monotonic() < deadline:
+        time.sleep(0.01)
+    supervisor.stop()
+
+    connect.assert_not_called()
+    assert supervisor.stats()["attempts"] == 0
@@ -0,0 +1,57 @@
+from seen_incidents import SeenIncidentCache, get_incident_key
+
+
+FIRST_VERSION = b"<IncidentNumber>ABC</IncidentNumber><Version>1</Version><Summary>Delays</Summary>"
+
+
+def test_get_incident_key_reads_number_and_version(example_message):
+    """Tests that the incident number and version are read without parsing the XML"""
+    assert get_incident_key(example_message) == ("A1B2C3D4E5F6A7B8C9D0E1F2A3B4C5D6",
+                                                 "20230920101600")
+
+
+def test_claim_drops_a_repeated_message():
+    """Tests that a message is claimed once and then dropped as a duplicate"""
+    cache = SeenIncidentCache()
+
+    assert cache.claim(FIRST_VERSION)
+    assert not cache.claim(FIRST_VERSION)
+    assert cache.stats()["duplicates"] == 1
+
+
+def test_claim_accepts_changed_content_for_a_seen_version():
+    """Tests that a seen version with different content is processed again"""
+    cache = SeenIncidentCache()
+    cache.claim(FIRST_VERSION)
+
+    assert cache.claim(FIRST_VERSION.replace(b"Delays", b"Cancellations"))
+    assert cache.stats()["changed"] == 1
+
+
+def test_forget_lets_a_message_be_claimed_again():
+    """Tests that a forgotten version is processed again when redelivered"""
+    cache = SeenIncidentCache()
+    cache.claim(FIRST_VERSION)
+
+    cache.forget("ABC", "1")
+
+    assert cache.claim(FIRST_VERSION)
+
+
+def test_claim_always_accepts_messages_without_a_key():
+    """Tests that messages without an incident number and version are never dropped"""
+    cache = SeenIncidentCache()
+
+    assert cache.claim(b"<Summary>No key</Summary>")
+    assert cache.claim(b"<Summary>No key</Summary>")
+    assert cache.stats()["unkeyed"] == 2
+
+
+def test_least_recently_used_version_is_evicted():
+    """Tests that the cache forgets the least recently used version once full"""
+    cache = SeenIncidentCache(max_size=1)
+    cache.claim(FIRST_VERSION)
+
+    cache.claim(FIRST_VERSION.replace(b"ABC", b"DEF"))
+
+    assert cache.claim(FIRST_VERSION)
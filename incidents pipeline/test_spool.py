@@ -0,0 +1,79 @@
+from spool import CHECKPOINT_FILE, IncidentSpool
+
+
+def test_frames_are_replayed_after_reopening(tmp_path):
+    """Tests that appended frames are read back, in order, by a reopened spool"""
+    spool = IncidentSpool(tmp_path)
+    spool.open()
+    bodies = [b"first", b"second", b"third"]
+    sequences = [spool.append(body) for body in bodies]
+    spool.close()
+
+    reopened = IncidentSpool(tmp_path)
+    reopened.open()
+
+    assert reopened.needs_replay()
+    assert list(reopened.pending()) == list(zip(sequences, bodies))
+    reopened.close()
+
+
+def test_torn_record_is_truncated_on_open(tmp_path):
+    """Tests that a partly written record at the end of a segment is cut off"""
+    spool = IncidentSpool(tmp_path)
+    spool.open()
+    spool.append(b"first")
+    spool.append(b"second")
+    spool.close()
+    segment = spool.list_segments()[-1]
+    intact_size = segment.stat().st_size
+    with open(segment, "ab") as file:
+        file.write(b"\x03\x00\x00\x00torn")
+
+    reopened = IncidentSpool(tmp_path)
+    reopened.open()
+
+    assert segment.stat().st_size == intact_size
+    assert [sequence for sequence, _ in reopened.pending()] == [1, 2]
+    assert reopened.append(b"third") == 3
+    reopened.close()
+
+
+def test_sync_saves_checkpoint_and_removes_finished_segments(tmp_path):
+    """Tests that segments holding only frames before the checkpoint are deleted"""
+    spool = IncidentSpool(tmp_path, segment_bytes=1)
+    spool.open()
+    for body in [b"first", b"second", b"third"]:
+        spool.append(body)
+    assert len(spool.list_segments()) == 3
+
+    spool.mark_done([2, 1])
+    spool.sync()
+
+    assert (tmp_path / CHECKPOINT_FILE).read_text() == "2"
+    assert [int(path.stem) for path in spool.list_segments()] == [3]
+    spool.close()
+
+
+def test_checkpoint_waits_for_frames_done_out_of_order(spool):
+    """Tests that the checkpoint only moves past frames that are done in sequence"""
+    for body in [b"first", b"second", b"third"]:
+        spool.append(body)
+
+    spool.mark_done([2, 3])
+    assert spool.checkpoint == 0
+
+    spool.mark_done([1])
+    assert spool.checkpoint == 3
+
+
+def test_pending_yields_deferred_frames_in_order(spool):
+    """Tests that only deferred frames are replayed, in sequence order"""
+    for body in [b"first", b"second", b"third", b"fourth"]:
+        spool.append(body)
+    spool.mark_done([2])
+
+    spool.defer([3, 1])
+
+    assert spool.needs_replay()
+    assert list(spool.pending()) == [(1, b"first"), (3, b"third")]
+    assert list(spool.pending()) == []
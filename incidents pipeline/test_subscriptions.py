@@ -0,0 +1,94 @@
+from unittest.mock import MagicMock
+
+import pytest
+
+from subscriptions import (SubscriptionIndex, add_subscription, normalise_phone_number,
+                           normalise_tokens)
+
+
+def make_index(subscriptions: list) -> SubscriptionIndex:
+    """Returns an index loaded from a fake subscription table"""
+    fake_connection = MagicMock()
+    fake_cursor = fake_connection.cursor().__enter__()
+    fake_cursor.fetchall.return_value = [{"phone_number": phone_number, "route_term": route_term}
+                                         for phone_number, route_term in subscriptions]
+    index = SubscriptionIndex()
+    index.load(fake_connection)
+    return index
+
+
+def test_normalise_tokens_drops_stop_words_and_apostrophes():
+    """Tests that filler words are dropped and apostrophes do not split words"""
+    assert normalise_tokens("between King's Lynn and London") == {"kings", "lynn", "london"}
+
+
+def test_match_finds_subscribers_to_a_station_on_the_route():
+    """Tests that a station subscription matches a route passing through it"""
+    index = make_index([("+447700900001", "Reading"), ("+447700900002", "York")])
+
+    assert index.match(["between London Paddington and Reading"]) == {"+447700900001"}
+
+
+def test_match_needs_every_word_of_a_term():
+    """Tests that a term only matches a route containing all of its words"""
+    index = make_index([("+447700900001", "London Paddington"),
+                        ("+447700900002", "London Euston")])
+
+    assert index.match(["between London Paddington and Reading"]) == {"+447700900001"}
+
+
+def test_match_ignores_apostrophes():
+    """Tests that a term written without an apostrophe matches a route with one"""
+    index = make_index([("+447700900001", "Kings Lynn")])
+
+    assert index.match(["between Cambridge and King's Lynn"]) == {"+447700900001"}
+
+
+def test_match_checks_every_route():
+    """Tests that subscribers to any of the incident's routes are matched, once each"""
+    index = make_index([("+447700900001", "Reading"), ("+447700900002", "Heathrow"),
+                        ("+447700900001", "Paddington")])
+
+    assert index.match(["between Reading and London Paddington",
+                        "between Hayes & Harlington and Heathrow Terminal 5"]) == {
+                            "+447700900001", "+447700900002"}
+    assert index.stats()["subscriptions"] == 3
+
+
+def test_match_without_routes_finds_no_one():
+    """Tests that an incident with no routes matches no subscribers"""
+    index = make_index([("+447700900001", "Reading")])
+
+    assert index.match(None) == set()
+
+
+def test_normalise_phone_number_removes_spaces():
+    """Tests that a spaced E.164 number is accepted without its spaces"""
+    assert normalise_phone_number("+44 7700 900123") == "+447700900123"
+
+
+@pytest.mark.parametrize("phone_number", ["07700900123", "+0447700900123", "+4477009001234567",
+                                          "+44-7700-900123", ""])
+def test_normalise_phone_number_rejects_numbers_not_in_e164(phone_number):
+    """Tests that numbers without a country code or with other characters are refused"""
+    with pytest.raises(ValueError):
+        normalise_phone_number(phone_number)
+
+
+def test_add_subscription_does_not_insert_an_invalid_number():
+    """Tests that an invalid number is refused before anything is written"""
+    fake_connection = MagicMock()
+
+    with pytest.raises(ValueError):
+        add_subscription(fake_connection, "07700900123", "Reading")
+
+    fake_connection.cursor.assert_not_called()
+    fake_connection.commit.assert_not_called()
+
+
+def test_load_skips_numbers_not_in_e164():
+    """Tests that numbers added to the table some other way are checked when indexed"""
+    index = make_index([("+447700900001", "Reading"), ("07700900002", "Reading")])
+
+    assert index.match(["between London Paddington and Reading"]) == {"+447700900001"}
+    assert index.stats()["subscriptions"] == 1
@@ -0,0 +1,100 @@
+"""Work queue file: hands incoming frames from the STOMP listener to a pool of worker threads"""
+
+import logging
+import queue
+import threading
+import time
+from typing import Callable
+
+from metrics import timings
+
+
+class IncidentWorkQueue:
+    """
+    A bounded queue of incoming frames drained by a pool
+    of worker threads. When the queue is full, put blocks
+    the listener, pushing back on the broker rather than
+    buffering frames without limit
+    """
+
+    def __init__(self, process: Callable, workers: int = 4, max_size: int = 1000):
+        self.process = process
+        self.workers = workers
+        self.frames = queue.Queue(maxsize=max_size)
+        self.threads = []
+        self.lock = threading.Lock()
+        self.counts = {"enqueued": 0, "processed": 0, "failed": 0, "blocked_puts": 0}
+        self.max_depth = 0
+        self.blocked_secs = 0.0
+
+    def start(self) -> None:
+        """Starts the worker threads"""
+        for number in range(self.workers):
+            thread = threading.Thread(target=self.work, name=f"incident-worker-{number}",
+                                      daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def put(self, frame) -> None:
+        """
+        Adds a frame to the queue, blocking
+        while the queue is full
+        """
+        item = (time.perf_counter(), frame)
+        try:
+            self.frames.put_nowait(item)
+        except queue.Full:
+            logging.warning("Work queue full (%s frames) - blocking listener",
+                            self.frames.maxsize)
+            blocked_at = time.monotonic()
+            self.frames.put(item)
+            with self.lock:
+                self.counts["blocked_puts"] += 1
+                self.blocked_secs += time.monotonic() - blocked_at
+
+        with self.lock:
+            self.counts["enqueued"] += 1
+            self.max_depth = max(self.max_depth, self.frames.qsize())
+
+    def work(self) -> None:
+        """
+        Processes frames until a None
+        sentinel is taken from the queue
+        """
+        while True:
+            item = self.frames.get()
+            if item is None:
+                self.frames.task_done()
+                return
+            enqueued_at, frame = item
+            timings.record("queue_wait", time.perf_counter() - enqueued_at)
+            try:
+                self.process(frame)
+                outcome = "processed"
+            except Exception as e:
+                logging.error("Worker failed to process frame: %s", e)
+                outcome = "failed"
+            with self.lock:
+                self.counts[outcome] += 1
+            self.frames.task_done()
+
+    def stop(self) -> None:
+        """
+        Lets the workers finish the frames already
+        queued, then stops them
+        """
+        for _ in self.threads:
+            self.frames.put(None)
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+
+    def stats(self) -> dict:
+        """
+        Returns the current queue depth along with
+        the counters gathered since the queue started
+        """
+        with self.lock:
+            return {"depth": self.frames.qsize(), "max_depth": self.max_depth,
+                    "capacity": self.frames.maxsize, "blocked_secs": round(self.blocked_secs, 3),
+                    **self.counts}
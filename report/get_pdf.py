@@ -13,30 +13,6 @@ from altair.vegalite.v5.api import Chart
 from email.mime.multipart import MIMEMultipart
 from email.mime.application import MIMEApplication
 
-CSV_COLUMNS = [
-    "cancel_code_id",
-    "cancel_code",
-    "cancel_reason",
-    "cancel_abbreviation",
-    "company_id",
-    "company_name",
-    "origin_station_id",
-    "origin_station_name",
-    "destination_station_id",
-    "destination_station_name",
-    "service_type_id",
-    "service_type_name",
-    "service_details_id",
-    "service_uid",
-    "run_date",
-    "delay_details_id",
-    "arrival_lateness",
-    "scheduled_arrival",
-    "cancellation_id",
-    "cancelled_station_id",
-    "reached_station_id"
-]
-
 
 def get_db_connection() -> connection:
     """Establish a database connection."""
@@ -54,51 +30,47 @@ def get_db_connection() -> connection:
         return None
 
 
-def get_data_from_database(conn: connection) -> pd.DataFrame:
-    """Retrieve the tables for database and return as a data frame."""
-
-    yesterday = datetime.now() - timedelta(days=1)
-    yesterday_date = yesterday.strftime("%Y-%m-%d")
-
-    query = """
+SUMMARY_QUERIES = {
+    "station": """
     SET search_path TO service_data;
     SELECT
-        cc.cancel_code_id,
-        cc.code AS cancel_code,
-        cc.reason AS cancel_reason,
-        cc.abbreviation AS cancel_abbreviation,
-        c.company_id,
-        c.company_name,
-        s.station_id AS origin_station_id,
         s.station_name AS origin_station_name,
-        s2.station_id AS destination_station_id,
-        s2.station_name AS destination_station_name,
-        st.service_type_id,
-        st.service_type_name,
-        sd.service_details_id,
-        sd.service_uid,
-        sd.run_date,
-        dd.delay_details_id,
-        dd.arrival_lateness,
-        dd.scheduled_arrival,
-        cn.cancellation_id,
-        cn.cancelled_station_id,
-        cn.reached_station_id
-        FROM service_details sd
-        LEFT JOIN company c ON sd.company_id = c.company_id
-        LEFT JOIN service_type st ON sd.service_type_id = st.service_type_id
-        LEFT JOIN station s ON sd.origin_station_id = s.station_id
-        LEFT JOIN station s2 ON sd.destination_station_id = s2.station_id
-        LEFT JOIN delay_details dd ON sd.service_details_id = dd.service_details_id
-        LEFT JOIN cancellation cn ON sd.service_details_id = cn.service_details_id
-        LEFT JOIN cancel_code cc ON cn.cancel_code_id = cc.cancel_code_id
-        WHERE DATE(sd.run_date) = %s;
+        dss.total_services,
+        dss.delayed_services,
+        dss.total_lateness,
+        dss.total_lateness::FLOAT / NULLIF(dss.delayed_services, 0) AS arrival_lateness,
+        dss.cancellations AS cancellation_count
+        FROM daily_station_summary dss
+        JOIN station s ON dss.station_id = s.station_id
+        WHERE dss.run_day = %s;
+        """,
+    "company": """
+    SET search_path TO service_data;
+    SELECT
+        c.company_name,
+        dcs.total_services,
+        dcs.delayed_services,
+        dcs.total_lateness,
+        dcs.total_lateness::FLOAT / NULLIF(dcs.delayed_services, 0) AS arrival_lateness,
+        dcs.cancellations AS cancellation_count
+        FROM daily_company_summary dcs
+        JOIN company c ON dcs.company_id = c.company_id
+        WHERE dcs.run_day = %s;
         """
+}
+
+
+def get_daily_summary_from_database(conn: connection, summary: str) -> pd.DataFrame:
+    """Retrieve yesterday's station or company rollup maintained by the load step."""
+
+    yesterday = datetime.now() - timedelta(days=1)
+    yesterday_date = yesterday.strftime("%Y-%m-%d")
+
     with conn.cursor() as cur:
-        cur.execute(query, (yesterday_date,))
+        cur.execute(SUMMARY_QUERIES[summary], (yesterday_date,))
         data = cur.fetchall()
-    data_df = pd.DataFrame(data, columns=CSV_COLUMNS)
-    return data_df
+        columns = [column[0] for column in cur.description]
+    return pd.DataFrame(data, columns=columns)
 
 
 def clean_html_dataframes(data_frame: pd.DataFrame) -> str:
@@ -109,7 +81,8 @@ def clean_html_dataframes(data_frame: pd.DataFrame) -> str:
     return data_frame_html
 
 
-def export_to_html(data: pd.DataFrame, average_delays: pd.DataFrame, total_services: pd.DataFrame) -> str:
+def export_to_html(station_summary: pd.DataFrame, company_summary: pd.DataFrame,
+                   average_delays: pd.DataFrame, total_services: pd.DataFrame) -> str:
     """Create the HTML string and export to html file."""
 
     yesterday = datetime.now() - timedelta(days=1)
@@ -119,31 +92,24 @@ def export_to_html(data: pd.DataFrame, average_delays: pd.DataFrame, total_servi
 
     average_delays_html = clean_html_dataframes(average_delays)
 
-    company = data.groupby(
-        'company_name')['arrival_lateness'].sum().reset_index()
+    company = company_summary[['company_name', 'total_lateness']].rename(
+        columns={'total_lateness': 'arrival_lateness'})
     company_html = clean_html_dataframes(company)
 
-    cancellations = data.groupby('company_name')[
-        'cancel_code'].count().reset_index()
+    cancellations = company_summary[['company_name', 'cancellation_count']]
     cancellations = clean_html_dataframes(cancellations)
 
-    delays_station = data.groupby(
-        'origin_station_name')['arrival_lateness'].mean().reset_index()
+    delays_station = station_summary[['origin_station_name', 'arrival_lateness']]
     delays_station = clean_html_dataframes(delays_station)
 
-    cancellations_station = data.groupby(
-        'origin_station_name')['cancel_code'].count().reset_index()
+    cancellations_station = station_summary[['origin_station_name', 'cancellation_count']]
     cancellations_station = clean_html_dataframes(cancellations_station)
 
-    cancellations_per_station = data[data['cancellation_id'].notnull()].groupby(
-        'origin_station_name')['cancellation_id'].count().reset_index()
-    cancellations_per_station = cancellations_per_station.rename(
-        columns={'cancellation_id': 'cancellation_count'})
+    cancellations_per_station = station_summary[station_summary['cancellation_count'] > 0][
+        ['origin_station_name', 'cancellation_count']]
 
-    cancellations_per_company = data[data['cancellation_id'].notnull()].groupby(
-        'company_name')['cancellation_id'].count().reset_index()
-    cancellations_per_company = cancellations_per_company.rename(
-        columns={'cancellation_id': 'cancellation_count'})
+    cancellations_per_company = company_summary[company_summary['cancellation_count'] > 0][
+        ['company_name', 'cancellation_count']]
 
     cancellations_per_station = cancellations_per_station.sort_values(
         by='cancellation_count', ascending=False).head(20)
@@ -190,8 +156,7 @@ def export_to_html(data: pd.DataFrame, average_delays: pd.DataFrame, total_servi
         cancellations_per_company_img = base64.b64encode(
             cancellations_per_company_img_bytes).decode("utf-8")
 
-    avg_delays_station = data.groupby('origin_station_name')[
-        'arrival_lateness'].mean().reset_index()
+    avg_delays_station = station_summary[['origin_station_name', 'arrival_lateness']]
 
     avg_delays_station = avg_delays_station.sort_values(by='arrival_lateness',
                                                         ascending=False).head(20)
@@ -218,8 +183,7 @@ def export_to_html(data: pd.DataFrame, average_delays: pd.DataFrame, total_servi
         avg_delays_station_img = base64.b64encode(
             avg_delays_station_img_bytes).decode("utf-8")
 
-    average_delays_per_company = data.groupby('company_name')[
-        'arrival_lateness'].mean().reset_index()
+    average_delays_per_company = company_summary[['company_name', 'arrival_lateness']]
 
     average_delays_per_company = average_delays_per_company.sort_values(by='arrival_lateness',
                                                                         ascending=False).head(20)
@@ -246,6 +210,9 @@ def export_to_html(data: pd.DataFrame, average_delays: pd.DataFrame, total_servi
         avg_delays_company_img = base64.b64encode(
             avg_delays_company_img_bytes).decode("utf-8")
 
+    total_delays = station_summary["delayed_services"].sum()
+    average_delay = station_summary["total_lateness"].sum() / total_delays if total_delays else None
+
     html_content = f"""
     <!DOCTYPE html>
     <html>
@@ -302,10 +269,10 @@ def export_to_html(data: pd.DataFrame, average_delays: pd.DataFrame, total_servi
         <center>
         <h3>Key Statistics</h3>
         <table border="0.1">
-        <tr><td>Total Number Of Services</td><td>{data["service_uid"].count()}</td></tr>
-        <tr><td>Total Number Of Delays</td><td>{data["arrival_lateness"].count()}</td></tr>
-        <tr><td>Total Number Of Cancellations </td><td>{data["cancellation_id"].count()}</td></tr>
-        <tr><td>Average Delay (minutes)</td><td>{data["arrival_lateness"].mean()}</td></tr>
+        <tr><td>Total Number Of Services</td><td>{station_summary["total_services"].sum()}</td></tr>
+        <tr><td>Total Number Of Delays</td><td>{total_delays}</td></tr>
+        <tr><td>Total Number Of Cancellations </td><td>{station_summary["cancellation_count"].sum()}</td></tr>
+        <tr><td>Average Delay (minutes)</td><td>{average_delay}</td></tr>
         </table>
         <h3><center>Total Services Per Station</center></h3>
         <p> {total_services_html} </p>
@@ -342,25 +309,23 @@ def convert_html_to_pdf(source_html: str, output_filename: str) -> bool:
     return pisa_status.err
 
 
-def create_report(data: pd.DataFrame):
+def create_report(station_summary: pd.DataFrame, company_summary: pd.DataFrame):
     """
     Creates the pdf report in one function and 
     calls all functions required to do so
     """
     yesterday = datetime.now() - timedelta(days=1)
     yesterday_date = yesterday.strftime("%d-%m-%Y")
-    average = get_average_delays(data)
-    total_services = data.groupby(
-        'origin_station_name').size().reset_index(name='total_services')
-    html_data = export_to_html(data, average, total_services)
+    average = get_average_delays(company_summary)
+    total_services = station_summary[['origin_station_name', 'total_services']]
+    html_data = export_to_html(station_summary, company_summary, average, total_services)
 
     convert_html_to_pdf(html_data, f"daily_report_{yesterday_date}.pdf")
 
 
-def get_average_delays(data_df: pd.DataFrame) -> pd.DataFrame:
+def get_average_delays(company_summary: pd.DataFrame) -> pd.DataFrame:
     """Gets the average delays by company"""
-    average_delays = data_df.groupby('company_name')[
-        'arrival_lateness'].mean().reset_index()
+    average_delays = company_summary[['company_name', 'arrival_lateness']]
 
     average_delays = average_delays.sort_values(
         by='arrival_lateness', ascending=False).head(20)
@@ -411,8 +376,9 @@ def send_email(file_name):
 def main():
     load_dotenv()
     connection = get_db_connection()
-    data_df = get_data_from_database(connection)
-    create_report(data_df)
+    station_summary = get_daily_summary_from_database(connection, "station")
+    company_summary = get_daily_summary_from_database(connection, "company")
+    create_report(station_summary, company_summary)
     yesterday = datetime.now() - timedelta(days=1)
     yesterday_date = yesterday.strftime("%d-%m-%Y")
     upload_to_s3_bucket(f"daily_report_{yesterday_date}.pdf")
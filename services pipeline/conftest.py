@@ -149,3 +149,39 @@ def generated_df():
             "numbers": [12, -5, "cancelled at origin"],
             "crs": ["ABC", 0, "FUDGE"]}
     return pd.DataFrame(data)
+
+
+@fixture
+def transformed_services_df():
+    """
+    A fixture that returns a small dataframe in the
+    shape of the transformed service data
+    """
+    return pd.DataFrame({
+        "service_uid": ["P44650", "H38443"],
+        "company_name": ["Northern", "Great Northern"],
+        "service_type": ["train", "bus"],
+        "origin_crs": ["LDS", "KGX"],
+        "origin_stn_name": ["Leeds", "London Kings Cross"],
+        "planned_final_destination": ["Sheffield", "Cambridge"],
+        "planned_final_crs": ["SHF", "CBG"],
+        "destination_reached_crs": ["SHF", "KGX"],
+        "destination_reached_name": ["Sheffield", "London Kings Cross"],
+        "arrival_lateness": [4.0, None],
+        "cancellation_station_crs": [None, "KGX"],
+        "cancellation_station_name": [None, "London Kings Cross"],
+        "cancel_code": [None, "AA"],
+        "scheduled_arrival_datetime": ["2023-09-10 15:51:00", "2023-09-10 16:10:00"],
+        "origin_run_datetime": ["2023-09-10 14:32:00", "2023-09-10 15:00:00"]
+    })
+
+
+@fixture
+def dimension_cache():
+    """A fixture that returns a dimension cache for the transformed services"""
+    return {
+        "company": {"Northern": 1, "Great Northern": 2},
+        "station": {"LDS": 1, "SHF": 2, "KGX": 3, "CBG": 4},
+        "service_type": {"bus": 1, "train": 2},
+        "cancel_code": {"AA": 1}
+    }
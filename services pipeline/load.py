@@ -12,6 +12,7 @@ from dotenv import load_dotenv
 
 
 CODES_CSV = "cancel_codes.csv"
+REJECTS_CSV = "data/rejected_rows.csv"
 
 
 def get_connection(host: str, db_name: str, password: str, user: str):
@@ -47,19 +48,67 @@ def write_cancel_codes(conn: connection, codes_df: pd.DataFrame):
     conn.commit()
 
 
-def insert_company_data(conn: connection, data: pd.DataFrame) -> None:
-    """Inserts company data to the database"""
+DIMENSIONS = {
+    "company": ("company_name", "company_id", ("company_name",)),
+    "station": ("crs", "station_id", ("crs", "station_name")),
+    "service_type": ("service_type_name", "service_type_id", ("service_type_name",)),
+    "cancel_code": ("code", "cancel_code_id", ("code", "reason", "abbreviation"))
+}
 
-    company_names = data[['company_name']].values.tolist()
+PARTITIONED_TABLES = ("service_details", "delay_details", "cancellation")
+
+
+def get_dimension_cache(conn: connection) -> dict:
+    """
+    Loads the natural key to ID mapping of every
+    dimension table, so foreign keys can be
+    resolved in memory for the rest of the run
+    """
+    cache = {}
 
     with conn.cursor() as cur:
-        execute_values(cur, """INSERT INTO company (company_name) VALUES
-                        %s ON CONFLICT DO NOTHING;""", company_names)
-    conn.commit()
+        for table, (key_column, id_column, _) in DIMENSIONS.items():
+            cur.execute(f"SELECT {key_column}, {id_column} FROM {table};")
+            cache[table] = {row[key_column]: row[id_column]
+                            for row in cur.fetchall()}
+
+    return cache
+
+
+def upsert_dimension_members(conn: connection, cache: dict, table: str, members: list) -> None:
+    """
+    Inserts the members of a dimension table that
+    are not already in the cache in one statement,
+    and adds their returned IDs to the cache
+    """
+    key_column, id_column, columns = DIMENSIONS[table]
+
+    missing = {}
+    for member in members:
+        if member[0] not in cache[table]:
+            missing.setdefault(member[0], tuple(member))
+
+    if not missing:
+        return
+
+    with conn.cursor() as cur:
+        inserted = execute_values(cur, f"""INSERT INTO {table} ({", ".join(columns)}) VALUES %s
+                        ON CONFLICT ({key_column}) DO UPDATE SET {key_column} = EXCLUDED.{key_column}
+                        RETURNING {key_column}, {id_column};""", list(missing.values()), fetch=True)
+
+    cache[table].update({row[key_column]: row[id_column] for row in inserted})
+
+
+def insert_company_data(conn: connection, data: pd.DataFrame, cache: dict) -> None:
+    """Inserts any new companies into the database"""
+
+    company_names = data[['company_name']].values.tolist()
+
+    upsert_dimension_members(conn, cache, "company", company_names)
 
 
-def insert_station_data(conn: connection, data: pd.DataFrame) -> None:
-    """Inserts station data to the database"""
+def insert_station_data(conn: connection, data: pd.DataFrame, cache: dict) -> None:
+    """Inserts any new stations into the database"""
 
     col_sets = [['origin_crs', 'origin_stn_name'],
                 ['planned_final_crs', 'planned_final_destination'],
@@ -71,29 +120,148 @@ def insert_station_data(conn: connection, data: pd.DataFrame) -> None:
     stations = set([tuple(x) for x in np.concatenate(
         dfs).tolist() if not pd.isna(x[0])])
 
+    upsert_dimension_members(conn, cache, "station", stations)
+
+
+def insert_service_type_data(conn: connection, data: pd.DataFrame, cache: dict) -> None:
+    """Inserts any service types not seeded by the schema into the database"""
+
+    service_types = data[['service_type']].values.tolist()
+
+    upsert_dimension_members(conn, cache, "service_type", service_types)
+
+
+def reject_unresolved_rows(table: str, columns: tuple, rows: list, rejects: list) -> list:
+    """
+    Returns the rows whose foreign key IDs all resolved,
+    adding every other row to the rejects along with
+    the ID columns that could not be resolved
+    """
+    valid_rows = []
+
+    for row in rows:
+        unresolved = [column for column, value in zip(columns, row)
+                      if column.endswith("_id") and value is None]
+        if unresolved:
+            rejects.append({"table": table, "reason": f"unresolved {', '.join(unresolved)}",
+                            "row": row})
+        else:
+            valid_rows.append(row)
+
+    return valid_rows
+
+
+def execute_values_isolated(cur, table: str, query: str, rows: list, rejects: list,
+                            fetch: bool = False) -> list:
+    """
+    Sends the rows as one batch under a savepoint. If the batch
+    fails on bad data it is rolled back to the savepoint and split
+    in half until the failing rows are found and added to the
+    rejects, so the rest of the batch is still written in bulk.
+    Any other database error is raised, failing the whole load
+    """
+    if not rows:
+        return []
+
+    cur.execute("SAVEPOINT load_batch;")
+    try:
+        returned = execute_values(cur, query, rows, fetch=fetch)
+        cur.execute("RELEASE SAVEPOINT load_batch;")
+        return returned if fetch else []
+    except (psycopg2.DataError, psycopg2.IntegrityError) as e:
+        cur.execute("ROLLBACK TO SAVEPOINT load_batch;")
+        cur.execute("RELEASE SAVEPOINT load_batch;")
+        if len(rows) == 1:
+            rejects.append({"table": table, "reason": str(e).strip(), "row": rows[0]})
+            return []
+
+    middle = len(rows) // 2
+    return (execute_values_isolated(cur, table, query, rows[:middle], rejects, fetch)
+            + execute_values_isolated(cur, table, query, rows[middle:], rejects, fetch))
+
+
+def write_rejected_rows(rejects: list, csv_path: str = REJECTS_CSV) -> None:
+    """
+    Writes the rows rejected during a load to a CSV file for
+    inspection, removing the file left by an earlier load when
+    there are none, so it only ever describes the latest load
+    """
+
+    if rejects:
+        pd.DataFrame(rejects, columns=["table", "reason", "row"]).to_csv(csv_path, index=False)
+        print(f"{len(rejects)} rows rejected, see {csv_path}.")
+    elif os.path.exists(csv_path):
+        os.remove(csv_path)
+
+
+def none_if_missing(value):
+    """Returns None for a missing value such as NaN or NaT, so it is sent as NULL"""
+    return None if pd.isna(value) else value
+
+
+def service_key(service_uid: str, run_date) -> tuple:
+    """
+    Returns the natural key of a service, with the run
+    date normalised so that CSV strings and database
+    timestamps compare equal
+    """
+    return (service_uid, pd.Timestamp(run_date))
+
+
+def insert_service_details_data(conn: connection, data: pd.DataFrame, cache: dict,
+                                rejects: list) -> dict:
+    """
+    Inserts each service into the service details table with the
+    corresponding foreign key IDs, and returns a mapping of each
+    service key to its service_details_id
+    """
+
+    services = data.drop_duplicates(subset=["service_uid", "origin_run_datetime"])
+
+    details = [(service_uid, cache["company"].get(company_name),
+                cache["service_type"].get(service_type), cache["station"].get(origin_crs),
+                cache["station"].get(final_crs), run_date)
+               for service_uid, company_name, service_type, origin_crs, final_crs, run_date
+               in services[["service_uid", "company_name", "service_type", "origin_crs",
+                            "planned_final_crs", "origin_run_datetime"]].values.tolist()]
+    details = reject_unresolved_rows("service_details", ("service_uid", "company_id",
+                                     "service_type_id", "origin_station_id",
+                                     "destination_station_id", "run_date"), details, rejects)
+
     with conn.cursor() as cur:
-        execute_values(cur, """INSERT INTO station (crs, station_name) VALUES
-                        %s ON CONFLICT DO NOTHING;""", stations)
-    conn.commit()
+        inserted = execute_values_isolated(cur, "service_details", """INSERT INTO service_details
+                       (service_uid, company_id, service_type_id, origin_station_id,
+                       destination_station_id, run_date) VALUES %s
+                       ON CONFLICT (service_uid, run_date) DO UPDATE SET
+                       company_id = EXCLUDED.company_id, service_type_id = EXCLUDED.service_type_id,
+                       origin_station_id = EXCLUDED.origin_station_id,
+                       destination_station_id = EXCLUDED.destination_station_id
+                       RETURNING service_details_id, service_uid, run_date;""", details, rejects,
+                       fetch=True)
 
+    return {service_key(row["service_uid"], row["run_date"]): row["service_details_id"]
+            for row in inserted}
 
-def insert_service_details_data(conn: connection, data: pd.DataFrame) -> None:
-    """Inserts each service into the service details table with the corresponding
-    foreign key IDs"""
 
-    details = data[["service_uid", "company_name", "service_type", "origin_crs",
-                    "planned_final_crs", "origin_run_datetime"]].values.tolist()
+def create_month_partitions(conn: connection, data: pd.DataFrame) -> None:
+    """
+    Creates the monthly partitions of the service, delay
+    and cancellation tables for every month in the data
+    """
+    months = pd.to_datetime(data["origin_run_datetime"]).dt.to_period("M").unique()
 
     with conn.cursor() as cur:
-        cur.executemany("""INSERT INTO service_details (service_uid, company_id, service_type_id,
-                       origin_station_id, destination_station_id, run_date) VALUES (%s, (SELECT company_id
-                    FROM company WHERE company_name = %s), (SELECT service_type_id FROM service_type
-                       WHERE service_type_name = %s), (SELECT station_id FROM station WHERE crs = %s),
-                       (SELECT station_id FROM station WHERE crs = %s), %s) ON CONFLICT DO NOTHING;""", details)
-    conn.commit()
+        for month in sorted(months):
+            month_start = month.start_time.date()
+            month_end = (month + 1).start_time.date()
+            for table in PARTITIONED_TABLES:
+                cur.execute(f"""CREATE TABLE IF NOT EXISTS {table}_{month.strftime("%Y_%m")}
+                            PARTITION OF {table} FOR VALUES FROM (%s) TO (%s);""",
+                            (month_start, month_end))
 
 
-def insert_delay_details(conn: connection, data: pd.DataFrame) -> None:
+def insert_delay_details(conn: connection, data: pd.DataFrame, service_ids: dict,
+                         rejects: list) -> None:
     """
     Inserts all services where the arrival lateness
     is great that 0 into the delay details table
@@ -101,33 +269,220 @@ def insert_delay_details(conn: connection, data: pd.DataFrame) -> None:
 
     details = data[["service_uid", "origin_run_datetime", "arrival_lateness",
                     "scheduled_arrival_datetime"]]
-    delays = details[data["arrival_lateness"] > 0].values.tolist()
+    delays = [(service_ids.get(service_key(service_uid, run_date)), run_date,
+               none_if_missing(lateness), none_if_missing(scheduled_arrival))
+              for service_uid, run_date, lateness, scheduled_arrival
+              in details[data["arrival_lateness"] > 0].values.tolist()]
+    delays = reject_unresolved_rows("delay_details", ("service_details_id", "run_date",
+                                    "arrival_lateness", "scheduled_arrival"), delays, rejects)
 
     with conn.cursor() as cur:
-        cur.executemany("""INSERT INTO delay_details (service_details_id, arrival_lateness, scheduled_arrival)
-                        VALUES ((SELECT service_details_id FROM service_details WHERE service_uid = %s AND run_date = %s),
-                        %s, %s) ON CONFLICT DO NOTHING;""", delays)
-    conn.commit()
+        execute_values_isolated(cur, "delay_details", """INSERT INTO delay_details
+                       (service_details_id, run_date, arrival_lateness, scheduled_arrival) VALUES %s
+                       ON CONFLICT DO NOTHING;""", delays, rejects)
 
 
-def insert_cancellations(conn: connection, data: pd.DataFrame) -> None:
+def insert_cancellations(conn: connection, data: pd.DataFrame, cache: dict,
+                         service_ids: dict, rejects: list) -> None:
     """Inserts all cancellations into the database"""
 
     details = data[["service_uid", "origin_run_datetime", "cancellation_station_crs",
                    "destination_reached_crs", "cancel_code"]]
-    cancellations = details[data["cancel_code"].notna()].values.tolist()
+    cancellations = [(service_ids.get(service_key(service_uid, run_date)), run_date,
+                      cache["station"].get(cancelled_crs), cache["station"].get(reached_crs),
+                      cache["cancel_code"].get(code))
+                     for service_uid, run_date, cancelled_crs, reached_crs, code
+                     in details[data["cancel_code"].notna()].values.tolist()]
+    cancellations = reject_unresolved_rows("cancellation", ("service_details_id", "run_date",
+                                           "cancelled_station_id", "reached_station_id",
+                                           "cancel_code_id"), cancellations, rejects)
 
     with conn.cursor() as cur:
-        cur.executemany("""INSERT INTO cancellation (service_details_id, cancelled_station_id, reached_station_id, cancel_code_id)
-                        VALUES ((SELECT service_details_id FROM service_details WHERE service_uid = %s AND run_date = %s),
-                        (SELECT station_id FROM station WHERE crs = %s),
-                        (SELECT station_id FROM station WHERE crs = %s), (SELECT cancel_code_id FROM cancel_code WHERE code = %s))
-                        ON CONFLICT DO NOTHING""", cancellations)
-    conn.commit()
+        execute_values_isolated(cur, "cancellation", """INSERT INTO cancellation
+                       (service_details_id, run_date, cancelled_station_id, reached_station_id,
+                       cancel_code_id) VALUES %s ON CONFLICT DO NOTHING;""", cancellations, rejects)
+
 
+def refresh_daily_summaries(conn: connection, data: pd.DataFrame) -> None:
+    """
+    Rebuilds the station, company and cancel code rollups
+    for the days in the data from that day's rows alone,
+    leaving the rollups of every other day untouched
+    """
+    days = sorted(pd.to_datetime(data["origin_run_datetime"]).dt.date.unique())
+
+    loaded_days = """UNNEST(%(days)s::DATE[]) AS loaded(run_day)
+                  ON sd.run_date >= loaded.run_day
+                  AND sd.run_date < loaded.run_day + INTERVAL '1 day'"""
+    service_facts = f"""FROM service_details sd
+                    JOIN {loaded_days}
+                    JOIN service_type st ON sd.service_type_id = st.service_type_id
+                    LEFT JOIN delay_details dd ON sd.service_details_id = dd.service_details_id
+                        AND sd.run_date = dd.run_date
+                    LEFT JOIN cancellation cn ON sd.service_details_id = cn.service_details_id
+                        AND sd.run_date = cn.run_date"""
+    service_measures = """COUNT(*), COUNT(dd.delay_details_id),
+                       COALESCE(SUM(dd.arrival_lateness), 0), COUNT(cn.cancellation_id),
+                       COUNT(*) FILTER (WHERE st.service_type_name = 'bus')"""
 
-def run_load(conn):
-    """Runs the load script in this function so that it can be used in the pipeline file"""
+    with conn.cursor() as cur:
+        for table in ("daily_station_summary", "daily_company_summary",
+                      "daily_cancel_code_summary"):
+            cur.execute(f"DELETE FROM {table} WHERE run_day = ANY(%(days)s::DATE[]);",
+                        {"days": days})
+
+        cur.execute(f"""INSERT INTO daily_station_summary (run_day, station_id, total_services,
+                    delayed_services, total_lateness, cancellations, bus_replacements)
+                    SELECT loaded.run_day, sd.origin_station_id, {service_measures}
+                    {service_facts}
+                    GROUP BY loaded.run_day, sd.origin_station_id;""", {"days": days})
+        cur.execute(f"""INSERT INTO daily_company_summary (run_day, company_id, total_services,
+                    delayed_services, total_lateness, cancellations, bus_replacements)
+                    SELECT loaded.run_day, sd.company_id, {service_measures}
+                    {service_facts}
+                    GROUP BY loaded.run_day, sd.company_id;""", {"days": days})
+        cur.execute(f"""INSERT INTO daily_cancel_code_summary (run_day, company_id,
+                    cancel_code_id, cancellations)
+                    SELECT loaded.run_day, sd.company_id, cn.cancel_code_id, COUNT(*)
+                    FROM cancellation cn
+                    JOIN service_details sd ON sd.service_details_id = cn.service_details_id
+                        AND sd.run_date = cn.run_date
+                    JOIN {loaded_days}
+                    GROUP BY loaded.run_day, sd.company_id, cn.cancel_code_id;""",
+                    {"days": days})
+
+
+def load_day(conn: connection, data: pd.DataFrame) -> None:
+    """
+    Loads a day of services in a single transaction, so
+    that a failure part way through leaves nothing behind.
+    Rows that cannot be loaded are written to the rejects file
+    """
+    rejects = []
+    try:
+        cache = get_dimension_cache(conn)
+        insert_company_data(conn, data, cache)
+        insert_station_data(conn, data, cache)
+        insert_service_type_data(conn, data, cache)
+        create_month_partitions(conn, data)
+        service_ids = insert_service_details_data(conn, data, cache, rejects)
+        insert_delay_details(conn, data, service_ids, rejects)
+        insert_cancellations(conn, data, cache, service_ids, rejects)
+        refresh_daily_summaries(conn, data)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    write_rejected_rows(rejects)
+
+
+STAGING_COLUMNS = ("service_uid", "company_id", "service_type_id", "origin_station_id",
+                   "destination_station_id", "run_date", "arrival_lateness", "scheduled_arrival",
+                   "cancelled_station_id", "reached_station_id", "cancel_code", "cancel_code_id")
+
+
+def stage_services(conn: connection, data: pd.DataFrame, cache: dict, rejects: list) -> None:
+    """
+    Writes one row per service, with its delay and cancellation
+    details and resolved foreign keys, into a staging table that
+    is dropped when the transaction ends. Services with unresolved
+    keys are rejected, as are cancellations with unresolved keys
+    """
+
+    services = data.drop_duplicates(subset=["service_uid", "origin_run_datetime"])
+
+    staged = [(service_uid, cache["company"].get(company_name),
+               cache["service_type"].get(service_type), cache["station"].get(origin_crs),
+               cache["station"].get(final_crs), run_date,
+               none_if_missing(lateness), none_if_missing(scheduled_arrival),
+               cache["station"].get(cancelled_crs), cache["station"].get(reached_crs),
+               none_if_missing(code), cache["cancel_code"].get(code))
+              for service_uid, company_name, service_type, origin_crs, final_crs, run_date,
+              lateness, scheduled_arrival, cancelled_crs, reached_crs, code
+              in services[["service_uid", "company_name", "service_type", "origin_crs",
+                           "planned_final_crs", "origin_run_datetime", "arrival_lateness",
+                           "scheduled_arrival_datetime", "cancellation_station_crs",
+                           "destination_reached_crs", "cancel_code"]].values.tolist()]
+    staged = reject_unresolved_rows("service_details", STAGING_COLUMNS[:6], staged, rejects)
+
+    for index, row in enumerate(staged):
+        if row[10] is not None and None in (row[8], row[9], row[11]):
+            reject_unresolved_rows("cancellation", STAGING_COLUMNS, [row], rejects)
+            staged[index] = row[:10] + (None, None)
+
+    with conn.cursor() as cur:
+        cur.execute("""CREATE TEMPORARY TABLE service_staging (
+                    service_uid TEXT, company_id INT, service_type_id INT,
+                    origin_station_id INT, destination_station_id INT, run_date TIMESTAMP,
+                    arrival_lateness SMALLINT, scheduled_arrival TIMESTAMP,
+                    cancelled_station_id INT, reached_station_id INT,
+                    cancel_code TEXT, cancel_code_id INT) ON COMMIT DROP;""")
+        execute_values(cur, "INSERT INTO service_staging VALUES %s;", staged)
+
+
+def swap_staged_services(conn: connection) -> None:
+    """
+    Deletes every service, delay and cancellation on the days
+    present in the staging table, then inserts the staged rows
+    in their place
+    """
+    staged_days = """(SELECT DISTINCT DATE_TRUNC('day', run_date) AS run_day
+                     FROM service_staging) AS staged"""
+
+    with conn.cursor() as cur:
+        for table in reversed(PARTITIONED_TABLES):
+            cur.execute(f"""DELETE FROM {table} t USING {staged_days}
+                        WHERE t.run_date >= staged.run_day
+                        AND t.run_date < staged.run_day + INTERVAL '1 day';""")
+
+        cur.execute("""INSERT INTO service_details (service_uid, company_id, service_type_id,
+                    origin_station_id, destination_station_id, run_date)
+                    SELECT service_uid, company_id, service_type_id, origin_station_id,
+                    destination_station_id, run_date FROM service_staging;""")
+        cur.execute("""INSERT INTO delay_details (service_details_id, run_date,
+                    arrival_lateness, scheduled_arrival)
+                    SELECT sd.service_details_id, sd.run_date, st.arrival_lateness,
+                    st.scheduled_arrival
+                    FROM service_staging st JOIN service_details sd
+                    ON sd.service_uid = st.service_uid AND sd.run_date = st.run_date
+                    WHERE st.arrival_lateness > 0;""")
+        cur.execute("""INSERT INTO cancellation (service_details_id, run_date,
+                    cancelled_station_id, reached_station_id, cancel_code_id)
+                    SELECT sd.service_details_id, sd.run_date, st.cancelled_station_id,
+                    st.reached_station_id, st.cancel_code_id
+                    FROM service_staging st JOIN service_details sd
+                    ON sd.service_uid = st.service_uid AND sd.run_date = st.run_date
+                    WHERE st.cancel_code IS NOT NULL;""")
+
+
+def replace_day(conn: connection, data: pd.DataFrame) -> None:
+    """
+    Replaces every day covered by the data in a single
+    transaction, so re-runs and backfills overwrite stale
+    rows instead of skipping them
+    """
+    rejects = []
+    try:
+        cache = get_dimension_cache(conn)
+        insert_company_data(conn, data, cache)
+        insert_station_data(conn, data, cache)
+        insert_service_type_data(conn, data, cache)
+        create_month_partitions(conn, data)
+        stage_services(conn, data, cache, rejects)
+        swap_staged_services(conn)
+        refresh_daily_summaries(conn, data)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    write_rejected_rows(rejects)
+
+
+def run_load(conn, mode: str = "append"):
+    """
+    Runs the load script in this function so that it can be used in the pipeline file.
+    The "replace" mode overwrites the days in the data rather than appending to them
+    """
 
     print("Loading data into database.")
     start_time = time.time()
@@ -135,11 +490,10 @@ def run_load(conn):
     data = pd.read_csv("data/transformed_service_data.csv")
 
     switch_between_schemas(conn, "service_data")
-    insert_company_data(conn, data)
-    insert_station_data(conn, data)
-    insert_service_details_data(conn, data)
-    insert_delay_details(conn, data)
-    insert_cancellations(conn, data)
+    if mode == "replace":
+        replace_day(conn, data)
+    else:
+        load_day(conn, data)
 
     # os.remove("data/transformed_service_data.csv")
 
@@ -154,4 +508,4 @@ if __name__ == "__main__":  # pragma: no cover
     connection = get_connection(os.environ["DB_HOST"], os.environ["DB_NAME"],
                                 os.environ["DB_PASS"], os.environ["DB_USER"])
 
-    run_load(connection)
+    run_load(connection, os.environ.get("LOAD_MODE", "append"))
@@ -0,0 +1,109 @@
+-- Moves an existing unpartitioned service_data schema onto the partitioned
+-- tables defined in schema.sql. Runs in one transaction.
+
+\c loco_db;
+
+SET search_path TO service_data;
+
+BEGIN;
+
+ALTER TABLE cancellation RENAME TO cancellation_old;
+ALTER TABLE delay_details RENAME TO delay_details_old;
+ALTER TABLE service_details RENAME TO service_details_old;
+
+CREATE TABLE service_details (
+    service_details_id SERIAL,
+    service_uid TEXT NOT NULL,
+    company_id INT NOT NULL,
+    service_type_id INT NOT NULL,
+    origin_station_id INT NOT NULL,
+    destination_station_id INT NOT NULL,
+    run_date TIMESTAMP NOT NULL,
+    PRIMARY KEY (service_details_id, run_date),
+    FOREIGN KEY (company_id) REFERENCES company(company_id),
+    FOREIGN KEY (service_type_id) REFERENCES service_type(service_type_id),
+    FOREIGN KEY (origin_station_id) REFERENCES station(station_id),
+    FOREIGN KEY (destination_station_id) REFERENCES station(station_id),
+    UNIQUE (service_uid, run_date)
+) PARTITION BY RANGE (run_date);
+
+CREATE TABLE delay_details (
+    delay_details_id SERIAL,
+    service_details_id INT NOT NULL,
+    run_date TIMESTAMP NOT NULL,
+    arrival_lateness SMALLINT,
+    scheduled_arrival TIMESTAMP,
+    PRIMARY KEY (delay_details_id, run_date),
+    UNIQUE (service_details_id, run_date),
+    FOREIGN KEY (service_details_id, run_date) REFERENCES service_details(service_details_id, run_date)
+) PARTITION BY RANGE (run_date);
+
+CREATE TABLE cancellation (
+    cancellation_id SERIAL,
+    service_details_id INT NOT NULL,
+    run_date TIMESTAMP NOT NULL,
+    cancelled_station_id INT NOT NULL,
+    reached_station_id INT NOT NULL,
+    cancel_code_id INT NOT NULL,
+    PRIMARY KEY (cancellation_id, run_date),
+    UNIQUE (service_details_id, run_date),
+    FOREIGN KEY (service_details_id, run_date) REFERENCES service_details(service_details_id, run_date),
+    FOREIGN KEY (cancel_code_id) REFERENCES cancel_code(cancel_code_id),
+    FOREIGN KEY (cancelled_station_id) REFERENCES station(station_id),
+    FOREIGN KEY (reached_station_id) REFERENCES station(station_id)
+) PARTITION BY RANGE (run_date);
+
+DO $$
+DECLARE
+    month_start DATE;
+    table_name TEXT;
+BEGIN
+    FOR month_start IN
+        SELECT DISTINCT DATE_TRUNC('month', run_date)::DATE FROM service_details_old
+    LOOP
+        FOREACH table_name IN ARRAY ARRAY['service_details', 'delay_details', 'cancellation']
+        LOOP
+            EXECUTE FORMAT('CREATE TABLE IF NOT EXISTS %I PARTITION OF %I FOR VALUES FROM (%L) TO (%L);',
+                           table_name || '_' || TO_CHAR(month_start, 'YYYY_MM'), table_name,
+                           month_start, month_start + INTERVAL '1 month');
+        END LOOP;
+    END LOOP;
+END $$;
+
+INSERT INTO service_details (service_details_id, service_uid, company_id, service_type_id,
+                             origin_station_id, destination_station_id, run_date)
+SELECT service_details_id, service_uid, company_id, service_type_id,
+       origin_station_id, destination_station_id, run_date
+FROM service_details_old;
+
+INSERT INTO delay_details (delay_details_id, service_details_id, run_date,
+                           arrival_lateness, scheduled_arrival)
+SELECT dd.delay_details_id, dd.service_details_id, sd.run_date,
+       dd.arrival_lateness, dd.scheduled_arrival
+FROM delay_details_old dd
+JOIN service_details_old sd ON dd.service_details_id = sd.service_details_id;
+
+INSERT INTO cancellation (cancellation_id, service_details_id, run_date, cancelled_station_id,
+                          reached_station_id, cancel_code_id)
+SELECT cn.cancellation_id, cn.service_details_id, sd.run_date, cn.cancelled_station_id,
+       cn.reached_station_id, cn.cancel_code_id
+FROM cancellation_old cn
+JOIN service_details_old sd ON cn.service_details_id = sd.service_details_id;
+
+SELECT SETVAL(PG_GET_SERIAL_SEQUENCE('service_details', 'service_details_id'),
+              COALESCE((SELECT MAX(service_details_id) FROM service_details), 0) + 1, FALSE);
+SELECT SETVAL(PG_GET_SERIAL_SEQUENCE('delay_details', 'delay_details_id'),
+              COALESCE((SELECT MAX(delay_details_id) FROM delay_details), 0) + 1, FALSE);
+SELECT SETVAL(PG_GET_SERIAL_SEQUENCE('cancellation', 'cancellation_id'),
+              COALESCE((SELECT MAX(cancellation_id) FROM cancellation), 0) + 1, FALSE);
+
+DROP TABLE cancellation_old;
+DROP TABLE delay_details_old;
+DROP TABLE service_details_old;
+
+CREATE INDEX IF NOT EXISTS service_details_run_date_idx ON service_details (run_date);
+CREATE INDEX IF NOT EXISTS service_details_origin_station_idx ON service_details (origin_station_id, run_date);
+CREATE INDEX IF NOT EXISTS service_details_company_idx ON service_details (company_id, run_date);
+CREATE INDEX IF NOT EXISTS cancellation_cancel_code_idx ON cancellation (cancel_code_id, run_date);
+
+COMMIT;
@@ -38,4 +38,4 @@ if __name__ == "__main__":
 
     conn = get_connection(os.environ["DB_HOST"], os.environ["DB_NAME"],
                           os.environ["DB_PASS"], os.environ["DB_USER"])
-    run_load(conn)
+    run_load(conn, os.environ.get("LOAD_MODE", "append"))
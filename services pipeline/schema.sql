@@ -35,41 +35,87 @@ CREATE TABLE IF NOT EXISTS service_type (
 );
 
 CREATE TABLE IF NOT EXISTS service_details (
-    service_details_id INT GENERATED ALWAYS AS IDENTITY,
+    service_details_id SERIAL,
     service_uid TEXT NOT NULL,
     company_id INT NOT NULL,
     service_type_id INT NOT NULL,
     origin_station_id INT NOT NULL,
     destination_station_id INT NOT NULL,
     run_date TIMESTAMP NOT NULL,
-    PRIMARY KEY (service_details_id),
+    PRIMARY KEY (service_details_id, run_date),
     FOREIGN KEY (company_id) REFERENCES company(company_id),
     FOREIGN KEY (service_type_id) REFERENCES service_type(service_type_id),
     FOREIGN KEY (origin_station_id) REFERENCES station(station_id),
     FOREIGN KEY (destination_station_id) REFERENCES station(station_id),
-    UNIQUE (service_uid, run_data)
-);
+    UNIQUE (service_uid, run_date)
+) PARTITION BY RANGE (run_date);
 
 CREATE TABLE IF NOT EXISTS delay_details (
-    delay_details_id INT GENERATED ALWAYS AS IDENTITY,
-    service_details_id INT NOT NULL UNIQUE,
+    delay_details_id SERIAL,
+    service_details_id INT NOT NULL,
+    run_date TIMESTAMP NOT NULL,
     arrival_lateness SMALLINT,
     scheduled_arrival TIMESTAMP,
-    PRIMARY KEY (delay_details_id),
-    FOREIGN KEY(service_details_id) REFERENCES service_details(service_details_id)
-);
+    PRIMARY KEY (delay_details_id, run_date),
+    UNIQUE (service_details_id, run_date),
+    FOREIGN KEY (service_details_id, run_date) REFERENCES service_details(service_details_id, run_date)
+) PARTITION BY RANGE (run_date);
 
 CREATE TABLE IF NOT EXISTS cancellation (
-    cancellation_id INT GENERATED ALWAYS AS IDENTITY,
-    service_details_id INT NOT NULL UNIQUE,
+    cancellation_id SERIAL,
+    service_details_id INT NOT NULL,
+    run_date TIMESTAMP NOT NULL,
     cancelled_station_id INT NOT NULL,
     reached_station_id INT NOT NULL,
     cancel_code_id INT NOT NULL,
-    PRIMARY KEY (cancellation_id),
-    FOREIGN KEY (service_details_id) REFERENCES service_details(service_details_id),
+    PRIMARY KEY (cancellation_id, run_date),
+    UNIQUE (service_details_id, run_date),
+    FOREIGN KEY (service_details_id, run_date) REFERENCES service_details(service_details_id, run_date),
     FOREIGN KEY (cancel_code_id) REFERENCES cancel_code(cancel_code_id),
     FOREIGN KEY (cancelled_station_id) REFERENCES station(station_id),
-    FOREIGN KEY (reached_station_id) REFERENCES station(station_id)   
+    FOREIGN KEY (reached_station_id) REFERENCES station(station_id)
+) PARTITION BY RANGE (run_date);
+
+-- Monthly partitions are created by the load step before each day is written.
+-- Day queries from the dashboard and report filter on a run_date range, which
+-- prunes to one partition and is served by these indexes.
+CREATE INDEX IF NOT EXISTS service_details_run_date_idx ON service_details (run_date);
+CREATE INDEX IF NOT EXISTS service_details_origin_station_idx ON service_details (origin_station_id, run_date);
+CREATE INDEX IF NOT EXISTS service_details_company_idx ON service_details (company_id, run_date);
+CREATE INDEX IF NOT EXISTS cancellation_cancel_code_idx ON cancellation (cancel_code_id, run_date);
+
+CREATE TABLE IF NOT EXISTS daily_station_summary (
+    run_day DATE NOT NULL,
+    station_id INT NOT NULL,
+    total_services INT NOT NULL,
+    delayed_services INT NOT NULL,
+    total_lateness INT NOT NULL,
+    cancellations INT NOT NULL,
+    bus_replacements INT NOT NULL,
+    PRIMARY KEY (run_day, station_id),
+    FOREIGN KEY (station_id) REFERENCES station(station_id)
+);
+
+CREATE TABLE IF NOT EXISTS daily_company_summary (
+    run_day DATE NOT NULL,
+    company_id INT NOT NULL,
+    total_services INT NOT NULL,
+    delayed_services INT NOT NULL,
+    total_lateness INT NOT NULL,
+    cancellations INT NOT NULL,
+    bus_replacements INT NOT NULL,
+    PRIMARY KEY (run_day, company_id),
+    FOREIGN KEY (company_id) REFERENCES company(company_id)
+);
+
+CREATE TABLE IF NOT EXISTS daily_cancel_code_summary (
+    run_day DATE NOT NULL,
+    company_id INT NOT NULL,
+    cancel_code_id INT NOT NULL,
+    cancellations INT NOT NULL,
+    PRIMARY KEY (run_day, company_id, cancel_code_id),
+    FOREIGN KEY (company_id) REFERENCES company(company_id),
+    FOREIGN KEY (cancel_code_id) REFERENCES cancel_code(cancel_code_id)
 );
 
 INSERT INTO service_type (service_type_name)
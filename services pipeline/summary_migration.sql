@@ -0,0 +1,82 @@
+-- Adds the daily rollup tables defined in schema.sql to an existing service_data
+-- schema and fills them from the service history. Runs in one transaction, and
+-- can be re-run to rebuild every day's rollups.
+
+\c loco_db;
+
+SET search_path TO service_data;
+
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS daily_station_summary (
+    run_day DATE NOT NULL,
+    station_id INT NOT NULL,
+    total_services INT NOT NULL,
+    delayed_services INT NOT NULL,
+    total_lateness INT NOT NULL,
+    cancellations INT NOT NULL,
+    bus_replacements INT NOT NULL,
+    PRIMARY KEY (run_day, station_id),
+    FOREIGN KEY (station_id) REFERENCES station(station_id)
+);
+
+CREATE TABLE IF NOT EXISTS daily_company_summary (
+    run_day DATE NOT NULL,
+    company_id INT NOT NULL,
+    total_services INT NOT NULL,
+    delayed_services INT NOT NULL,
+    total_lateness INT NOT NULL,
+    cancellations INT NOT NULL,
+    bus_replacements INT NOT NULL,
+    PRIMARY KEY (run_day, company_id),
+    FOREIGN KEY (company_id) REFERENCES company(company_id)
+);
+
+CREATE TABLE IF NOT EXISTS daily_cancel_code_summary (
+    run_day DATE NOT NULL,
+    company_id INT NOT NULL,
+    cancel_code_id INT NOT NULL,
+    cancellations INT NOT NULL,
+    PRIMARY KEY (run_day, company_id, cancel_code_id),
+    FOREIGN KEY (company_id) REFERENCES company(company_id),
+    FOREIGN KEY (cancel_code_id) REFERENCES cancel_code(cancel_code_id)
+);
+
+DELETE FROM daily_station_summary;
+DELETE FROM daily_company_summary;
+DELETE FROM daily_cancel_code_summary;
+
+INSERT INTO daily_station_summary (run_day, station_id, total_services, delayed_services,
+                                   total_lateness, cancellations, bus_replacements)
+SELECT sd.run_date::DATE, sd.origin_station_id, COUNT(*), COUNT(dd.delay_details_id),
+       COALESCE(SUM(dd.arrival_lateness), 0), COUNT(cn.cancellation_id),
+       COUNT(*) FILTER (WHERE st.service_type_name = 'bus')
+FROM service_details sd
+JOIN service_type st ON sd.service_type_id = st.service_type_id
+LEFT JOIN delay_details dd ON sd.service_details_id = dd.service_details_id
+    AND sd.run_date = dd.run_date
+LEFT JOIN cancellation cn ON sd.service_details_id = cn.service_details_id
+    AND sd.run_date = cn.run_date
+GROUP BY sd.run_date::DATE, sd.origin_station_id;
+
+INSERT INTO daily_company_summary (run_day, company_id, total_services, delayed_services,
+                                   total_lateness, cancellations, bus_replacements)
+SELECT sd.run_date::DATE, sd.company_id, COUNT(*), COUNT(dd.delay_details_id),
+       COALESCE(SUM(dd.arrival_lateness), 0), COUNT(cn.cancellation_id),
+       COUNT(*) FILTER (WHERE st.service_type_name = 'bus')
+FROM service_details sd
+JOIN service_type st ON sd.service_type_id = st.service_type_id
+LEFT JOIN delay_details dd ON sd.service_details_id = dd.service_details_id
+    AND sd.run_date = dd.run_date
+LEFT JOIN cancellation cn ON sd.service_details_id = cn.service_details_id
+    AND sd.run_date = cn.run_date
+GROUP BY sd.run_date::DATE, sd.company_id;
+
+INSERT INTO daily_cancel_code_summary (run_day, company_id, cancel_code_id, cancellations)
+SELECT sd.run_date::DATE, sd.company_id, cn.cancel_code_id, COUNT(*)
+FROM cancellation cn
+JOIN service_details sd ON sd.service_details_id = cn.service_details_id
+    AND sd.run_date = cn.run_date
+GROUP BY sd.run_date::DATE, sd.company_id, cn.cancel_code_id;
+
+COMMIT;
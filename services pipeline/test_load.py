@@ -1,5 +1,12 @@
 from unittest.mock import patch, MagicMock
-from load import write_cancel_codes
+import pandas as pd
+import psycopg2
+import pytest
+from load import (write_cancel_codes, get_dimension_cache, upsert_dimension_members,
+                  service_key, insert_service_details_data, insert_delay_details,
+                  insert_cancellations, load_day, stage_services, replace_day,
+                  create_month_partitions, refresh_daily_summaries,
+                  reject_unresolved_rows, execute_values_isolated, write_rejected_rows)
 
 
 def test_write_cancel_codes():
@@ -9,3 +16,298 @@ def test_write_cancel_codes():
     fake_execute = fake_connection.cursor().execute
 
     write_cancel_codes(fake_connection, ['a', 'b', 'c'])
+
+
+def test_get_dimension_cache_maps_keys_to_ids():
+    """Tests that each dimension table is loaded into a key to ID mapping"""
+    fake_connection = MagicMock()
+    fake_cursor = fake_connection.cursor().__enter__()
+    fake_cursor.fetchall.side_effect = [
+        [{"company_name": "Northern", "company_id": 1}],
+        [{"crs": "LDS", "station_id": 5}],
+        [{"service_type_name": "bus", "service_type_id": 1}],
+        [{"code": "AA", "cancel_code_id": 3}]
+    ]
+
+    cache = get_dimension_cache(fake_connection)
+
+    assert cache == {"company": {"Northern": 1}, "station": {"LDS": 5},
+                     "service_type": {"bus": 1}, "cancel_code": {"AA": 3}}
+
+
+@patch("load.execute_values")
+def test_upsert_dimension_members_only_inserts_missing(mock_execute_values, dimension_cache):
+    """Tests that only members missing from the cache are sent, and their IDs cached"""
+    mock_execute_values.return_value = [{"crs": "YRK", "station_id": 9}]
+
+    upsert_dimension_members(MagicMock(), dimension_cache, "station",
+                             [("LDS", "Leeds"), ("YRK", "York"), ("YRK", "York")])
+
+    assert mock_execute_values.call_args[0][2] == [("YRK", "York")]
+    assert dimension_cache["station"]["YRK"] == 9
+
+
+@patch("load.execute_values")
+def test_upsert_dimension_members_skips_when_all_cached(mock_execute_values, dimension_cache):
+    """Tests that no statement is sent when every member is already cached"""
+    upsert_dimension_members(MagicMock(), dimension_cache, "company", [["Northern"]])
+
+    mock_execute_values.assert_not_called()
+
+
+def test_service_key_matches_strings_and_timestamps():
+    """Tests that CSV run dates and database timestamps give the same key"""
+    assert service_key("P44650", "2023-09-10 14:32:00") == service_key(
+        "P44650", pd.Timestamp("2023-09-10 14:32:00").to_pydatetime())
+
+
+@patch("load.execute_values")
+def test_insert_service_details_returns_service_ids(mock_execute_values,
+                                                   transformed_services_df, dimension_cache):
+    """
+    Tests that service details are sent with foreign keys already
+    resolved, and the returned IDs are mapped by service key
+    """
+    mock_execute_values.return_value = [
+        {"service_details_id": 7, "service_uid": "P44650",
+         "run_date": pd.Timestamp("2023-09-10 14:32:00").to_pydatetime()}]
+
+    service_ids = insert_service_details_data(MagicMock(), transformed_services_df,
+                                              dimension_cache, [])
+
+    details = mock_execute_values.call_args[0][2]
+    assert details[0] == ("P44650", 1, 2, 1, 2, "2023-09-10 14:32:00")
+    assert "SELECT" not in mock_execute_values.call_args[0][1]
+    assert service_ids == {service_key("P44650", "2023-09-10 14:32:00"): 7}
+
+
+@patch("load.execute_values")
+def test_insert_delay_details_uses_returned_service_ids(mock_execute_values,
+                                                       transformed_services_df):
+    """Tests that delays are mapped to service IDs without a lookup query"""
+    service_ids = {service_key("P44650", "2023-09-10 14:32:00"): 7}
+
+    insert_delay_details(MagicMock(), transformed_services_df, service_ids, [])
+
+    assert mock_execute_values.call_args[0][2] == [
+        (7, "2023-09-10 14:32:00", 4.0, "2023-09-10 15:51:00")]
+
+
+@patch("load.execute_values")
+def test_insert_cancellations_only_sends_cancelled_services(mock_execute_values,
+                                                           transformed_services_df,
+                                                           dimension_cache):
+    """Tests that only services with a cancel code are inserted as cancellations"""
+    service_ids = {service_key("H38443", "2023-09-10 15:00:00"): 8}
+
+    insert_cancellations(MagicMock(), transformed_services_df, dimension_cache, service_ids, [])
+
+    cancellations = mock_execute_values.call_args[0][2]
+    assert cancellations == [(8, "2023-09-10 15:00:00", 3, 3, 1)]
+
+
+@patch("load.write_rejected_rows")
+@patch("load.get_dimension_cache")
+@patch("load.execute_values")
+def test_load_day_commits_once(mock_execute_values, mock_get_cache, mock_write_rejects,
+                               transformed_services_df, dimension_cache):
+    """Tests that a whole day is committed in a single transaction"""
+    mock_get_cache.return_value = dimension_cache
+    mock_execute_values.return_value = []
+    fake_connection = MagicMock()
+
+    load_day(fake_connection, transformed_services_df)
+
+    fake_connection.commit.assert_called_once()
+    fake_connection.rollback.assert_not_called()
+
+
+@patch("load.write_rejected_rows")
+@patch("load.get_dimension_cache")
+@patch("load.execute_values")
+def test_load_day_sends_missing_scheduled_arrival_as_null(mock_execute_values, mock_get_cache,
+                                                          mock_write_rejects,
+                                                          transformed_services_df,
+                                                          dimension_cache):
+    """Tests that a delay without a scheduled arrival is appended with NULL, not NaN"""
+    mock_get_cache.return_value = dimension_cache
+    transformed_services_df.loc[0, "scheduled_arrival_datetime"] = float("nan")
+
+    def return_service_ids(cur, query, rows, fetch=False):
+        if "INTO service_details" in query:
+            return [{"service_details_id": 7, "service_uid": "P44650",
+                     "run_date": "2023-09-10 14:32:00"}]
+        return []
+
+    mock_execute_values.side_effect = return_service_ids
+
+    load_day(MagicMock(), transformed_services_df)
+
+    delays = [call[0][2] for call in mock_execute_values.call_args_list
+              if "INTO delay_details" in call[0][1]]
+    assert delays == [[(7, "2023-09-10 14:32:00", 4.0, None)]]
+    assert not [reject for reject in mock_write_rejects.call_args[0][0]
+                if reject["table"] == "delay_details"]
+
+
+@patch("load.get_dimension_cache")
+@patch("load.execute_values")
+def test_load_day_rolls_back_on_failure(mock_execute_values, mock_get_cache,
+                                        transformed_services_df, dimension_cache):
+    """Tests that nothing is committed when one of the inserts fails"""
+    mock_get_cache.return_value = dimension_cache
+    mock_execute_values.side_effect = Exception("insert failed")
+    fake_connection = MagicMock()
+
+    with pytest.raises(Exception):
+        load_day(fake_connection, transformed_services_df)
+
+    fake_connection.commit.assert_not_called()
+    fake_connection.rollback.assert_called_once()
+
+
+@patch("load.execute_values")
+def test_stage_services_sends_one_row_per_service(mock_execute_values,
+                                                  transformed_services_df, dimension_cache):
+    """Tests that each service is staged once, with missing values sent as NULL"""
+    duplicated_df = pd.concat([transformed_services_df, transformed_services_df])
+
+    stage_services(MagicMock(), duplicated_df, dimension_cache, [])
+
+    staged = mock_execute_values.call_args[0][2]
+    assert len(staged) == 2
+    assert staged[1] == ("H38443", 2, 1, 3, 4, "2023-09-10 15:00:00", None,
+                         "2023-09-10 16:10:00", 3, 3, "AA", 1)
+
+
+@patch("load.execute_values")
+def test_stage_services_sends_missing_scheduled_arrival_as_null(mock_execute_values,
+                                                               transformed_services_df,
+                                                               dimension_cache):
+    """Tests that a service without a scheduled arrival is staged with NULL, not NaN"""
+    transformed_services_df.loc[1, "scheduled_arrival_datetime"] = float("nan")
+
+    stage_services(MagicMock(), transformed_services_df, dimension_cache, [])
+
+    staged = mock_execute_values.call_args[0][2]
+    assert staged[1][7] is None
+
+
+@patch("load.get_dimension_cache")
+@patch("load.execute_values")
+def test_replace_day_swaps_in_one_transaction(mock_execute_values, mock_get_cache,
+                                              transformed_services_df, dimension_cache):
+    """Tests that the delete and re-insert of a day are committed together"""
+    mock_get_cache.return_value = dimension_cache
+    fake_connection = MagicMock()
+    fake_execute = fake_connection.cursor().__enter__().execute
+
+    replace_day(fake_connection, transformed_services_df)
+
+    statements = [call[0][0] for call in fake_execute.call_args_list]
+    assert any(statement.startswith("DELETE FROM service_details") for statement in statements)
+    fake_connection.commit.assert_called_once()
+
+
+def test_create_month_partitions_creates_each_table_once_per_month(transformed_services_df):
+    """Tests that a partition of each fact table is created for every month loaded"""
+    transformed_services_df.loc[1, "origin_run_datetime"] = "2023-10-01 00:10:00"
+    fake_connection = MagicMock()
+    fake_execute = fake_connection.cursor().__enter__().execute
+
+    create_month_partitions(fake_connection, transformed_services_df)
+
+    statements = [call[0][0].split()[5] for call in fake_execute.call_args_list]
+    assert statements == ["service_details_2023_09", "delay_details_2023_09",
+                          "cancellation_2023_09", "service_details_2023_10",
+                          "delay_details_2023_10", "cancellation_2023_10"]
+    assert fake_execute.call_args_list[0][0][1][1].isoformat() == "2023-10-01"
+
+
+def test_refresh_daily_summaries_only_rebuilds_loaded_days(transformed_services_df):
+    """Tests that each rollup is cleared and rebuilt for the loaded days alone"""
+    fake_connection = MagicMock()
+    fake_execute = fake_connection.cursor().__enter__().execute
+
+    refresh_daily_summaries(fake_connection, transformed_services_df)
+
+    statements = [call[0][0] for call in fake_execute.call_args_list]
+    parameters = [call[0][1] for call in fake_execute.call_args_list]
+    assert [statement.split()[2] for statement in statements] == [
+        "daily_station_summary", "daily_company_summary", "daily_cancel_code_summary",
+        "daily_station_summary", "daily_company_summary", "daily_cancel_code_summary"]
+    assert all([day.isoformat() for day in parameter["days"]] == ["2023-09-10"]
+               for parameter in parameters)
+
+
+def test_reject_unresolved_rows_keeps_only_resolved_rows():
+    """Tests that rows with a missing foreign key ID are rejected with the column named"""
+    rejects = []
+    rows = [(1, "2023-09-10", 3), (None, "2023-09-10", None)]
+
+    valid_rows = reject_unresolved_rows("cancellation", ("service_details_id", "run_date",
+                                        "cancel_code_id"), rows, rejects)
+
+    assert valid_rows == [(1, "2023-09-10", 3)]
+    assert rejects == [{"table": "cancellation",
+                        "reason": "unresolved service_details_id, cancel_code_id",
+                        "row": (None, "2023-09-10", None)}]
+
+
+@patch("load.execute_values")
+def test_execute_values_isolated_bisects_to_the_failing_row(mock_execute_values):
+    """Tests that a failing batch is split until only the bad row is rejected"""
+    def fail_on_bad_row(cur, query, rows, fetch):
+        if "bad" in rows:
+            raise psycopg2.IntegrityError("null value violates not-null constraint")
+        return [{"row": row} for row in rows]
+
+    mock_execute_values.side_effect = fail_on_bad_row
+    rejects = []
+
+    returned = execute_values_isolated(MagicMock(), "delay_details", "INSERT",
+                                       ["a", "b", "bad", "c"], rejects, fetch=True)
+
+    assert returned == [{"row": "a"}, {"row": "b"}, {"row": "c"}]
+    assert rejects == [{"table": "delay_details",
+                        "reason": "null value violates not-null constraint", "row": "bad"}]
+
+
+@patch("load.execute_values")
+def test_execute_values_isolated_raises_errors_not_caused_by_rows(mock_execute_values):
+    """Tests that a failure unrelated to the data is raised rather than bisected"""
+    mock_execute_values.side_effect = psycopg2.OperationalError("server closed the connection")
+    rejects = []
+
+    with pytest.raises(psycopg2.OperationalError):
+        execute_values_isolated(MagicMock(), "delay_details", "INSERT", ["a", "b"], rejects)
+
+    assert mock_execute_values.call_count == 1
+    assert rejects == []
+
+
+@patch("load.execute_values")
+def test_insert_cancellations_rejects_unknown_cancel_codes(mock_execute_values,
+                                                          transformed_services_df,
+                                                          dimension_cache):
+    """Tests that a cancellation with an unknown cancel code is rejected, not sent"""
+    service_ids = {service_key("H38443", "2023-09-10 15:00:00"): 8}
+    dimension_cache["cancel_code"] = {}
+    rejects = []
+
+    insert_cancellations(MagicMock(), transformed_services_df, dimension_cache,
+                         service_ids, rejects)
+
+    mock_execute_values.assert_not_called()
+    assert rejects[0]["reason"] == "unresolved cancel_code_id"
+
+
+def test_write_rejected_rows_removes_stale_file_on_a_clean_load(tmp_path):
+    """Tests that a load without rejects leaves no rejects file from an earlier load"""
+    csv_path = tmp_path / "rejected_rows.csv"
+    write_rejected_rows([{"table": "delay_details", "reason": "bad", "row": (1,)}], csv_path)
+    assert csv_path.exists()
+
+    write_rejected_rows([], csv_path)
+
+    assert not csv_path.exists()